@@ -1,28 +1,28 @@
 #!/usr/bin/env python3
 
-# Конвертурует вывод данной программы в типичный CoNLL 
-# формат с двумя столбцами - буквой и частью слова
+# Конвертурует вывод данной программы в типичный CoNLL
+# формат с двумя столбцами - буквой и частью слова.
+# Теперь это лишь обёртка над `python3 -m roots.main conll`,
+# запускаемая из любого каталога без установки пакета.
 
 # Converts segmentations from main programm format to
-# standart CoNLL with two columns - letter and part type
+# standart CoNLL with two columns - letter and part type.
+# Now it is only wrapper around `python3 -m roots.main conll`
+# runnable from any directory without package installation.
 
+import os
 import sys
+import importlib
 
-def transform(f, of):
-    for line in f:
-        line = line.strip().split()
-        for part in line:
-            part_type, part = part.split('_')
-            # Why we have to have such check at all?
-            if part == '': continue
+# package lies in roots directory but imports itself as rwe; done at module
+# level so that worker processes re-importing this script get it too
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.modules.setdefault('rwe', importlib.import_module('roots'))
 
-            print(part[0], ' ', part_type, '_начало', sep='', file=of)
-            for letter in part[1:]:
-                print(letter, part_type, file=of)
+import rwe.parallel
+import rwe.segmentations.conll
 
-        print(file=of)
-
-for filename in sys.argv[1:]:
-    with open(filename, 'r') as f: 
-        with open(filename + '.conll', 'w') as of:
-            transform(f, of)
+if __name__ == '__main__':
+    executor = rwe.parallel.create_executor('process')
+    rwe.segmentations.conll.convert_files(sys.argv[1:], executor)
+    executor.shutdown()
@@ -0,0 +1,547 @@
+"""
+Измерение производительности извлечения на синтетическом дампе. Генератор
+детерминированно (по `seed`) создаёт дамп в формате экспорта MediaWiki с
+русскими страницами ({{-ru-}}, {{морфо}}, {{сущ ru ...}}), шаблонами таблиц
+и шумом (другие языки, страницы без {{морфо}} или таблицы, странные
+символы, неизвестные шаблоны), а также соответствующие файлы .table.
+Каждый этап запускается в отдельном процессе, так что пиковая память
+(RSS) измеряется для этапа; результаты сохраняются в JSON и могут
+сравниваться с предыдущими без доступа к сети.
+
+Этапы:
+    pages      - чтение дампа (`pages.extract`), страниц в секунду;
+    metas      - извлечение мета-информации (`meta.extract_meta_segmentations`);
+    tables     - компиляция и создание шаблонов таблиц
+                 (`tables.load_segmentation_table_templates`), шаблонов в секунду;
+    segment    - разбиение форм по готовой мета-информации (`annotated.main`),
+                 форм в секунду;
+    end-to-end - всё извлечение из дампа (`annotated.main`).
+
+Extraction performance measurement on synthetic dump. Generator
+deterministically (by `seed`) creates MediaWiki export dump with russian
+pages ({{-ru-}}, {{морфо}}, {{сущ ru ...}}), tables' templates and noise
+(other languages, pages without {{морфо}} or table, strange symbols, unknown
+templates), and corresponding .table files. Every stage is run in separate
+process, so peak memory (RSS) is measured per stage; results are saved as
+JSON and may be compared with previous ones without network access.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import random
+import argparse
+import platform
+import resource
+import subprocess
+import multiprocessing
+import xml.sax.saxutils
+
+import logging
+logger = logging.getLogger(__name__)
+
+import rwe.parallel
+import rwe.metrics
+import rwe.dedupe
+import rwe.pages
+import rwe.tables
+import rwe.segmentations.meta
+import rwe.segmentations.tables
+import rwe.segmentations.annotated
+
+
+"""
+Версия формата файла результатов.
+
+Results file format version.
+"""
+results_version = 1
+
+stages = ('pages', 'metas', 'tables', 'segment', 'end-to-end')
+
+"""
+Файл с параметрами и счётчиками сгенерированного дампа в каталоге
+измерений.
+
+File with parameters and counters of generated dump in benchmark directory.
+"""
+dump_info_file = 'dump.json'
+
+default_pages = 20000
+default_noise = 0.5
+default_templates = 40
+default_seed = 0
+
+
+"""
+Склонения существительных: окончание начальной формы, суффиксы основ,
+строки таблицы (падеж, окончание ед. ч., окончание мн. ч.; None - беглая
+гласная в основе1) и номер склонения в имени шаблона.
+
+Nouns' declensions: normal form ending, stems' suffixies, table rows
+(case, singular ending, plural ending; None means fleeting vowel in
+основа1) and declension number in template name.
+"""
+_declensions = [
+    ('f', '1', 'а', ['', 'ниц', 'ин'], [('Им.', 'а', 'ы'), ('Р.', 'ы', ''), ('Д.', 'е', 'ам'), ('В.', 'у', ''), ('Тв.', 'ой', 'ами'), ('Пр.', 'е', 'ах')]),
+    ('m', '1', '', ['', 'ист', 'ант'], [('Им.', '', 'ы'), ('Р.', 'а', 'ов'), ('Д.', 'у', 'ам'), ('В.', '', 'ы'), ('Тв.', 'ом', 'ами'), ('Пр.', 'е', 'ах')]),
+    ('n', '1', 'о', ['', 'ств'], [('Им.', 'о', 'а'), ('Р.', 'а', ''), ('Д.', 'у', 'ам'), ('В.', 'о', 'а'), ('Тв.', 'ом', 'ами'), ('Пр.', 'е', 'ах')]),
+    ('f', '3*', 'а', ['к'], [('Им.', 'а', 'и'), ('Р.', 'и', None), ('Д.', 'е', 'ам'), ('В.', 'у', 'и'), ('Тв.', 'ой', 'ами'), ('Пр.', 'е', 'ах')]),
+]
+
+_prefixies = ['', '', '', 'по', 'за', 'на', 'пере', 'при', 'вы']
+_consonants = 'бвдзлмнпрстф'
+_vowels = 'аоуи'
+_stress = '́'
+
+
+def _table_rows(declension):
+    rows = [['падеж', 'ед. ч.', 'мн. ч.']]
+    for case, singular, plural in declension[4]:
+        rows.append([case, '{{{основа}}}' + singular, '{{{основа1}}}' if plural is None else '{{{основа}}}' + plural])
+    return rows
+
+def _forms_count(declension):
+    """
+    Возвращает число различных форм в таблице склонения.
+
+    Returns number of distinct forms in declension table.
+    """
+    return len(set(cell for row in _table_rows(declension)[1:] for cell in row[1:]))
+
+def _template_names(count):
+    """
+    Возвращает по `count` имён шаблонов таблиц, поровну на склонение.
+
+    Returns `count` tables' templates names divided equally by declensions.
+    """
+    names = [[] for declension in _declensions]
+    variants = [(animacy, accent) for accent in 'abcdef' for animacy in ('ina', 'a')]
+    for i in range(max(count, len(_declensions))):
+        d = i % len(_declensions)
+        gender, declension_number = _declensions[d][:2]
+        animacy, accent = variants[len(names[d]) % len(variants)]
+        suffix = '' if len(names[d]) < len(variants) else '-' + str(len(names[d]) // len(variants))
+        names[d].append('сущ ru {} {} {}{}{}'.format(gender, animacy, declension_number, accent, suffix))
+    return names
+
+
+class DumpGenerator(object):
+    """
+    Генератор синтетического дампа с генератором случайных чисел `rng`.
+
+    Synthetic dump generator with `rng` random numbers generator.
+    """
+
+    def __init__(self, rng, templates=default_templates):
+        self.rng = rng
+        self.template_names = _template_names(templates)
+        self.words = set()
+
+    def _root(self):
+        rng = self.rng
+        syllables = rng.choice((1, 1, 2))
+        return ''.join(rng.choice(_consonants) + rng.choice(_vowels) for i in range(syllables)) + rng.choice(_consonants)
+
+    def _word(self):
+        """
+        Возвращает новое слово: заголовок, имя шаблона, морфемы (приставка,
+        корень, суффикс, окончание), основы и число его различных форм.
+
+        Returns new word: title, template name, morphemes (prefix, root,
+        suffix, ending), stems and number of its distinct forms.
+        """
+        rng = self.rng
+        while True:
+            d = rng.randrange(len(_declensions))
+            gender, declension_number, ending, suffixies, rows = _declensions[d]
+            prefix, root, suffix = rng.choice(_prefixies), self._root(), rng.choice(suffixies)
+            title = prefix + root + suffix + ending
+            if title not in self.words:
+                self.words.add(title)
+                break
+
+        stems = {'основа': prefix + root + suffix}
+        if any(plural is None for case, singular, plural in rows):
+            stems['основа1'] = prefix + root + 'е' + suffix
+
+        return title, rng.choice(self.template_names[d]), (prefix, root, suffix, ending), stems, _forms_count(_declensions[d])
+
+    def _morfo(self, morphemes):
+        prefix, root, suffix, ending = morphemes
+        if self.rng.random() < 0.3:
+            # stress marks are removed by metas extraction
+            root = root[:-1] + _stress + root[-1:] if len(root) > 2 else root
+
+        if self.rng.random() < 0.5:
+            return '{{морфо|' + '|'.join(morphemes[:1] + (root,) + morphemes[2:]) + '}}'
+
+        named = [('прист1', prefix), ('корень', root), ('суфф1', suffix), ('оконч', ending)]
+        return '{{морфо|' + '|'.join('{}={}'.format(name, value) for name, value in named if value or name == 'оконч') + '}}'
+
+    def russian_page(self, table_call=True, morfo=True, template_name=None, strange=False):
+        """
+        Возвращает заголовок и текст русской страницы и число различных
+        форм слова в таблице, если его можно разбить.
+
+        Returns title and text of russian page and number of distinct word
+        forms in table if word may be segmented.
+        """
+        title, name, morphemes, stems, forms = self._word()
+        if template_name is not None:
+            name = template_name
+
+        lines = ['= {{-ru-}} =', '', '=== Морфологические и синтаксические свойства ===']
+        if table_call:
+            lines.append('{{' + name)
+            lines.extend('|{}={}'.format(key, value) for key, value in sorted(stems.items()))
+            lines.append('|слоги={{по-слогам|' + title + '}}')
+            lines.append('}}')
+        else:
+            lines.append("'''" + title + "'''")
+        lines.append('')
+        if morfo:
+            text = self._morfo(morphemes)
+            lines.append(text.replace('}}', 'q}}') if strange else text)
+        lines.extend(['', '=== Произношение ===', '{{transcriptions-ru|' + title + '|' + title + '}}', '',
+                      '=== Семантические свойства ===', '==== Значение ====', '# синтетическое слово {{пример|' + title + '}}', ''])
+        lines.extend(['= {{-uk-}} =', '', "'''" + title + "'''", ''])
+
+        if not table_call or not morfo or strange or template_name is not None:
+            forms = 0
+        return title, '\n'.join(lines), forms
+
+    def other_page(self):
+        title = 'word' + str(self.rng.randrange(10 ** 9))
+        return title, '= {{-en-}} =\n\n' + 'Some english text here. ' * self.rng.randint(5, 40), 0
+
+    def noise_page(self):
+        """
+        Возвращает страницу, из которой разбиений не извлечь, и причину.
+
+        Returns page which segmentations can't be extracted from and reason.
+        """
+        kind = self.rng.choice(('other language', 'other language', 'other language', 'no morfo', 'no table call', 'strange symbols', 'unknown template'))
+        if kind == 'other language':
+            return self.other_page()
+        if kind == 'no morfo':
+            return self.russian_page(morfo=False)
+        if kind == 'no table call':
+            return self.russian_page(table_call=False)
+        if kind == 'strange symbols':
+            return self.russian_page(strange=True)
+        return self.russian_page(template_name='сущ ru m ina 9z')
+
+
+def _revision(page_id):
+    return str(100000000 + page_id)
+
+def _write_page(out, page_id, title, text):
+    out.write('  <page>\n    <title>{}</title>\n    <ns>0</ns>\n    <id>{}</id>\n    <revision>\n      <id>{}</id>\n'
+              '      <text xml:space="preserve">{}</text>\n    </revision>\n  </page>\n'.format(
+                  xml.sax.saxutils.escape(title), page_id, _revision(page_id), xml.sax.saxutils.escape(text)))
+
+def _template_wikitext(rows):
+    return '{| class="wikitable" style="float:right"\n' + ''.join('|-\n| ' + ' || '.join(row) + '\n' for row in rows) + '|}'
+
+def generate_dump(directory, pages=default_pages, noise=default_noise, templates=default_templates, seed=default_seed):
+    """
+    Создаёт в каталоге `directory` синтетический дамп dump.xml из `pages`
+    страниц (доля `noise` из них - шум) с `templates` шаблонами таблиц,
+    файлы таблиц в tables и описание дампа dump.json, которое и возвращает.
+
+    Creates in `directory` synthetic dump dump.xml of `pages` pages (`noise`
+    fraction of them is noise) with `templates` tables' templates, tables'
+    files in tables and dump description dump.json which is also returned.
+    """
+    rng = random.Random(seed)
+    generator = DumpGenerator(rng, templates)
+    tables_directory = os.path.join(directory, 'tables')
+    os.makedirs(tables_directory, exist_ok=True)
+    manifest = rwe.tables.Manifest(tables_directory)
+    manifest.start()
+
+    info = {'pages': 0, 'words': 0, 'forms': 0, 'templates': 0, 'noise': noise, 'seed': seed}
+    dump_file = os.path.join(directory, 'dump.xml')
+    with open(dump_file + '.tmp', 'w') as out:
+        out.write('<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.8/" version="0.8">\n'
+                  '  <siteinfo>\n    <sitename>Викисловарь</sitename>\n  </siteinfo>\n')
+
+        for d, names in enumerate(generator.template_names):
+            rows = _table_rows(_declensions[d])
+            for name in names:
+                info['pages'] += 1
+                info['templates'] += 1
+                _write_page(out, info['pages'], 'Шаблон:' + name, _template_wikitext(rows))
+                # tables are rendered as if from the dump, so no stage renders them again
+                manifest.record('Шаблон:' + name, _revision(info['pages']), rwe.tables.save_table(name, rows, tables_directory))
+
+        for i in range(pages):
+            if rng.random() < noise:
+                title, text, forms = generator.noise_page()
+            else:
+                title, text, forms = generator.russian_page()
+            info['pages'] += 1
+            info['words'] += forms > 0
+            info['forms'] += forms
+            _write_page(out, info['pages'], title, text)
+
+        out.write('</mediawiki>\n')
+    os.replace(dump_file + '.tmp', dump_file)
+    manifest.finish()
+
+    info['size'] = os.path.getsize(dump_file)
+    with open(os.path.join(directory, dump_info_file), 'w') as f:
+        json.dump(info, f, indent=1)
+
+    return info
+
+def prepare(directory, pages=default_pages, noise=default_noise, templates=default_templates, seed=default_seed):
+    """
+    Возвращает описание дампа в `directory`, генерируя его заново,
+    если он создан с другими параметрами.
+
+    Returns description of dump in `directory`, generating it again
+    if it was created with other parameters.
+    """
+    try:
+        with open(os.path.join(directory, dump_info_file)) as f:
+            info = json.load(f)
+        if (info['pages'] - info['templates'], info['templates'], info['noise'], info['seed']) == (pages, max(templates, len(_declensions)), noise, seed):
+            return info
+    except (OSError, ValueError, KeyError):
+        pass
+
+    logger.info('Generating benchmark dump in %s', directory)
+    return generate_dump(directory, pages, noise, templates, seed)
+
+
+def _stage_args(settings, directory, output_file=None, **overrides):
+    """
+    Собирает аргументы этапов, как их задала бы командная строка.
+
+    Builds stages' arguments as command line would set them.
+    """
+    args = argparse.Namespace(
+        dump_file=os.path.join(directory, 'dump.xml'), dump_index=None, meta_segmentations=None,
+        tables_directory=os.path.join(directory, 'tables'), offline=True, render_jobs=1, address=None,
+        render_cache=None, save_pages=None, pages_directory=None, debug=False, warm_templates=False,
+        inflexions=open(settings['inflexions']), suffixies=open(settings['suffixies']),
+        ordered=False, reorder_window=None, output_format='text', compression_level=0,
+        write_batch=rwe.segmentations.annotated.default_write_batch, dedupe=False,
+        dedupe_limit=rwe.dedupe.default_max_entries, dedupe_directory=None,
+        output=open(output_file or os.devnull, 'w'),
+        backend=settings['backend'], jobs=settings['jobs'], max_pending=settings['max_pending'], chunk_size=settings['chunk_size'])
+    for key, value in overrides.items():
+        setattr(args, key, value)
+    return args
+
+def _count_lines(output_file):
+    with open(output_file, 'rb') as f:
+        return sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1 << 20), b''))
+
+def _run_stage(stage, settings, directory):
+    """
+    Выполняет этап `stage` и возвращает его счётчики (без времени).
+
+    Runs `stage` and returns its counters (without time).
+    """
+    if stage == 'pages':
+        executor = rwe.parallel.create_executor(settings['backend'], settings['jobs'], settings['max_pending'])
+        titles = rwe.pages.extract('.', os.path.join(directory, 'dump.xml'), None, executor)
+        executor.shutdown()
+        return {'pages': len(titles)}
+
+    if stage == 'metas':
+        executor = rwe.parallel.create_executor(settings['backend'], settings['jobs'], settings['max_pending'])
+        metas = 0
+        for meta in rwe.segmentations.meta.extract_meta_segmentations(os.path.join(directory, 'dump.xml'), executor, settings['chunk_size']):
+            metas += 1
+        executor.shutdown()
+        return {'metas': metas}
+
+    if stage == 'tables':
+        compiled_file = os.path.join(directory, 'tables', rwe.segmentations.tables.compiled_file_name)
+        if os.path.exists(compiled_file):
+            os.unlink(compiled_file)
+        registry = rwe.segmentations.tables.load_segmentation_table_templates(_stage_args(settings, directory, warm_templates=True))
+        return {'templates': len(registry)}
+
+    output_file = os.path.join(directory, 'segmentations.txt')
+    if stage == 'segment':
+        metas_file = open(os.path.join(directory, 'metas.txt'))
+        rwe.segmentations.annotated.main(_stage_args(settings, directory, output_file, meta_segmentations=metas_file))
+    else:
+        rwe.segmentations.annotated.main(_stage_args(settings, directory, output_file))
+
+    return {'forms': _count_lines(output_file)}
+
+def _peak_rss_mb():
+    """
+    Возвращает пиковую память процесса. ru_maxrss наследуется через exec
+    от породившего процесса, поэтому, где можно, берётся VmHWM.
+
+    Returns process peak memory. ru_maxrss is inherited through exec from
+    parent process, so VmHWM is taken where available.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _measure(stage, settings, directory, results):
+    start = time.perf_counter()
+    counters = _run_stage(stage, settings, directory)
+    counters['seconds'] = time.perf_counter() - start
+    counters['peak_rss_mb'] = _peak_rss_mb()
+    counters['metrics'] = rwe.metrics.snapshot()
+    counters['workers_peak_rss_mb'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    results.put(counters)
+
+def measure(stage, settings, directory):
+    """
+    Выполняет этап `stage` в отдельном процессе и возвращает его счётчики,
+    время и пиковую память процесса и его обработчиков.
+
+    Runs `stage` in separate process and returns its counters, time and
+    peak memory of process and its workers.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_measure, args=(stage, settings, directory, results))
+    process.start()
+
+    # results are read before join: child can't exit until big counters are read from pipe
+    counters = None
+    while counters is None:
+        try:
+            counters = results.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                try:
+                    counters = results.get_nowait()
+                except queue.Empty:
+                    pass
+                break
+
+    process.join()
+    if process.exitcode != 0 or counters is None:
+        raise RuntimeError('Benchmark stage {} failed with exit code {}'.format(stage, process.exitcode))
+    return counters
+
+
+def _write_metas(settings, directory):
+    metas_file = os.path.join(directory, 'metas.txt')
+    if os.path.exists(metas_file) and os.path.getmtime(metas_file) >= os.path.getmtime(os.path.join(directory, 'dump.xml')):
+        return
+
+    with open(metas_file + '.tmp', 'w') as f:
+        for morf, template_name, stems in rwe.segmentations.meta.extract_meta_segmentations(os.path.join(directory, 'dump.xml')):
+            print(morf, template_name, *stems, sep=';', file=f)
+    os.replace(metas_file + '.tmp', metas_file)
+
+def _rates(stage, counters, info):
+    seconds = counters['seconds']
+    if stage in ('pages', 'metas', 'end-to-end'):
+        counters['pages_per_second'] = info['pages'] / seconds
+    if stage == 'tables':
+        counters['templates_per_second'] = counters['templates'] / seconds
+    if stage in ('segment', 'end-to-end'):
+        counters['forms_per_second'] = counters['forms'] / seconds
+        if counters['forms'] != info['forms']:
+            logger.warning('Stage %s extracted %d forms instead of %d', stage, counters['forms'], info['forms'])
+
+def run(directory, settings, selected_stages=stages, repeat=1):
+    """
+    Выполняет этапы `selected_stages` по `repeat` раз на дампе из
+    `directory` и возвращает результаты: лучшее время и наибольшую память
+    каждого этапа.
+
+    Runs `selected_stages` `repeat` times each over dump in `directory` and
+    returns results: best time and largest memory of every stage.
+    """
+    with open(os.path.join(directory, dump_info_file)) as f:
+        info = json.load(f)
+    if 'segment' in selected_stages:
+        _write_metas(settings, directory)
+
+    results = {}
+    for stage in selected_stages:
+        runs = [measure(stage, settings, directory) for i in range(repeat)]
+        best = min(runs, key=lambda counters: counters['seconds'])
+        best['peak_rss_mb'] = max(counters['peak_rss_mb'] for counters in runs)
+        best['workers_peak_rss_mb'] = max(counters['workers_peak_rss_mb'] for counters in runs)
+        _rates(stage, best, info)
+        results[stage] = best
+        logger.info('Benchmark %s: %s', stage, json.dumps(best))
+
+    return {
+        'version': results_version,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'settings': {key: value for key, value in settings.items() if key not in ('inflexions', 'suffixies')},
+        'repeat': repeat,
+        'dump': info,
+        'stages': results,
+    }
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, output=sys.stdout):
+    """
+    Печатает скорость этапов `results` относительно результатов `baseline`.
+
+    Prints `results` stages' throughput relative to `baseline` results.
+    """
+    for stage, counters in results['stages'].items():
+        previous = baseline.get('stages', {}).get(stage)
+        for key in sorted(counters):
+            if not key.endswith('_per_second') and key != 'peak_rss_mb':
+                continue
+            line = '{:<11} {:<21} {:>12.1f}'.format(stage, key, counters[key])
+            if previous is not None and previous.get(key):
+                line += '  {:+.1%} vs {}'.format(counters[key] / previous[key] - 1, baseline.get('commit') or 'baseline')
+            print(line, file=output)
+
+
+def main(args):
+    selected_stages = stages if args.stages == 'all' else args.stages.split(',')
+    for stage in selected_stages:
+        if stage not in stages:
+            raise ValueError('Unknown benchmark stage ' + stage)
+
+    os.makedirs(args.directory, exist_ok=True)
+    prepare(args.directory, args.pages, args.noise, args.templates, args.seed)
+
+    settings = {
+        'backend': args.backend, 'jobs': args.jobs, 'max_pending': args.max_pending, 'chunk_size': args.chunk_size,
+        'inflexions': os.path.abspath(args.inflexions.name), 'suffixies': os.path.abspath(args.suffixies.name),
+    }
+    results = run(args.directory, settings, selected_stages, args.repeat)
+
+    with open(args.results, 'w') as f:
+        json.dump(results, f, indent=1)
+
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    compare(results, baseline, args.output)
+    args.output.close()
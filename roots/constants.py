@@ -23,3 +23,5 @@ namespace = '{http://www.mediawiki.org/xml/export-0.8/}'
 page_tag  = namespace + 'page'
 title_tag = namespace + 'title'
 text_tag  = namespace + 'text'
+revision_tag = namespace + 'revision'
+id_tag    = namespace + 'id'
@@ -0,0 +1,130 @@
+"""
+Потоковое удаление повторяющихся строк с ограниченной памятью. Пока
+множество встреченных строк помещается в заданный предел, уникальные строки
+выдаются сразу в исходном порядке. При переполнении множество сбрасывается
+на диск отсортированными частями, а оставшиеся уникальные строки выдаются
+в конце слиянием частей (в отсортированном порядке, как у `sort -u`).
+
+Memory bounded streaming removal of duplicate lines. While set of seen
+lines fits into given limit, unique lines are emitted immediately in
+original order. On overflow the set is spilled to disk as sorted runs and
+remaining unique lines are emitted at the end by merging runs (in sorted
+order, as `sort -u` does).
+"""
+
+import os
+import heapq
+import shutil
+import tempfile
+import itertools
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+"""
+Число строк во множестве, после которого оно сбрасывается на диск.
+
+Number of lines in set after which it is spilled to disk.
+"""
+default_max_entries = 5000000
+
+"""
+Метки частей: уже выданные строки и строки, ждущие слияния.
+
+Runs' tags: already emitted lines and lines waiting for merge.
+"""
+_emitted = 0
+_pending = 1
+
+
+class Deduplicator(object):
+    """
+    Фильтр повторяющихся строк, держащий в памяти не более `max_entries`
+    строк. Части сбрасываются во временный каталог внутри `temp_directory`.
+
+    Duplicate lines filter keeping at most `max_entries` lines in memory.
+    Runs are spilled into temporary directory inside `temp_directory`.
+    """
+
+    def __init__(self, max_entries=default_max_entries, temp_directory=None):
+        self.max_entries = max_entries
+        self.temp_directory = temp_directory
+        self.total = 0
+        self.unique = 0
+        self._seen = set()
+        self._spilling = False
+        self._runs = []
+        self._runs_directory = None
+
+    def feed(self, lines):
+        """
+        Пропускает через фильтр строки `lines` и возвращает список тех,
+        которые можно выдать сразу.
+
+        Passes `lines` through filter and returns list of those which
+        may be emitted immediately.
+        """
+        seen = self._seen
+        unique = []
+        for line in lines:
+            self.total += 1
+            if line in seen:
+                continue
+
+            seen.add(line)
+            if not self._spilling:
+                unique.append(line)
+                self.unique += 1
+
+            if len(seen) >= self.max_entries:
+                self._spill()
+                seen = self._seen
+
+        return unique
+
+    def _spill(self):
+        if self._runs_directory is None:
+            self._runs_directory = tempfile.mkdtemp(prefix='dedupe-', dir=self.temp_directory)
+
+        run_file = os.path.join(self._runs_directory, '{}.run'.format(len(self._runs)))
+        with open(run_file, 'w') as f:
+            for line in sorted(self._seen):
+                print(line, file=f)
+
+        logger.info('Spilled %d lines into %s', len(self._seen), run_file)
+        self._runs.append((run_file, _pending if self._spilling else _emitted))
+        self._seen = set()
+        self._spilling = True
+
+    def _read_run(self, run_file, tag):
+        with open(run_file, 'r') as f:
+            for line in f:
+                yield line[:-1], tag
+
+    def finish(self):
+        """
+        Возвращает оставшиеся уникальные строки (сливая части, если они
+        были сброшены на диск) и удаляет временные файлы.
+
+        Yields remaining unique lines (merging runs if they were spilled
+        to disk) and removes temporary files.
+        """
+        if not self._spilling:
+            return
+
+        if self._seen:
+            self._spill()
+
+        try:
+            runs = [self._read_run(run_file, tag) for run_file, tag in self._runs]
+            for line, tagged in itertools.groupby(heapq.merge(*runs), key=lambda t: t[0]):
+                if next(tagged)[1] == _pending:
+                    self.unique += 1
+                    yield line
+        finally:
+            shutil.rmtree(self._runs_directory, ignore_errors=True)
+            self._runs = []
+
+    def duplicates_ratio(self):
+        return 1 - self.unique / self.total if self.total else 0.0
@@ -0,0 +1,513 @@
+"""
+Чтение страниц из дампа в формате экспорта MediaWiki. Поддерживаются
+как распакованный дамп, который отображается в память и разбирается
+параллельно по диапазонам байт, так и сжатый дамп с несколькими потоками bz2
+(pages-articles-multistream.xml.bz2), который распаковывается параллельно
+с помощью прилагающегося к нему индекса, без промежуточного файла на диске.
+
+Reading pages from MediaWiki export dump. Both plain XML dump, which is
+memory-mapped and parsed in parallel by byte ranges, and multistream bz2
+dump (pages-articles-multistream.xml.bz2) are supported, the latter is
+decompressed in parallel using its index file, without intermediate file
+on disk.
+"""
+
+import bz2
+import collections
+import functools
+import html
+import mmap
+import os
+import xml.etree.ElementTree as ET
+
+import logging
+logger = logging.getLogger(__name__)
+
+from rwe.constants import *
+import rwe.parallel
+import rwe.metrics
+
+
+"""
+Страница дампа: заголовок, текст и номер последней ревизии.
+
+Dump page: title, text and id of the last revision.
+"""
+Page = collections.namedtuple('Page', ['title', 'text', 'revision'])
+
+"""
+Предварительный фильтр страниц: страница проходит его, если её заголовок
+удовлетворяет регулярному выражению `title_pattern` (если задано) и
+текст содержит все строки из `markers`. Проверка делается прямо над байтами
+дампа, до разбора XML, поэтому отброшенные страницы ничего не стоят.
+Если заданы `reasons` (по причине на строку из `markers`), для страниц,
+отброшенных фильтром, отмечается причина первой отсутствующей строки
+(см. `metrics`).
+
+Page prefilter: page passes it if its title matches `title_pattern` regexp
+(if any) and its text contains all `markers` strings. Check is made right
+on dump bytes, before XML parsing, so dropped pages cost next to nothing.
+If `reasons` are given (reason per `markers` string), reason of the first
+missing string is marked for pages dropped by filter (see `metrics`).
+"""
+PageFilter = collections.namedtuple('PageFilter', ['title_pattern', 'markers', 'reasons'], defaults=(None,))
+
+"""
+Примерное количество страниц в одном потоке bz2 сжатого дампа.
+
+Approximate number of pages in one bz2 stream of compressed dump.
+"""
+pages_per_stream = 100
+
+"""
+Наибольший размер диапазона байт распакованного дампа, разбираемого
+одним обработчиком.
+
+Maximum size of plain dump byte range parsed by one worker.
+"""
+max_range_size = 16 * 1024 * 1024
+
+
+def default_index_file(dump_file):
+    """
+    Возвращает имя индекса, лежащего рядом со сжатым дампом `dump_file`,
+    если такой существует.
+
+    Returns name of index file lying next to compressed `dump_file`, if any.
+    """
+    if not dump_file.endswith('.xml.bz2'):
+        return
+
+    index_file = dump_file[:-len('.xml.bz2')] + '-index.txt.bz2'
+    if os.path.exists(index_file):
+        return index_file
+
+
+def read_stream_offsets(index_file):
+    """
+    Считывает из индекса сжатого дампа смещения начал потоков bz2.
+    Строки индекса имеют вид `смещение:id страницы:заголовок`.
+
+    Reads bz2 streams offsets from compressed dump index.
+    Index lines are of form `offset:page id:title`.
+    """
+    offsets = []
+    opener = bz2.open if index_file.endswith('.bz2') else open
+    with opener(index_file, 'rt', encoding='utf-8') as f:
+        for l in f:
+            offset = int(l.split(':', 1)[0])
+            if not offsets or offsets[-1] != offset:
+                offsets.append(offset)
+
+    return offsets
+
+
+def _title_matches(page_filter, title):
+    return page_filter.title_pattern is None or page_filter.title_pattern.match(title)
+
+
+def _bytes_match(page_filters, data, start, end):
+    """
+    Проверяет, проходит ли страница из байтов `data[start:end]` хоть один
+    из фильтров `page_filters`, не копируя и не декодируя её текст.
+
+    Checks if page from `data[start:end]` bytes passes any of `page_filters`
+    without copying or decoding its text.
+    """
+    title = None
+    rejection = None
+    for page_filter in page_filters:
+        if page_filter.title_pattern is not None and title is None:
+            title_start = data.find(b'<title>', start, end)
+            title_end = data.find(b'</title>', title_start, end)
+            if title_start == -1 or title_end == -1:
+                # malformed page without title can't pass title filters
+                return False
+            title = html.unescape(data[title_start + len(b'<title>'):title_end].decode())
+
+        if not _title_matches(page_filter, title):
+            continue
+        for i, marker in enumerate(page_filter.markers):
+            if data.find(marker.encode(), start, end) == -1:
+                break
+        else:
+            return True
+
+        if rejection is None and page_filter.reasons is not None:
+            rejection = page_filter.reasons[i]
+
+    if rejection is not None:
+        rwe.metrics.reject(rejection)
+    return False
+
+
+def _page_matches(page_filters, page):
+    """
+    Проверяет, проходит ли уже разобранная страница `page` хоть один
+    из фильтров `page_filters`.
+
+    Checks if already parsed `page` passes any of `page_filters`.
+    """
+    rejection = None
+    text = page.text or ''
+    for page_filter in page_filters:
+        if not _title_matches(page_filter, page.title):
+            continue
+        for i, marker in enumerate(page_filter.markers):
+            if marker not in text:
+                break
+        else:
+            return True
+
+        if rejection is None and page_filter.reasons is not None:
+            rejection = page_filter.reasons[i]
+
+    if rejection is not None:
+        rwe.metrics.reject(rejection)
+    return False
+
+
+def _parse_pages(data, page_filters=None, start=0, end=None):
+    """
+    Разбирает последовательность элементов <page> из байтов `data[start:end]`, оставляя
+    только страницы, прошедшие хоть один из фильтров `page_filters` (если заданы).
+    Всё до первой и после последней страницы (заголовок и концовка дампа)
+    отбрасывается. Возвращает разобранные страницы и число всех страниц.
+
+    Parses sequence of <page> elements from `data[start:end]` bytes, keeping only pages
+    passing any of `page_filters` (if any). Everything before first and after
+    last page (dump header and footer) is dropped. Returns parsed pages and
+    number of all pages.
+    """
+    if end is None:
+        end = len(data)
+
+    total = 0
+    kept = []
+
+    page_start = data.find(b'<page>', start, end)
+    while page_start != -1:
+        page_end = data.find(b'</page>', page_start, end)
+        if page_end == -1:
+            break
+        page_end += len(b'</page>')
+
+        total += 1
+        if page_filters is None or _bytes_match(page_filters, data, page_start, page_end):
+            kept.append(data[page_start:page_end])
+
+        page_start = data.find(b'<page>', page_end, end)
+
+    if not kept:
+        return [], total
+
+    root = ET.fromstring(b'<pages>' + b''.join(kept) + b'</pages>')
+
+    pages = []
+    for page in root:
+        pages.append(Page(page.findtext('title'), page.findtext('revision/text'), page.findtext('revision/id')))
+
+    return pages, total
+
+
+def _apply(handler, pages):
+    if handler is None:
+        return pages
+
+    return handler(pages)
+
+
+def _handle_streams(handler, page_filters, dump_file, streams_range):
+    """
+    Распаковывает потоки bz2 из байтов `streams_range` сжатого дампа
+    и передаёт содержащиеся в них страницы, прошедшие фильтры `page_filters`,
+    обработчику `handler`. Возвращает число всех и отброшенных страниц и
+    результат обработки.
+
+    Decompresses bz2 streams from `streams_range` bytes of compressed dump
+    and passes contained pages passing `page_filters` to `handler`. Returns
+    number of all and dropped pages and handler result.
+    """
+    start, end = streams_range
+    with open(dump_file, 'rb') as f:
+        f.seek(start)
+        data = f.read(-1 if end is None else end - start)
+
+    pages, total = _parse_pages(bz2.decompress(data), page_filters)
+    return total, total - len(pages), _apply(handler, pages)
+
+
+def _streams_ranges(offsets, streams_per_chunk):
+    for i in range(0, len(offsets), streams_per_chunk):
+        end = None
+        if i + streams_per_chunk < len(offsets):
+            end = offsets[i + streams_per_chunk]
+
+        yield (offsets[i], end)
+
+
+def _page_ranges(dump_file, ranges_count):
+    """
+    Разбивает распакованный дамп `dump_file` на диапазоны байт, начинающиеся
+    с <page>, числом не менее `ranges_count` и размером не более `max_range_size`.
+
+    Splits plain `dump_file` into byte ranges starting with <page>, at least
+    `ranges_count` of them and each no larger than `max_range_size`.
+    """
+    with open(dump_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        start = m.find(b'<page>')
+        end = m.rfind(b'</page>')
+        if start == -1 or end == -1:
+            return []
+        end += len(b'</page>')
+
+        range_size = min(max_range_size, max(1, (end - start) // ranges_count))
+
+        boundaries = [start]
+        for offset in range(start + range_size, end, range_size):
+            boundary = m.find(b'<page>', max(offset, boundaries[-1] + 1), end)
+            if boundary == -1:
+                break
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+
+    boundaries.append(end)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def _handle_range(handler, page_filters, dump_file, page_range):
+    """
+    Разбирает страницы из диапазона байт `page_range` распакованного дампа
+    и передаёт прошедшие фильтры `page_filters` обработчику `handler`.
+    Возвращает число всех и отброшенных страниц и результат обработки.
+
+    Parses pages from `page_range` bytes of plain dump and passes ones
+    passing `page_filters` to `handler`. Returns number of all and dropped
+    pages and handler result.
+    """
+    start, end = page_range
+    with open(dump_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        pages, total = _parse_pages(m, page_filters, start, end)
+
+    return total, total - len(pages), _apply(handler, pages)
+
+
+def _handle_chunk(handler, chunk):
+    total, dropped, pages = chunk
+    return total, dropped, _apply(handler, pages)
+
+
+def _filtered_chunks(pages, page_filters, chunk_size):
+    """
+    Разбивает уже разобранные страницы `pages` на пачки по `chunk_size`
+    прошедших фильтры `page_filters` и возвращает их вместе с числом всех
+    и отброшенных страниц.
+
+    Splits already parsed `pages` into chunks of `chunk_size` ones passing
+    `page_filters` and yields them along with number of all and dropped pages.
+    """
+    total = 0
+    chunk = []
+    for page in pages:
+        total += 1
+        if page_filters is None or _page_matches(page_filters, page):
+            chunk.append(page)
+
+        if len(chunk) >= chunk_size:
+            yield total, total - len(chunk), chunk
+            total = 0
+            chunk = []
+
+    if total > 0:
+        yield total, total - len(chunk), chunk
+
+
+def _iterparse_pages(dump):
+    """
+    Последовательно считывает страницы из дампа `dump`.
+
+    Serially reads pages from `dump`.
+    """
+    context = ET.iterparse(dump, events=("start", "end"))
+    context = iter(context)
+    event, root = next(context)
+
+    page = False
+    page_title = ''
+    page_content = ''
+    page_revision = None
+    revision = False
+
+    for event, elem in context:
+        if elem.tag == page_tag:
+            if event == 'start':
+                page = True
+                page_revision = None
+                continue
+            else:
+                yield Page(page_title, page_content, page_revision)
+
+        if page and elem.tag == revision_tag:
+            revision = event == 'start'
+
+        if revision and event == 'end' and elem.tag == id_tag and page_revision is None:
+            page_revision = elem.text
+
+        if page and event == "end" and elem.tag == title_tag:
+            page_title = elem.text
+
+        if page and event == 'end' and elem.tag == text_tag:
+            page_content = elem.text
+
+        if event == 'end':
+            elem.clear()
+
+    root.clear()
+
+
+def _map_pages(handler, dump_file, index_file, executor, chunk_size, page_filters):
+    if index_file is not None:
+        offsets = read_stream_offsets(index_file)
+        logger.info('Reading %d bz2 streams of %s', len(offsets), dump_file)
+
+        streams_per_chunk = max(1, chunk_size // pages_per_stream)
+        fn = functools.partial(_handle_streams, handler, page_filters, dump_file)
+        yield from rwe.parallel.imap(executor, fn, _streams_ranges(offsets, streams_per_chunk))
+        return
+
+    if not dump_file.endswith('.bz2'):
+        ranges = _page_ranges(dump_file, getattr(executor, 'max_pending', 1))
+        logger.info('Reading %d byte ranges of %s', len(ranges), dump_file)
+
+        fn = functools.partial(_handle_range, handler, page_filters, dump_file)
+        yield from rwe.parallel.imap(executor, fn, ranges)
+        return
+
+    logger.warning('No index for compressed dump %s, decompressing serially', dump_file)
+    with bz2.open(dump_file, 'rb') as dump:
+        chunks = _filtered_chunks(_iterparse_pages(dump), page_filters, chunk_size)
+        yield from rwe.parallel.imap(executor, functools.partial(_handle_chunk, handler), chunks)
+
+
+def map_pages(handler, dump_file, index_file=None, executor=None, chunk_size=rwe.parallel.default_chunk_size, page_filters=None):
+    """
+    Передаёт страницы дампа `dump_file` пачками примерно по `chunk_size`
+    штук обработчику `handler` через исполнителя `executor` и возвращает
+    результаты обработки пачек в порядке следования страниц в дампе.
+    Если заданы фильтры `page_filters`, обработчику передаются только
+    страницы, прошедшие хоть один из них.
+
+    Сжатый дамп с индексом `index_file` (по умолчанию ищется рядом с дампом)
+    распаковывается прямо в обработчиках, распакованный - разбирается ими
+    по диапазонам байт, остальные дампы читаются последовательно.
+    `handler` должен быть доступен обработчикам в других процессах.
+
+    Passes pages of `dump_file` in chunks of about `chunk_size` to `handler`
+    using `executor` and yields chunks' results in dump order. If
+    `page_filters` are given, only pages passing any of them are passed
+    to `handler`.
+
+    Compressed dump with `index_file` (looked up next to dump by default)
+    is decompressed right in workers, plain dump is parsed by them in byte
+    ranges, other dumps are read serially. `handler` must be picklable for
+    process workers.
+    """
+    if executor is None:
+        executor = rwe.parallel.create_executor()
+
+    if index_file is None:
+        index_file = default_index_file(dump_file)
+
+    pages_count = 0
+    dropped_count = 0
+    for total, dropped, result in _map_pages(handler, dump_file, index_file, executor, chunk_size, page_filters):
+        pages_count += total
+        dropped_count += dropped
+        yield result
+
+    rwe.metrics.count('dump.pages', pages_count)
+    if page_filters is not None:
+        rwe.metrics.count('dump.prefiltered', dropped_count)
+        logger.info('Prefilter dropped %d of %d pages of %s', dropped_count, pages_count, dump_file)
+
+
+def read_pages(dump_file, index_file=None, executor=None, chunk_size=rwe.parallel.default_chunk_size, page_filters=None):
+    """
+    Возвращает по одной страницы дампа `dump_file`, прошедшие фильтры
+    `page_filters`, в порядке следования.
+
+    Yields pages of `dump_file` passing `page_filters` one by one
+    in dump order.
+    """
+    for pages in map_pages(None, dump_file, index_file, executor, chunk_size, page_filters):
+        yield from pages
+
+
+class Consumer(object):
+    """
+    Потребитель страниц дампа для однопроходного чтения с помощью `dispatch`.
+    Обработчик `handler` получает пачки страниц, прошедших фильтры
+    `page_filters` (все страницы, если фильтры не заданы), и выполняется
+    исполнителем, а его результаты передаются в `consume` в порядке следования
+    страниц. После прочтения дампа вызывается `finish`.
+
+    Dump pages consumer for single-pass reading with `dispatch`.
+    `handler` receives chunks of pages passing `page_filters` (all pages
+    if no filters are given) and runs in executor, while its results are
+    passed to `consume` in dump order. `finish` is called after whole dump
+    is read.
+    """
+    handler = None
+    page_filters = None
+
+    def consume(self, result):
+        pass
+
+    def finish(self):
+        pass
+
+
+def _handle_for_consumers(handlers, consumers_filters, pages):
+    """
+    Передаёт каждому обработчику из `handlers` страницы пачки `pages`,
+    прошедшие его фильтры, и возвращает список результатов.
+
+    Passes pages of `pages` chunk passing its filters to every handler from
+    `handlers` and returns list of results.
+    """
+    results = []
+    for handler, page_filters in zip(handlers, consumers_filters):
+        consumer_pages = pages
+        if page_filters is not None:
+            consumer_pages = [page for page in pages if _page_matches(page_filters, page)]
+
+        results.append(_apply(handler, consumer_pages))
+
+    return results
+
+
+def dispatch(consumers, dump_file, index_file=None, executor=None, chunk_size=rwe.parallel.default_chunk_size):
+    """
+    Читает дамп `dump_file` один раз, передавая каждую страницу всем
+    потребителям `consumers`, которым она нужна. Возвращает список
+    результатов `finish` потребителей.
+
+    Reads `dump_file` once, passing every page to all `consumers` interested
+    in it. Returns list of consumers' `finish` results.
+    """
+    handlers = [consumer.handler for consumer in consumers]
+    consumers_filters = [consumer.page_filters for consumer in consumers]
+
+    page_filters = []
+    for consumer_filters in consumers_filters:
+        if consumer_filters is None:
+            page_filters = None
+            break
+        page_filters.extend(consumer_filters)
+
+    handler = functools.partial(_handle_for_consumers, handlers, consumers_filters)
+    for results in map_pages(handler, dump_file, index_file, executor, chunk_size, page_filters):
+        for consumer, result in zip(consumers, results):
+            consumer.consume(result)
+
+    return [consumer.finish() for consumer in consumers]
@@ -4,22 +4,54 @@ if __name__ == '__main__':
     import sys
     import logging
 
+    import rwe.parallel
+    import rwe.metrics
+    import rwe.dedupe
     import rwe.pages
     import rwe.tables
     import rwe.segmentations.meta
     import rwe.segmentations.annotated
+    import rwe.segmentations.binary
+    import rwe.segmentations.index
+    import rwe.segmentations.server
+    import rwe.segmentations.conll
+    import rwe.segmentations.segmenter
+    import rwe.segmentations.corpus
+    import rwe.segmentations.features
+    import rwe.benchmark
 
     parser = argparse.ArgumentParser(description='Extracts annotated (type of morpheme) segmentations of russian words from ruwiktionary.')
-    parser.add_argument('-D', '--dump-file', type=str, default='ruwiktionary.xml', help='ruwiktionary dump file (%(default)s)')
+    parser.add_argument('-D', '--dump-file', type=str, default='ruwiktionary.xml', help='ruwiktionary dump file, plain or multistream bz2 (%(default)s)')
+    parser.add_argument('--dump-index', type=str, default=None, help='index of multistream bz2 dump (defaults to *-index.txt.bz2 next to dump)')
     parser.add_argument('-v', '--verbose', action='count', default=0, help='verbose (repeat for more output)')
     parser.add_argument('-L', '--log', type=argparse.FileType('w'), default=sys.stderr, help='file to log debug messages (%(default)s)')
-    parser.add_argument('-O', '--output', type=argparse.FileType('w'), default='segmentations.txt', help='file to output segmentations (%(default)s)')
+    parser.add_argument('-O', '--output', type=argparse.FileType('w'), default=None, help='file to output segmentations (segmentations.txt for extraction and metas, stdout for other subcommands)')
     parser.add_argument('-A', '--address', type=str, default='ru.wiktionary.org', help='address of mediawiki with ruwiktionary data (%(default)s).\nRequired if no tables were previously extracted')
+    parser.add_argument('--render-jobs', type=int, default=rwe.tables.default_render_jobs, help='number of concurrent template render requests (%(default)s)')
+    parser.add_argument('--offline', action='store_true', help='expand table templates from dump wikitext with --backend workers instead of requesting their render from server? (%(default)s)')
+    parser.add_argument('--render-cache', type=str, default='render-cache', help='directory to cache rendered html of templates in (%(default)s)')
     parser.add_argument('-T', '--tables-directory', type=str, default='tables', help='directory to load from or put extracted tables into if not already extracted (%(default)s)')
+    parser.add_argument('--save-pages', type=str, default=None, help="regexp of pages' titles to save while reading dump for tables and metas in single pass")
+    parser.add_argument('--pages-directory', type=str, default='pages', help='directory to save pages into (%(default)s)')
     parser.add_argument('-M', '--meta-segmentations', type=argparse.FileType('r'), help='file with meta-segmentations (defaults to %(default)s meaning extract them on the go)')
+    parser.add_argument('--ordered', action='store_true', help='write segmentations in order of metas regardless of parallel processing? (%(default)s)')
+    parser.add_argument('--reorder-window', type=int, default=None, help='number of words segmented ahead in ordered mode (defaults to --max-pending)')
+    parser.add_argument('--output-format', type=str, choices=['text', 'binary'], default='text', help='format of segmentations output (%(default)s)')
+    parser.add_argument('--compression-level', type=int, default=rwe.segmentations.binary.default_compression_level, help='zlib compression level of binary output blocks, 0 to disable (%(default)s)')
+    parser.add_argument('--write-batch', type=int, default=rwe.segmentations.annotated.default_write_batch, help='number of segmentations written to output at once (%(default)s)')
+    parser.add_argument('--dedupe', action='store_true', help='drop duplicate segmentations before writing? (%(default)s)')
+    parser.add_argument('--dedupe-limit', type=int, default=rwe.dedupe.default_max_entries, help='number of segmentations kept in memory for dedupe before spilling to disk (%(default)s)')
+    parser.add_argument('--dedupe-directory', type=str, default=None, help='directory for dedupe spill files (defaults to system temporary directory)')
     parser.add_argument('-I', '--inflexions', type=argparse.FileType('r'), default='data/inflexions', help='file with possible inflexions list (%(default)s)')
     parser.add_argument('-S', '--suffixies', type=argparse.FileType('r'), default='data/suffixies', help='file with possible suffixies list (%(default)s)')
+    parser.add_argument('--warm-templates', action='store_true', help='instantiate all table templates once in parallel before segmentation instead of on first use in every worker? (%(default)s)')
     parser.add_argument('--debug', action='store_true', default=False, help='enable debug mode')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of parallel workers (defaults to number of processors)')
+    parser.add_argument('-B', '--backend', type=str, choices=rwe.parallel.backends, default='process', help='parallel processing backend (%(default)s)')
+    parser.add_argument('--max-pending', type=int, default=None, help='maximum number of tasks waiting for workers before reading of input blocks (defaults to four times number of workers)')
+    parser.add_argument('--chunk-size', type=int, default=rwe.parallel.default_chunk_size, help='number of pages sent to worker at once (%(default)s)')
+    parser.add_argument('--metrics', type=str, default=None, help='file to write json summary of rejection reasons, counters, stages timers and queues depth into')
+    parser.add_argument('--metrics-interval', type=float, default=60, help='seconds between periodic writes of --metrics summary, 0 to write only at the end (%(default)s)')
 
 
     subparsers = parser.add_subparsers()
@@ -40,8 +72,85 @@ if __name__ == '__main__':
     metas.set_defaults(func=rwe.segmentations.meta.main)
 
 
+    to_text = subparsers.add_parser('to-text', help="convert binary segmentations into text form", description="convert binary segmentations into text form written to --output")
+    to_text.set_defaults(func=rwe.segmentations.binary.main)
+    to_text.add_argument('input', type=argparse.FileType('rb'), help='binary segmentations file')
+
+
+    index = subparsers.add_parser('index', help="build lookup index over segmentations", description="build memory-mapped index of segmentations (text or binary) by word forms")
+    index.set_defaults(func=rwe.segmentations.index.build_main)
+    index.add_argument('segmentations', type=str, help='segmentations file, text or binary')
+    index.add_argument('index', type=str, help='index file to build')
+
+
+    lookup = subparsers.add_parser('lookup', help="look up word forms' segmentations in index", description="print segmentations of word forms from index to --output")
+    lookup.set_defaults(func=rwe.segmentations.index.lookup_main)
+    lookup.add_argument('index', type=str, help='index file')
+    lookup.add_argument('words', type=str, nargs='+', help='word forms (or prefixes) to look up')
+    lookup.add_argument('-p', '--prefix', action='store_true', help='look up words as prefixes? (%(default)s)')
+    lookup.add_argument('-l', '--limit', type=int, default=None, help='maximum number of results per prefix')
+
+
+    serve = subparsers.add_parser('serve', help="serve segmentations lookups over http", description="serve batched segmentations lookups over localhost http or unix socket")
+    serve.set_defaults(func=rwe.segmentations.server.main)
+    serve.add_argument('segmentations', type=str, help='index file or segmentations file (text or binary) to build index next to')
+    serve.add_argument('--host', type=str, default='127.0.0.1', help='address to listen on (%(default)s)')
+    serve.add_argument('--port', type=int, default=8080, help='port to listen on (%(default)s)')
+    serve.add_argument('--unix-socket', type=str, default=None, help='unix socket to listen on instead of tcp port')
+    serve.add_argument('--cache-size', type=int, default=rwe.segmentations.server.default_cache_size, help='number of cached lookups (%(default)s)')
+    serve.add_argument('--stats-interval', type=float, default=60, help='seconds between throughput and latency stats logged at info level (-v), 0 to disable (%(default)s)')
+
+
+    conll = subparsers.add_parser('conll', help="convert segmentations into CoNLL", description="convert segmentations files (text or binary) into CoNLL format with letter and part type columns, saving *.conll next to them")
+    conll.set_defaults(func=rwe.segmentations.conll.main)
+    conll.add_argument('files', type=str, nargs='+', help='segmentations files')
+    conll.add_argument('--lines-per-chunk', type=int, default=rwe.segmentations.conll.default_lines_per_chunk, help='number of segmentations converted by worker at once (%(default)s)')
+    conll.add_argument('--shards', type=rwe.segmentations.conll.shard_fractions, default=None, help='comma separated train,dev[,test] fractions to split words into *.train.conll, *.dev.conll and *.test.conll')
+
+    segment = subparsers.add_parser('segment', help="segment words by morphemes lists", description="segment words with dictionary-based segmenter over morphemes lists, --inflexions and --suffixies, printing word and segmentation to --output")
+    segment.set_defaults(func=rwe.segmentations.segmenter.main)
+    segment.add_argument('words', type=argparse.FileType('r'), nargs='?', default='-', help='file with words, one per line (stdin)')
+    segment.add_argument('--morphemes-directory', type=str, default=rwe.segmentations.segmenter.default_morphemes_directory, help='directory with roots, prefixes, suffixes and inflexions lists (%(default)s)')
+
+    annotate = subparsers.add_parser('annotate', help="append morphemes columns to CoNLL corpora", description="append прист, корень, суфф and оконч columns to CoNLL dependency trees files, looking words up in extracted segmentations first, saving *.segmented.conll next to them and printing hit rates to --output")
+    annotate.set_defaults(func=rwe.segmentations.corpus.main)
+    annotate.add_argument('files', type=str, nargs='+', help='CoNLL files')
+    annotate.add_argument('-s', '--segmentations', type=str, default=None, help='extracted segmentations (text, binary or index) to look words up in first')
+    annotate.add_argument('--fallback', type=str, choices=['segmenter', 'none'], default='segmenter', help='segmenter of words missing in segmentations (%(default)s)')
+    annotate.add_argument('--morphemes-directory', type=str, default=rwe.segmentations.segmenter.default_morphemes_directory, help='directory with morphemes lists for fallback segmenter (%(default)s)')
+    annotate.add_argument('--cache-size', type=int, default=rwe.segmentations.corpus.default_cache_size, help="number of words' segmentations cached by worker (%(default)s)")
+    annotate.add_argument('--sentences-per-chunk', type=int, default=rwe.segmentations.corpus.default_sentences_per_chunk, help='number of sentences annotated by worker at once (%(default)s)')
+
+    features = subparsers.add_parser('features', help="build letters' features for segmentation training", description="build hashed letters' features (scipy sparse matrices) and labels of segmentations (text or binary) in batches saved as batch-*.npz, labels' names go to labels.txt; requires numpy and scipy")
+    features.set_defaults(func=rwe.segmentations.features.main)
+    features.add_argument('segmentations', type=str, help='segmentations file')
+    features.add_argument('output_directory', type=str, help='directory to save batches into')
+    features.add_argument('--batch-size', type=int, default=rwe.segmentations.features.default_batch_size, help='number of words in batch (%(default)s)')
+    features.add_argument('--n-features', type=int, default=rwe.segmentations.features.default_n_features, help='number of hashed features columns (%(default)s)')
+    features.add_argument('--ngram', type=int, default=rwe.segmentations.features.default_ngram, help="maximum length of letters' n-grams (%(default)s)")
+    features.add_argument('--morphemes-directory', type=str, default=rwe.segmentations.segmenter.default_morphemes_directory, help='directory with morphemes lists for dictionary features (%(default)s)')
+
+    benchmark = subparsers.add_parser('benchmark', help="measure extraction throughput on synthetic dump", description="generate deterministic synthetic dump with tables and measure pages/s, forms/s and peak memory of extraction stages, saving results as json and printing them to --output")
+    benchmark.set_defaults(func=rwe.benchmark.main)
+    benchmark.add_argument('--directory', type=str, default='benchmark', help='directory for synthetic dump, tables and outputs (%(default)s)')
+    benchmark.add_argument('--pages', type=int, default=rwe.benchmark.default_pages, help='number of pages in dump besides templates (%(default)s)')
+    benchmark.add_argument('--noise', type=float, default=rwe.benchmark.default_noise, help='fraction of pages without segmentations (%(default)s)')
+    benchmark.add_argument('--templates', type=int, default=rwe.benchmark.default_templates, help="number of tables' templates (%(default)s)")
+    benchmark.add_argument('--seed', type=int, default=rwe.benchmark.default_seed, help='random seed of dump generator (%(default)s)')
+    benchmark.add_argument('--stages', type=str, default='all', help='comma separated stages to run: {} (%(default)s)'.format(','.join(rwe.benchmark.stages)))
+    benchmark.add_argument('--repeat', type=int, default=1, help='number of runs of every stage, best time is taken (%(default)s)')
+    benchmark.add_argument('--results', type=str, default='benchmark.json', help='file to save results into (%(default)s)')
+    benchmark.add_argument('--baseline', type=str, default=None, help='results file to compare with')
+
+
     args = parser.parse_args()
 
+    if args.output is None:
+        # Opened only now so that subcommands reading segmentations.txt do not truncate it,
+        # extraction and metas write there as they always did
+        writes_segmentations = 'func' not in args or args.func is rwe.segmentations.meta.main
+        args.output = open('segmentations.txt', 'w') if writes_segmentations else sys.stdout
+
     logging_level = logging.WARN
     if args.verbose > 1:
         logging_level = logging.DEBUG
@@ -59,8 +168,16 @@ if __name__ == '__main__':
 
     logger.addHandler(fh)
 
-    if 'func' not in args:
+    reporter = None
+    if args.metrics is not None:
+        reporter = rwe.metrics.Reporter(args.metrics, args.metrics_interval)
+
+    try:
+        if 'func' not in args:
 
-        rwe.segmentations.annotated.main(args)
-    else:
-        args.func(args)
+            rwe.segmentations.annotated.main(args)
+        else:
+            args.func(args)
+    finally:
+        if reporter is not None:
+            reporter.stop()
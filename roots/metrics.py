@@ -0,0 +1,219 @@
+"""
+Лёгкие счётчики работы извлечения: причины отбрасывания слов, прочие
+счётчики, время этапов и глубина очередей. Каждый процесс копит их в
+своём реестре `metrics`; процессы-обработчики отдают накопленное вместе
+с результатом каждой задачи (см. `parallel`), и оно складывается в реестр
+основного процесса, так что итог не зависит от способа обработки.
+Сводка в JSON пишется периодически и в конце работы (см. `Reporter`).
+
+Lightweight extraction counters: words rejection reasons, other counters,
+stages' time and queues depth. Every process accumulates them in its own
+`metrics` registry; worker processes hand accumulated values over along
+with result of every task (see `parallel`), and they are added to the main
+process registry, so totals don't depend on processing backend. JSON
+summary is written periodically and at the end of work (see `Reporter`).
+"""
+
+import os
+import json
+import time
+import threading
+import collections
+
+
+class Metrics(object):
+    """
+    Реестр счётчиков, безопасный для использования из многих потоков.
+
+    Counters registry safe to use from many threads.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.counters = collections.Counter()
+        self.rejections = collections.Counter()
+        # name -> [count, total seconds, max seconds]
+        self.timers = {}
+        # name -> [last value, max value]
+        self.gauges = {}
+
+    def _forked(self):
+        # forked worker must neither hand over parent's values nor wait for lock held by parent's thread
+        self._lock = threading.Lock()
+        self._reset()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def reject(self, reason):
+        """
+        Отмечает слово или страницу, отброшенные по причине `reason`.
+
+        Marks word or page rejected for `reason`.
+        """
+        with self._lock:
+            self.rejections[reason] += 1
+
+    def time(self, name, seconds):
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                if seconds > timer[2]:
+                    timer[2] = seconds
+
+    def timer(self, name):
+        """
+        Возвращает контекстный менеджер, замеряющий время своего блока.
+
+        Returns context manager measuring time of its block.
+        """
+        return _Timer(self, name)
+
+    def gauge(self, name, value):
+        with self._lock:
+            gauge = self.gauges.get(name)
+            if gauge is None:
+                self.gauges[name] = [value, value]
+            else:
+                gauge[0] = value
+                if value > gauge[1]:
+                    gauge[1] = value
+
+    def drain(self):
+        """
+        Возвращает накопленные значения для слияния в другом процессе
+        (или None, если их нет) и обнуляет реестр.
+
+        Returns accumulated values for merging in other process (or None
+        if there are none) and resets registry.
+        """
+        with self._lock:
+            if not (self.counters or self.rejections or self.timers or self.gauges):
+                return None
+            drained = (dict(self.counters), dict(self.rejections), self.timers, self.gauges)
+            self._reset()
+        return drained
+
+    def merge(self, drained):
+        """
+        Добавляет значения, полученные `drain` в другом процессе.
+
+        Adds values obtained by `drain` in other process.
+        """
+        if drained is None:
+            return
+
+        counters, rejections, timers, gauges = drained
+        with self._lock:
+            self.counters.update(counters)
+            self.rejections.update(rejections)
+            for name, (count, total, maximum) in timers.items():
+                timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+                timer[0] += count
+                timer[1] += total
+                timer[2] = max(timer[2], maximum)
+            for name, (last, maximum) in gauges.items():
+                gauge = self.gauges.setdefault(name, [last, maximum])
+                gauge[0] = last
+                gauge[1] = max(gauge[1], maximum)
+
+    def snapshot(self):
+        """
+        Возвращает сводку в виде, пригодном для JSON.
+
+        Returns summary in JSON-ready form.
+        """
+        with self._lock:
+            return {
+                'uptime': time.time() - self.started,
+                'counters': dict(sorted(self.counters.items())),
+                'rejections': dict(self.rejections.most_common()),
+                'rejected': sum(self.rejections.values()),
+                'timers': {name: {'count': count, 'total': total, 'mean': total / count, 'max': maximum}
+                           for name, (count, total, maximum) in sorted(self.timers.items())},
+                'gauges': {name: {'last': last, 'max': maximum} for name, (last, maximum) in sorted(self.gauges.items())},
+            }
+
+
+class _Timer(object):
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.time(self.name, time.perf_counter() - self.start)
+
+
+"""
+Реестр текущего процесса и сокращения для его методов. Порождённый через
+fork процесс начинает с пустого реестра.
+
+Current process registry and shortcuts for its methods. Process created
+through fork starts with empty registry.
+"""
+metrics = Metrics()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=metrics._forked)
+
+count = metrics.count
+reject = metrics.reject
+timer = metrics.timer
+gauge = metrics.gauge
+drain = metrics.drain
+merge = metrics.merge
+snapshot = metrics.snapshot
+
+
+def save(metrics_file):
+    """
+    Атомарно записывает сводку реестра процесса в `metrics_file`.
+
+    Atomically writes process registry summary into `metrics_file`.
+    """
+    with open(metrics_file + '.tmp', 'w') as f:
+        json.dump(snapshot(), f, ensure_ascii=False, indent=1)
+    os.replace(metrics_file + '.tmp', metrics_file)
+
+
+class Reporter(object):
+    """
+    Поток, записывающий сводку в `metrics_file` каждые `interval` секунд
+    (если `interval` положителен) и при остановке.
+
+    Thread writing summary into `metrics_file` every `interval` seconds
+    (if `interval` is positive) and on stop.
+    """
+
+    def __init__(self, metrics_file, interval):
+        self.metrics_file = metrics_file
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        if interval > 0:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            save(self.metrics_file)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        save(self.metrics_file)
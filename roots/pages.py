@@ -10,13 +10,14 @@ export format.
 
 """
 
-import xml.etree.ElementTree as ET
+import functools
 import re
 
 import os
 import sys
 
-from rwe.constants import *
+import rwe.dump
+import rwe.parallel
 
 def handle_page(pattern, page_content, page_title, output_directory):
     if not pattern.match(page_title):
@@ -26,8 +27,8 @@ def handle_page(pattern, page_content, page_title, output_directory):
         return page_title
     else:
         dump_file = os.path.join(output_directory, page_title.replace('/', '-').replace(' ', '_'))
-        if not os.path.exists(os.path.output_directory(dump_file)):
-            os.makedirs(os.path.output_directory(dump_file))
+        if not os.path.exists(os.path.dirname(dump_file)):
+            os.makedirs(os.path.dirname(dump_file), exist_ok=True)
 
         f = open(dump_file, 'a')
         f.write(page_content)
@@ -35,53 +36,58 @@ def handle_page(pattern, page_content, page_title, output_directory):
 
         return (page_title, dump_file)
 
-def extract(pattern, dump_file='ruwiktionary.xml', output_directory=None):
+def handle_pages(pattern, output_directory, pages):
+    extracted = []
+    for page in pages:
+        try:
+            extracted_page = handle_page(pattern, page.text, page.title, output_directory)
+            if extracted_page is not None:
+                extracted.append(extracted_page)
+        except:
+            print(page.title, page.text)
+
+    return extracted
+
+class PagesConsumer(rwe.dump.Consumer):
+    """
+    Потребитель страниц дампа, сохраняющий в `output_directory` (если указан)
+    страницы с заголовком удовлетворяющим `pattern`. По окончании возвращает
+    то же, что и `extract`.
+
+    Dump pages consumer saving pages with title matching `pattern` into
+    `output_directory` (if any). Finishes with the same result as `extract`.
+    """
+
+    def __init__(self, pattern, output_directory=None):
+        pattern = re.compile(pattern)
+        self.handler = functools.partial(handle_pages, pattern, output_directory)
+        self.page_filters = [rwe.dump.PageFilter(pattern, ())]
+        self.extracted = []
+
+    def consume(self, extracted_pages):
+        self.extracted.extend(extracted_pages)
+
+    def finish(self):
+        return self.extracted
+
+
+def extract(pattern, dump_file='ruwiktionary.xml', output_directory=None, executor=None, index_file=None):
     """Извлекает все страницы с заголовком удовлетворяющим `pattern` из дампа `dump_file`.
     Сохраняет их если указан `output_directory` и возвращает список кортежей (заголовок страницы, имя файла),
     иначе просто возвращает список подходящих заголовков.
+    Сжатый дамп читается с помощью индекса `index_file`, страницы обрабатываются исполнителем `executor`.
     
     Extract pages with title matching `pattern` regexp from dump `dump_file`.
     If `output_directory` is `None` then do nothing except return list of pages' names,
     otherwise extract page to file and return list of pairs (page title, file name).
+    Compressed dump is read using `index_file`, pages are handled by `executor`.
 
     """
-    context = ET.iterparse(dump_file, events=("start", "end"))
-    context = iter(context)
-    event, root = next(context)
-
-    page = False
-    page_title = ''
-    page_content = ''
-
-    pattern = re.compile(pattern)
-
-    extracted = []
-
-    for event, elem in context:
-        if elem.tag == page_tag:
-            if event == 'start':
-                page = True
-                continue
-            else:
-                try:
-                    extracted_page = handle_page(pattern, page_content, page_title, output_directory)
-                    if extracted_page is not None:
-                        extracted.append(extracted_page)
-                except:
-                    print(page_title, page_content)
-
-        if page and event == "end" and elem.tag == title_tag:
-            page_title = elem.text
-
-        if page and event == 'end' and elem.tag == text_tag:
-            page_content = elem.text
-
-        if event == 'end':
-            elem.clear()
-
-    root.clear()
+    extracted, = rwe.dump.dispatch([PagesConsumer(pattern, output_directory)], dump_file, index_file, executor)
     return extracted
 
 
 def main(args):
-    print(*extract(args.pattern, args.dump_file, args.output_directory))
+    executor = rwe.parallel.create_executor(args.backend, args.jobs, args.max_pending)
+    print(*extract(args.pattern, args.dump_file, args.output_directory, executor, args.dump_index))
+    executor.shutdown()
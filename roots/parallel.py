@@ -0,0 +1,196 @@
+"""
+Выбор способа параллельной обработки данных: процессы, потоки или
+последовательное выполнение в текущем потоке.
+
+Selection of parallel processing backend: processes, threads or
+serial execution in the current thread.
+"""
+
+import os
+import functools
+import threading
+import collections
+import concurrent.futures
+
+import rwe.metrics
+
+
+"""
+Доступные способы параллельной обработки.
+
+Available processing backends.
+"""
+backends = ('process', 'thread', 'serial')
+
+"""
+Количество страниц отправляемых обработчику за один раз.
+
+Number of pages sent to worker at once.
+"""
+default_chunk_size = 64
+
+
+class SerialExecutor(concurrent.futures.Executor):
+    """
+    Исполнитель, выполняющий задачи сразу же при их отправке.
+
+    Executor running tasks right at submission time.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+        return future
+
+
+def _collecting_metrics(fn, *args, **kwargs):
+    """
+    Выполняет задачу в процессе-обработчике и возвращает её результат или
+    исключение вместе с накопленными за неё значениями `metrics`.
+
+    Runs task in worker process and returns its result or exception along
+    with `metrics` values accumulated during it.
+    """
+    try:
+        return fn(*args, **kwargs), None, rwe.metrics.drain()
+    except Exception as e:
+        return None, e, rwe.metrics.drain()
+
+def _merged_metrics(future, inner):
+    try:
+        result, exception, drained = inner.result()
+    except BaseException as e:
+        future.set_exception(e)
+        return
+
+    rwe.metrics.merge(drained)
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+class BoundedExecutor(concurrent.futures.Executor):
+    """
+    Обёртка над исполнителем, блокирующая отправку новых задач пока
+    не завершены `max_pending` уже отправленных. Так читатель дампа
+    останавливается, если обработчики не поспевают за ним, и не копит
+    в памяти тексты ещё не обработанных страниц. Если `collect_metrics`,
+    значения `metrics` процессов-обработчиков переносятся в текущий процесс.
+
+    Executor wrapper blocking submission while `max_pending` already
+    submitted tasks are not done. This way dump reader waits for workers
+    falling behind instead of piling up texts of unprocessed pages. If
+    `collect_metrics`, `metrics` values of worker processes are carried
+    over into current process.
+    """
+
+    def __init__(self, executor, max_pending, collect_metrics=False):
+        self.executor = executor
+        self.max_pending = max_pending
+        self.collect_metrics = collect_metrics
+        self._semaphore = threading.BoundedSemaphore(max_pending)
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _release(self, future):
+        with self._lock:
+            self._pending -= 1
+        self._semaphore.release()
+
+    def submit(self, fn, *args, **kwargs):
+        self._semaphore.acquire()
+        try:
+            if self.collect_metrics:
+                inner = self.executor.submit(_collecting_metrics, fn, *args, **kwargs)
+                future = concurrent.futures.Future()
+                inner.add_done_callback(functools.partial(_merged_metrics, future))
+            else:
+                inner = future = self.executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+        with self._lock:
+            self._pending += 1
+            pending = self._pending
+        rwe.metrics.gauge('executor.pending', pending)
+
+        inner.add_done_callback(self._release)
+        return future
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait)
+
+
+def create_executor(backend='thread', jobs=None, max_pending=None):
+    """
+    Создаёт исполнителя для выбранного способа обработки `backend`
+    с `jobs` обработчиками (по умолчанию - по числу процессоров) и
+    не более чем `max_pending` одновременно ожидающими задачами
+    (по умолчанию - вчетверо больше числа обработчиков).
+
+    Creates executor for `backend` with `jobs` workers (defaults to
+    number of processors) and at most `max_pending` tasks in flight
+    (defaults to four times number of workers).
+    """
+    if backend == 'process':
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+    elif backend == 'thread':
+        jobs = jobs or 8
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+    elif backend == 'serial':
+        return SerialExecutor()
+    else:
+        raise ValueError('Unknown backend "{}"'.format(backend))
+
+    if max_pending is None:
+        max_pending = 4 * (jobs or os.cpu_count() or 1)
+
+    return BoundedExecutor(executor, max_pending, backend == 'process')
+
+
+def chunks(iterable, chunk_size=default_chunk_size):
+    """
+    Разбивает последовательность на списки длиной не более `chunk_size`.
+
+    Splits iterable into lists of at most `chunk_size` elements.
+    """
+    chunk = []
+    for element in iterable:
+        chunk.append(element)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def imap(executor, fn, iterable, window=None):
+    """
+    Ленивый аналог `map`: применяет `fn` к элементам `iterable` с помощью
+    `executor`, держа в работе не более `window` задач (по умолчанию -
+    предел исполнителя), и возвращает результаты в исходном порядке.
+
+    Lazy `map` counterpart: applies `fn` to elements of `iterable` using
+    `executor`, keeping at most `window` tasks in flight (defaults to
+    executor limit), and yields results in original order.
+    """
+    if window is None:
+        window = getattr(executor, 'max_pending', 1)
+
+    pending = collections.deque()
+    for element in iterable:
+        pending.append(executor.submit(fn, element))
+        while pending and (len(pending) >= window or pending[0].done()):
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
@@ -1,11 +1,11 @@
 #!/usr/bin/env python
 
+import collections
+import functools
 import operator
-import os
-import re
 import sys
 import queue
-import concurrent.futures
+import threading
 
 import logging
 logger = logging.getLogger(__name__)
@@ -14,40 +14,38 @@ from rwe.exception import ExtractException
 import rwe.segmentations.meta as meta
 import rwe.segmentations.tables as tables
 import rwe.segmentations.base_form as base_form
+import rwe.segmentations.yot as yot
 import rwe.segmentations.stems
+import rwe.segmentations.binary
+import rwe.parallel
+import rwe.metrics
+import rwe.dedupe
+import rwe.dump
+import rwe.pages
+import rwe.tables
 
 debug_mode = False
 
 def render_template(template, parameters):
     """
     Подставляет полученные ранее разбиения в шаблон, получая на выходе
-    полные разбиения форм слова на морфемы.
+    полные разбиения форм слова на морфемы. Шаблон заранее скомпилирован
+    в план (см. `tables.load_segmentation_table_templates`), так что
+    остаётся лишь заполнить места основ.
     
     Renders preprocessed declension/conjugation template using segmented stems,
-    resulting in full word's forms segmentation into morphemes.
+    resulting in full word's forms segmentation into morphemes. Template is
+    precompiled into plan (see `tables.load_segmentation_table_templates`),
+    so only stem slots are left to fill.
     """
     result = []
-    for parameter, inflexion in template:
-        value = None
-        split_index = parameter.find('|')
-        if split_index > -1:
-            if parameter[:split_index] + '}}}' in parameters:
-                value = parameters[parameter[:split_index] + '}}}']
-            else:
-                value = parameters[parameter[split_index + 1 : parameter.index('}', split_index) + 3]]
-        else:
-            value = parameters[parameter]
-
-        result.append(value + ' ' + inflexion)
+    for key, fallback, ending in template:
+        if fallback is not None and key not in parameters:
+            key = fallback
+        result.append(parameters[key] + ending)
 
     return result
 
-def check_segmentation(segmentation):
-    match = re.match('\w+_[\w-]+( \w+_[\w-]*)* *', segmentation)
-    if not match or match.end(0) != len(segmentation): raise ValueError("'" + segmentation + "'")
-
-
-
 def read_metas(metas_file):
     """
     Считывает мета-информацию для разбиений из файла.
@@ -58,25 +56,34 @@ def read_metas(metas_file):
         morfo, template_name, *stems = l.strip().split(';')
         yield (morfo, template_name, stems)
 
-def segment_word(morfo, stems, template, extracted_queue):
+def segment_word(morfo, stems, template):
     """
     Высчитывает разбиения форм слова основываясь на разбиении начальной формы
-    и таблицы склонения/спряжения.
+    и таблицы склонения/спряжения. Возвращает список разбиений (объектов
+    `Segmentation`) или None.
 
     Computes word forms' segmentations from word normal form segmentation 
     ({{{морфо}}} template) and declension/conjugation table template.
+    Returns list of segmentations (`Segmentation` objects) or None.
     """
     
     try:
 
         base_form_segmentation = base_form.extract_base_form_segmentation(morfo)
+    except yot.YotException as e:
+        logger.info("Can't replace yot in morfo %s: %s", morfo, e.string)
+        rwe.metrics.reject('yot failure')
+        if debug_mode: input()
+        return
     except ExtractException as e:
         logger.info("Can't extract segmentation from morfo %s: %s", morfo, e.string)
+        rwe.metrics.reject('bad morfo')
         if debug_mode: input()
         return
 
     if not base_form.check_for_root_presence(base_form_segmentation):
         logger.debug('No root for morfo %s', morfo)
+        rwe.metrics.reject('no root')
         if debug_mode: input()
         return
 
@@ -93,67 +100,259 @@ def segment_word(morfo, stems, template, extracted_queue):
 
     except ExtractException as e:
         logger.info("Can't extract segmentations for word %s: %s", word, e.string)
+        rwe.metrics.reject('stems segmentation error')
         if debug_mode: input()
         return
 
     for segmentation in segmentations:
-        check_segmentation(segmentation)
-        extracted_queue.put(segmentation)
+        segmentation.check()
 
+    rwe.metrics.count('segment.words')
+    rwe.metrics.count('segment.forms', len(segmentations))
+    return segmentations
 
-def writer(extracted_queue, output):
 
-    metas_read = False
-    while True:
-        try:
-            segmentation = extracted_queue.get(timeout=2)
-            if segmentation == 'metas read':
-                metas_read = True
-            else:
-                print(segmentation, file=output)
-                output.flush()
-        except queue.Empty:
-            if metas_read: break
+"""
+Число строк, записываемых в вывод за раз.
 
+Number of lines written to output at once.
+"""
+default_write_batch = 4096
 
+"""
+Признак конца потока результатов: число слов, отправленных на разбиение.
 
-def main(args):
-    segmentation_table_templates = tables.load_segmentation_table_templates(args)
+End of results stream mark: number of words submitted for segmentation.
+"""
+EndOfStream = collections.namedtuple('EndOfStream', ['words'])
 
-    metas = None
-    if args.meta_segmentations is not None:
-        metas = read_metas(args.meta_segmentations)
+class TextWriter(object):
+    """
+    Записывает разбиения в текстовый поток `output` построчно.
+
+    Writes segmentations into text `output` line by line.
+    """
+
+    def __init__(self, output):
+        self.output = output
+
+    def write(self, segmentations):
+        segmentations.append('')
+        self.output.write('\n'.join(map(str, segmentations)))
+
+    def close(self):
+        self.output.flush()
+
+def writer(extracted_queue, output, batch_size=default_write_batch, deduplicator=None):
+    """
+    Записывает в `output` (`TextWriter` или `binary.BinaryWriter`) разбиения,
+    приходящие из `extracted_queue` списками (по одному списку на слово,
+    возможно пустому), пачками по `batch_size` штук, пропуская повторы через
+    `deduplicator`, если он задан. Завершается, получив `EndOfStream` и
+    столько списков, сколько слов было отправлено на разбиение. Возвращает
+    число записанных разбиений.
+
+    Writes to `output` (`TextWriter` or `binary.BinaryWriter`) segmentations
+    coming from `extracted_queue` as lists (one list per word, possibly empty)
+    in batches of `batch_size`, dropping duplicates with `deduplicator` if any.
+    Finishes when `EndOfStream` and as many lists as words were submitted for
+    segmentation are received. Returns number of written segmentations.
+    """
+    batch = []
+    written = 0
+    received = 0
+    expected = None
+    while expected is None or received < expected:
+        item = extracted_queue.get()
+        if isinstance(item, EndOfStream):
+            expected = item.words
+            continue
+
+        received += 1
+        rwe.metrics.gauge('writer.queue', extracted_queue.qsize())
+        if deduplicator is None:
+            batch.extend(item)
+        else:
+            batch.extend(deduplicator.feed(map(str, item)))
+
+        if len(batch) >= batch_size:
+            written += len(batch)
+            with rwe.metrics.timer('writer.write'):
+                output.write(batch)
+            batch = []
+
+    if deduplicator is not None:
+        for line in deduplicator.finish():
+            batch.append(line)
+            if len(batch) >= batch_size:
+                written += len(batch)
+                output.write(batch)
+                batch = []
+
+    if batch:
+        written += len(batch)
+        output.write(batch)
+    output.close()
+
+    rwe.metrics.count('writer.written', written)
+    return written
+
+
+def extract_in_single_pass(args, executor):
+    """
+    Извлекает за один проход по дампу и имена шаблонов таблиц (которые
+    затем рендерятся), и мета-информацию, а также сохраняет страницы,
+    если это запрошено. Мета-информация возвращается списком.
+
+    Extracts both table templates' names (which are rendered afterwards) and
+    meta-segmentations in one pass over dump, also saving pages if requested.
+    Meta-segmentations are returned as list.
+    """
+    templates_consumer = rwe.tables.TemplatesConsumer(args.offline)
+    consumers = [templates_consumer, meta.MetasConsumer()]
+    if args.save_pages is not None:
+        consumers.append(rwe.pages.PagesConsumer(args.save_pages, args.pages_directory))
+
+    logger.info('Parsing wiktionary dump for templates and metas in single pass')
+    templates, metas, *_ = rwe.dump.dispatch(consumers, args.dump_file, args.dump_index, executor, args.chunk_size)
+
+    if args.offline:
+        rwe.tables.render_offline(templates, templates_consumer.pages, args.tables_directory, executor)
     else:
-        metas = meta.extract_meta_segmentations(args.dump_file)
+        rwe.tables.render_templates(templates, args.tables_directory, args.address, cache_directory=args.render_cache, jobs=args.render_jobs)
 
+    return metas
+
+
+def _word_tasks(metas, segmentation_table_templates):
+    """
+    Отбирает слова `metas` с известным шаблоном таблицы и возвращает
+    аргументы `segment_named_word` (без каталога таблиц). Шаблоны здесь
+    не создаются, а передаются по имени, чтобы не создавать их лишний раз
+    в текущем процессе и не пересылать их планы обработчикам с каждым словом.
+
+    Selects `metas` words with known table template and yields
+    `segment_named_word` arguments (without tables' directory). Templates
+    are not instantiated here but passed by name, so that they aren't
+    instantiated in vain in current process and their plans aren't sent to
+    workers with every word.
+    """
+    for morfo, template_name, stems in metas:
+        if template_name not in segmentation_table_templates:
+            logger.info('No template %s from word %s', template_name, morfo)
+            rwe.metrics.reject('no template')
+            continue
+        yield morfo, stems, template_name
+
+def segment_named_word(tables_directory, morfo, stems, template_name):
+    """
+    Как `segment_word`, но шаблон `template_name` берётся из реестра
+    шаблонов процесса для `tables_directory` (см.
+    `tables.get_template_registry`) и создаётся в нём при первом обращении.
+
+    As `segment_word`, but `template_name` template is taken from process
+    templates registry for `tables_directory` (see
+    `tables.get_template_registry`) and is instantiated there on first access.
+    """
+    try:
+        template = tables.get_template_registry(tables_directory).get(template_name)
+    except ExtractException as e:
+        logger.info("Can't instantiate template: %s", e.string)
+        rwe.metrics.reject('template instantiation error')
+        if debug_mode: input()
+        return
+
+    if not template:
+        logger.info('No template %s from word %s', template_name, morfo)
+        rwe.metrics.reject('no template')
+        return
+
+    return segment_word(morfo, stems, template)
+
+def _segment_word_task(tables_directory, task):
+    try:
+        return segment_named_word(tables_directory, *task) or []
+    except Exception:
+        logger.exception('Failed to segment word')
+        rwe.metrics.reject('segmentation error')
+        return []
+
+
+def main(args):
+    global debug_mode
     debug_mode = args.debug
 
     if debug_mode:
-        executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        executor = rwe.parallel.create_executor('serial')
     else:
-        executor = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+        executor = rwe.parallel.create_executor(args.backend, args.jobs, args.max_pending)
 
-    extracted_queue = queue.Queue()
+    metas = None
+    if args.meta_segmentations is not None:
+        metas = read_metas(args.meta_segmentations)
+    elif not rwe.tables.tables_complete(args.tables_directory):
+        with rwe.metrics.timer('stage.single_pass'):
+            metas = extract_in_single_pass(args, executor)
 
-    executor.submit(writer, extracted_queue, args.output)
+    with rwe.metrics.timer('stage.tables'):
+        segmentation_table_templates = tables.load_segmentation_table_templates(args, executor)
 
-    for morfo, template_name, stems in metas:
+    if args.warm_templates and not debug_mode and args.backend == 'process':
+        # workers forked before warming would instantiate templates once more, fresh ones inherit them
+        executor.shutdown()
+        executor = rwe.parallel.create_executor(args.backend, args.jobs, args.max_pending)
+
+    if metas is None:
+        # metas are extracted lazily, along with segmentation
+        metas = meta.extract_meta_segmentations(args.dump_file, executor, args.chunk_size, args.dump_index)
+
+    extracted_queue = queue.Queue()
+
+    def put_segmentations(future):
+        segmentations = None
         try:
-            template = segmentation_table_templates.get(template_name)
-            if not template:
-                logger.info('No template %s from word %s', template_name, morfo)
-            if debug_mode:
-                segment_word(morfo, stems, template, extracted_queue)
-            else:
-                executor.submit(segment_word, morfo, stems, template, extracted_queue)
-        except ExtractException as e:
-            logger.info("Can't instantiate template: %s", e.string)
-            segmentation_table_templates.pop(template_name)
-            if debug_mode: input()
+            segmentations = future.result()
+        except Exception:
+            logger.exception('Failed to segment word')
+            rwe.metrics.reject('segmentation error')
+        finally:
+            extracted_queue.put(segmentations or [])
+
+    deduplicator = None
+    if args.dedupe:
+        deduplicator = rwe.dedupe.Deduplicator(args.dedupe_limit, args.dedupe_directory)
+
+    if args.output_format == 'binary':
+        output = rwe.segmentations.binary.BinaryWriter(args.output.buffer, args.compression_level)
+    else:
+        output = TextWriter(args.output)
 
-    logger.info('all metas read')
+    with rwe.metrics.timer('stage.segmentation'):
+        writer_thread = threading.Thread(target=writer, args=(extracted_queue, output, args.write_batch, deduplicator))
+        writer_thread.start()
 
-    extracted_queue.put('metas read')
-    executor.shutdown()
+        words = 0
+        try:
+            if args.ordered:
+                fn = functools.partial(_segment_word_task, args.tables_directory)
+                for segmentations in rwe.parallel.imap(executor, fn, _word_tasks(metas, segmentation_table_templates), args.reorder_window):
+                    extracted_queue.put(segmentations)
+                    words += 1
+            else:
+                for task in _word_tasks(metas, segmentation_table_templates):
+                    executor.submit(segment_named_word, args.tables_directory, *task).add_done_callback(put_segmentations)
+                    words += 1
+
+            logger.info('all metas read')
+        finally:
+            # even if reading metas or submitting fails, writer gets all it waits for and process can exit
+            extracted_queue.put(EndOfStream(words))
+            executor.shutdown()
+            writer_thread.join()
+
+    if deduplicator is not None:
+        # stdout may be the output of segmentations
+        logger.info('Duplicates dropped: %d of %d segmentations (%.1f%%)', deduplicator.total - deduplicator.unique, deduplicator.total, 100 * deduplicator.duplicates_ratio())
+        rwe.metrics.count('dedupe.duplicates', deduplicator.total - deduplicator.unique)
 
     args.output.close()
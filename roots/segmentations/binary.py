@@ -0,0 +1,228 @@
+"""
+Компактный двоичный формат разбиений. Файл состоит из заголовка и блоков;
+каждый блок содержит словарь морфем ('тип_текст'), впервые встреченных
+в этом блоке, и разбиения в виде последовательностей номеров морфем.
+Числа записываются в формате varint, блоки могут сжиматься zlib.
+
+    файл  := magic блок* 'E'
+    блок  := 'B' флаги длина(4 байта) данные
+    данные := число_морфем (длина utf8)* число_разбиений (длина номер*)*
+
+Compact binary segmentations format. File consists of header and blocks;
+every block holds dictionary of morphemes ('type_text') first seen in this
+block and segmentations as sequences of morphemes' ids. Numbers are written
+as varints, blocks may be compressed with zlib.
+
+    file  := magic block* 'E'
+    block := 'B' flags length(4 bytes) payload
+    payload := morphemes_count (length utf8)* segmentations_count (length id*)*
+"""
+
+import zlib
+import struct
+
+from rwe.segmentations.segmentation import Segmentation, intern_morpheme, morpheme_token, empty_morpheme
+
+
+magic = b'RWESEG\x01\n'
+_compressed = 1
+
+"""
+Уровень сжатия блоков по умолчанию, 0 - без сжатия.
+
+Default blocks' compression level, 0 means no compression.
+"""
+default_compression_level = 6
+
+
+def _put_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _get_varint(data, pos):
+    value = data[pos]
+    pos += 1
+    if value < 0x80:
+        return value, pos
+
+    value &= 0x7f
+    shift = 7
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+class BinaryWriter(object):
+    """
+    Записывает разбиения в двоичном формате в байтовый поток `stream`,
+    по блоку на каждый вызов `write`. Блоки сжимаются с уровнем
+    `compression_level`, если он не 0.
+
+    Writes segmentations in binary format into bytes `stream`, one block
+    per `write` call. Blocks are compressed with `compression_level`
+    unless it is 0.
+    """
+
+    def __init__(self, stream, compression_level=default_compression_level):
+        self.stream = stream
+        self.compression_level = compression_level
+        self._ids = {}
+        stream.write(magic)
+
+    def write(self, segmentations):
+        """
+        Записывает блок из разбиений `segmentations` (объектов `Segmentation`
+        или их строковых представлений).
+
+        Writes block of `segmentations` (`Segmentation` objects or their
+        string representations).
+        """
+        ids = self._ids
+        dictionary = []
+        sequences = bytearray()
+        _put_varint(sequences, len(segmentations))
+        for item in segmentations:
+            if isinstance(item, str):
+                item = Segmentation.parse(item)
+
+            morphemes = item.morphemes
+            _put_varint(sequences, len(morphemes))
+            for morpheme_id in morphemes:
+                file_id = ids.get(morpheme_id)
+                if file_id is None:
+                    file_id = ids[morpheme_id] = len(ids)
+                    dictionary.append(morpheme_token(morpheme_id))
+                _put_varint(sequences, file_id)
+
+        payload = bytearray()
+        _put_varint(payload, len(dictionary))
+        for token in dictionary:
+            token = token.encode()
+            _put_varint(payload, len(token))
+            payload += token
+        payload += sequences
+
+        flags = 0
+        if self.compression_level:
+            payload = zlib.compress(payload, self.compression_level)
+            flags |= _compressed
+
+        self.stream.write(b'B' + struct.pack('>BI', flags, len(payload)))
+        self.stream.write(payload)
+
+    def close(self):
+        self.stream.write(b'E')
+        self.stream.flush()
+
+
+def read_blocks(stream):
+    """
+    Читает двоичный файл разбиений из байтового потока `stream` и
+    возвращает его блоки парами (новые морфемы, список последовательностей
+    номеров морфем), где морфемы заданы строками 'тип_текст'.
+
+    Reads binary segmentations file from bytes `stream` and yields its blocks
+    as (new morphemes, list of morphemes' ids sequences) pairs where
+    morphemes are given as 'type_text' strings.
+    """
+    if stream.read(len(magic)) != magic:
+        raise ValueError('Not a binary segmentations file')
+
+    while True:
+        mark = stream.read(1)
+        if mark == b'E':
+            return
+        if mark != b'B':
+            raise ValueError('Truncated binary segmentations file')
+
+        flags, length = struct.unpack('>BI', stream.read(5))
+        payload = stream.read(length)
+        if len(payload) != length:
+            raise ValueError('Truncated binary segmentations file')
+        if flags & _compressed:
+            payload = zlib.decompress(payload)
+
+        count, pos = _get_varint(payload, 0)
+        dictionary = []
+        for i in range(count):
+            length, pos = _get_varint(payload, pos)
+            dictionary.append(payload[pos:pos + length].decode())
+            pos += length
+
+        count, pos = _get_varint(payload, pos)
+        sequences = []
+        for i in range(count):
+            length, pos = _get_varint(payload, pos)
+            sequence = []
+            for j in range(length):
+                morpheme_id, pos = _get_varint(payload, pos)
+                sequence.append(morpheme_id)
+            sequences.append(sequence)
+
+        yield dictionary, sequences
+
+def _intern_token(token):
+    if token == '':
+        return empty_morpheme
+
+    return intern_morpheme(*token.split('_', 1))
+
+def read_segmentations(stream):
+    """
+    Потоково читает разбиения (объекты `Segmentation`) из двоичного файла.
+
+    Streams segmentations (`Segmentation` objects) from binary file.
+    """
+    ids = []
+    for dictionary, sequences in read_blocks(stream):
+        ids.extend(map(_intern_token, dictionary))
+        for sequence in sequences:
+            yield Segmentation(tuple(ids[file_id] for file_id in sequence))
+
+def read_line_blocks(stream):
+    """
+    Потоково читает разбиения из двоичного файла в текстовом виде,
+    списком строк на каждый блок.
+
+    Streams segmentations from binary file in text form, as list of lines
+    per block.
+    """
+    tokens = []
+    for dictionary, sequences in read_blocks(stream):
+        tokens.extend(dictionary)
+        yield [' '.join([tokens[file_id] for file_id in sequence]) for sequence in sequences]
+
+def read_lines(stream):
+    """
+    Потоково читает разбиения из двоичного файла в текстовом виде.
+
+    Streams segmentations from binary file in text form.
+    """
+    for lines in read_line_blocks(stream):
+        yield from lines
+
+
+def convert_to_text(stream, output):
+    """
+    Переводит двоичный файл разбиений `stream` в текстовый `output`,
+    записывая каждый блок за раз.
+
+    Converts binary segmentations file `stream` into text `output`, writing
+    each block at once.
+    """
+    for lines in read_line_blocks(stream):
+        if lines:
+            lines.append('')
+            output.write('\n'.join(lines))
+
+
+def main(args):
+    with args.input:
+        convert_to_text(args.input, args.output)
+    args.output.close()
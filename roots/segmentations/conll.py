@@ -0,0 +1,188 @@
+"""
+Перевод разбиений в типичный CoNLL формат с двумя столбцами - буквой и
+частью слова. Файлы читаются потоково пачками строк, пачки переводятся
+параллельно и пишутся в исходном порядке. По желанию за тот же проход
+слова раскладываются по обучающей, проверочной и тестовой выборкам.
+
+Conversion of segmentations into standard CoNLL format with two columns -
+letter and part type. Files are streamed in chunks of lines, chunks are
+converted in parallel and written in original order. Optionally words are
+split into train, dev and test shards in the same pass.
+"""
+
+import math
+import zlib
+import argparse
+import functools
+
+import logging
+logger = logging.getLogger(__name__)
+
+import rwe.parallel
+import rwe.segmentations.index
+
+
+"""
+Число строк в пачке, отправляемой на перевод.
+
+Number of lines in chunk sent for conversion.
+"""
+default_lines_per_chunk = 10000
+
+"""
+Имена выборок в порядке задания их долей.
+
+Shards' names in order of their fractions.
+"""
+shard_names = ['train', 'dev', 'test']
+
+
+def transform(lines):
+    """
+    Переводит разбиения `lines` в CoNLL и возвращает результат одной строкой.
+
+    Converts `lines` segmentations into CoNLL and returns result as one string.
+    """
+    out = []
+    for line in lines:
+        for token in line.split():
+            part_type, _, part = token.partition('_')
+            # Why we have to have such check at all?
+            if part == '': continue
+
+            out.append(part[0] + ' ' + part_type + '_начало\n')
+            suffix = ' ' + part_type + '\n'
+            for letter in part[1:]:
+                out.append(letter + suffix)
+
+        out.append('\n')
+
+    return ''.join(out)
+
+def word_key(line):
+    """
+    Возвращает ключ выборки для разбиения `line`: его корни (или саму
+    строку, если корней нет). Формы одного слова отличаются окончаниями и
+    суффиксами, но не корнями, так что ключ у них общий.
+
+    Returns shard key for `line` segmentation: its roots (or line itself if
+    there are no roots). Forms of one word differ in endings and suffixes
+    but not in roots, so they share the key.
+    """
+    roots = [token for token in line.split() if token.startswith('корень')]
+    return ' '.join(roots) or line
+
+def shard_of(line, bounds):
+    """
+    Возвращает номер выборки для разбиения `line` по накопленным долям
+    выборок `bounds`. Выборка зависит только от корней слова (см.
+    `word_key`), так что все формы слова (и слова с теми же корнями)
+    попадают в одну выборку, а разбиение на выборки одинаково при любом
+    числе процессов. Формы с чередованием в корне могут разойтись.
+
+    Returns shard number for `line` segmentation by shards' cumulative
+    fractions `bounds`. Shard depends only on word's roots (see `word_key`),
+    so all forms of word (and words with the same roots) go into the same
+    shard, and sharding is the same regardless of processes count. Forms
+    with alternating root may still be split.
+    """
+    position = (zlib.crc32(word_key(line).encode()) & 0xffffffff) / 0x100000000
+    for i, bound in enumerate(bounds):
+        if position < bound:
+            return i
+
+    return len(bounds) - 1
+
+def _transform_chunk(bounds, lines):
+    if bounds is None:
+        return [transform(lines)]
+
+    shards = [[] for bound in bounds]
+    for line in lines:
+        shards[shard_of(line, bounds)].append(line)
+
+    return [transform(shard) for shard in shards]
+
+
+def shard_fractions(string):
+    """
+    Разбирает доли выборок 'train,dev[,test]' для argparse: долей должно
+    быть 2 или 3, и все они должны быть положительными числами.
+
+    Parses 'train,dev[,test]' shards' fractions for argparse: there must be
+    2 or 3 fractions, all of them positive numbers.
+    """
+    try:
+        fractions = [float(fraction) for fraction in string.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('fractions must be numbers: ' + string)
+
+    if not 2 <= len(fractions) <= len(shard_names):
+        raise argparse.ArgumentTypeError('expected 2 or 3 shards fractions, got ' + string)
+    if not all(fraction > 0 and math.isfinite(fraction) for fraction in fractions):
+        raise argparse.ArgumentTypeError('fractions must be positive: ' + string)
+
+    return fractions
+
+def _bounds(fractions):
+    if fractions is None:
+        return None
+
+    total = sum(fractions)
+    bounds = []
+    accumulated = 0
+    for fraction in fractions:
+        accumulated += fraction
+        bounds.append(accumulated / total)
+
+    return bounds
+
+def output_files(filename, fractions=None):
+    """
+    Возвращает имена выходных файлов для `filename`: один .conll файл
+    или по файлу на выборку.
+
+    Returns output files' names for `filename`: single .conll file or
+    file per shard.
+    """
+    if fractions is None:
+        return [filename + '.conll']
+
+    return ['{}.{}.conll'.format(filename, name) for name in shard_names[:len(fractions)]]
+
+def convert_files(filenames, executor=None, lines_per_chunk=default_lines_per_chunk, fractions=None):
+    """
+    Переводит файлы разбиений `filenames` (текстовые или двоичные) в CoNLL,
+    сохраняя результат рядом (см. `output_files`). Пачки по `lines_per_chunk`
+    строк переводятся исполнителем `executor`. Если заданы доли выборок
+    `fractions` (обучающей, проверочной и, возможно, тестовой), слова
+    раскладываются по выборкам.
+
+    Converts `filenames` segmentations files (text or binary) into CoNLL,
+    saving result next to them (see `output_files`). Chunks of
+    `lines_per_chunk` lines are converted by `executor`. If shards'
+    `fractions` are given (train, dev and, possibly, test), words are split
+    into shards.
+    """
+    if executor is None:
+        executor = rwe.parallel.create_executor('serial')
+
+    fn = functools.partial(_transform_chunk, _bounds(fractions))
+    for filename in filenames:
+        outputs = [open(output_file, 'w') for output_file in output_files(filename, fractions)]
+        try:
+            lines = rwe.segmentations.index.read_segmentation_lines(filename)
+            for converted in rwe.parallel.imap(executor, fn, rwe.parallel.chunks(lines, lines_per_chunk)):
+                for output, text in zip(outputs, converted):
+                    output.write(text)
+        finally:
+            for output in outputs:
+                output.close()
+
+        logger.info('Converted %s', filename)
+
+
+def main(args):
+    executor = rwe.parallel.create_executor(args.backend, args.jobs, args.max_pending)
+    convert_files(args.files, executor, args.lines_per_chunk, args.shards)
+    executor.shutdown()
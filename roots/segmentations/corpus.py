@@ -0,0 +1,353 @@
+"""
+Разметка корпусов в формате CoNLL с деревьями зависимостей (10 столбцов):
+слова из столбца FORM разбиваются на морфемы, которые добавляются после
+столбца FEATS отдельными столбцами прист, корень, суфф и оконч (как делает
+stanford-crf/RussianConllSegmenter.java). Частоты слов в корпусах
+распределены по Ципфу, поэтому сначала слово ищется в индексе извлечённых
+разбиений (см. `index`) с кэшем ответов, и только незнакомые слова
+отдаются запасному разбивателю (по умолчанию см. `segmenter`).
+
+Annotation of CoNLL dependency trees corpora (10 columns): words from FORM
+column are segmented into morphemes which are appended after FEATS column
+as separate прист, корень, суфф and оконч columns (as
+stanford-crf/RussianConllSegmenter.java does). Words' frequencies in
+corpora are Zipfian, so word is looked up in extracted segmentations'
+index (see `index`) with answers cache first, and only unknown words are
+passed to fallback segmenter (see `segmenter` by default).
+"""
+
+import re
+import json
+import functools
+import threading
+import collections
+
+import logging
+logger = logging.getLogger(__name__)
+
+from rwe.segmentations.segmentation import Segmentation
+import rwe.parallel
+import rwe.segmentations.index
+import rwe.segmentations.segmenter
+
+
+"""
+Части речи (столбец POSTAG), слова которых не размечаются.
+
+Parts of speech (POSTAG column) which words are not annotated.
+"""
+ignored_pos = frozenset(['PR', 'COM', 'CONJ', 'PART', 'P', 'INTJ', 'NID'])
+
+"""
+Добавляемые столбцы: типы морфем в порядке столбцов.
+
+Appended columns: morphemes' types in columns' order.
+"""
+morpheme_columns = ['прист', 'корень', 'суфф', 'оконч']
+
+columns_count = 10
+_feats_column = 6
+_parts_separator = re.compile('[ -]')
+
+"""
+Число кэшируемых разбиений слов в процессе и число предложений в пачке,
+отправляемой на разметку.
+
+Number of words' segmentations cached per process and number of sentences
+in chunk sent for annotation.
+"""
+default_cache_size = 262144
+default_sentences_per_chunk = 1000
+
+"""
+Источники разбиения слова: индекс, запасной разбиватель или никакой.
+
+Sources of word segmentation: index, fallback segmenter or none.
+"""
+sources = ('known', 'fallback', 'missing')
+
+
+def _recut(part, pairs):
+    """
+    Нарезает `part` по морфемам `pairs`, сохраняя регистр букв слова.
+    Извлечение удаляет ь и ъ из морфем (см. `index.key_form`), поэтому
+    недостающие в морфемах знаки возвращаются в морфему, за которой они
+    идут. Возвращает None, если `part` не складывается из морфем `pairs`.
+
+    Cuts `part` by `pairs` morphemes keeping letters' case of word.
+    Extraction removes ь and ъ from morphemes (see `index.key_form`), so
+    signs missing in morphemes are put back into morpheme they follow.
+    Returns None if `part` doesn't consist of `pairs` morphemes.
+    """
+    word = part.lower()
+    # number of morpheme for every letter of word
+    owners = []
+    position = 0
+    for i, (part_type, text) in enumerate(pairs):
+        for letter in text:
+            while position < len(word) and word[position] != letter and word[position] in rwe.segmentations.index.signs:
+                owners.append(owners[-1] if owners else i)
+                position += 1
+            if position == len(word) or word[position] != letter:
+                return
+            owners.append(i)
+            position += 1
+
+    while owners and position < len(word) and word[position] in rwe.segmentations.index.signs:
+        owners.append(owners[-1])
+        position += 1
+    if position != len(word):
+        return
+
+    morphemes = []
+    start = 0
+    for i, (part_type, text) in enumerate(pairs):
+        end = start
+        while end < len(owners) and owners[end] == i:
+            end += 1
+        morphemes.append((part_type, part[start:end]))
+        start = end
+    return tuple(morphemes)
+
+
+class Annotator(object):
+    """
+    Разметчик предложений CoNLL. Разбиения ищутся в индексе `known`
+    (`SegmentationIndex` или None), а незнакомые слова разбиваются функцией
+    `fallback` ('слово' -> `Segmentation` или None), если она задана.
+    Разбиения `cache_size` последних слов кэшируются.
+
+    CoNLL sentences annotator. Segmentations are looked up in `known` index
+    (`SegmentationIndex` or None), and unknown words are segmented with
+    `fallback` function ('word' -> `Segmentation` or None) if given.
+    Segmentations of `cache_size` latest words are cached.
+    """
+
+    def __init__(self, known=None, fallback=None, cache_size=default_cache_size):
+        self.known = known
+        self.fallback = fallback
+        self.counts = collections.Counter()
+        self.segment = functools.lru_cache(maxsize=cache_size)(self._segment)
+
+    def _segment(self, part):
+        """
+        Возвращает источник разбиения `part` и его морфемы парами (тип, текст).
+
+        Returns source of `part` segmentation and its morphemes as (type, text) pairs.
+        """
+        word = part.lower()
+        if self.known is not None:
+            # exact spellings come first, words sharing key without signs don't fit
+            for segmentation in self.known.lookup(word):
+                morphemes = _recut(part, Segmentation.parse(segmentation).pairs())
+                if morphemes is not None:
+                    return 'known', morphemes
+
+        if self.fallback is not None:
+            segmentation = self.fallback(word)
+            if segmentation is not None:
+                morphemes = _recut(part, segmentation.pairs())
+                if morphemes is not None:
+                    return 'fallback', morphemes
+
+        return 'missing', ()
+
+    def columns(self, form, pos):
+        """
+        Возвращает значения добавляемых столбцов для слова `form` с частью
+        речи `pos`; несколько морфем одного типа разделяются '|'.
+
+        Returns appended columns' values for `form` word with `pos` part of
+        speech; several morphemes of the same type are separated by '|'.
+        """
+        columns = dict.fromkeys(morpheme_columns, '_')
+        if pos in ignored_pos:
+            self.counts['ignored'] += 1
+            return [columns[part_type] for part_type in morpheme_columns]
+
+        for part in _parts_separator.split(form):
+            if len(part) < 2:
+                continue
+
+            source, morphemes = self.segment(part)
+            self.counts[source] += 1
+            for part_type, text in morphemes:
+                column = columns.get(part_type)
+                if column is None:
+                    continue
+                columns[part_type] = text if column == '_' else column + '|' + text
+
+        return [columns[part_type] for part_type in morpheme_columns]
+
+    def annotate(self, sentence):
+        """
+        Размечает предложение `sentence` (список строк CoNLL) и возвращает
+        его строкой с пустой строкой в конце.
+
+        Annotates `sentence` (list of CoNLL lines) and returns it as string
+        ending with empty line.
+        """
+        out = []
+        for line in sentence:
+            fields = line.split('\t')
+            if len(fields) != columns_count:
+                raise ValueError('Expected {} columns but got {} on line:\n{}'.format(columns_count, len(fields), line))
+
+            self.counts['tokens'] += 1
+            fields[_feats_column:_feats_column] = self.columns(fields[1], fields[4])
+            out.append('\t'.join(fields))
+            out.append('\n')
+
+        out.append('\n')
+        return ''.join(out)
+
+    def annotate_many(self, sentences):
+        """
+        Размечает предложения `sentences` и возвращает результат одной
+        строкой и счётчики, накопленные за этот вызов (включая попадания
+        в кэш).
+
+        Annotates `sentences` and returns result as one string and counters
+        accumulated during this call (including cache hits).
+        """
+        self.counts = collections.Counter()
+        before = self.segment.cache_info()
+        text = ''.join(self.annotate(sentence) for sentence in sentences)
+        after = self.segment.cache_info()
+        self.counts['cache_hits'] += after.hits - before.hits
+        self.counts['cache_misses'] += after.misses - before.misses
+        return text, self.counts
+
+
+def read_sentences(conll_file):
+    """
+    Читает предложения (списки строк без перевода строки) из открытого
+    файла CoNLL, разделённые пустыми строками.
+
+    Reads sentences (lists of lines without newline) separated by empty lines
+    from opened CoNLL file.
+    """
+    sentence = []
+    for line in conll_file:
+        line = line.rstrip('\n')
+        if line.strip() == '':
+            if sentence:
+                yield sentence
+                sentence = []
+        else:
+            sentence.append(line)
+
+    if sentence:
+        yield sentence
+
+def output_file(filename):
+    """
+    Возвращает имя размеченного файла: *.segmented.conll для *.conll,
+    иначе *.segmented.
+
+    Returns annotated file name: *.segmented.conll for *.conll,
+    otherwise *.segmented.
+    """
+    if filename.endswith('.conll'):
+        return filename[:-len('.conll')] + '.segmented.conll'
+    return filename + '.segmented'
+
+
+"""
+Разметчики потока-обработчика, создаваемые при первом использовании: у
+каждого потока свои счётчики и кэш.
+
+Worker thread annotators created on first use: every thread has its own
+counters and cache.
+"""
+_local = threading.local()
+
+def get_annotator(index_file=None, segmenter_lists=None, cache_size=default_cache_size):
+    """
+    Возвращает разметчик по индексу `index_file` с разбивателем из `segmenter`
+    по спискам морфем `segmenter_lists` (каталог морфем, файлы окончаний
+    и суффиксов) в качестве запасного, если они заданы. Разметчик создаётся
+    один раз на поток.
+
+    Returns annotator over `index_file` index with `segmenter` segmenter
+    over `segmenter_lists` morphemes lists (morphemes directory, inflexions
+    and suffixies files) as fallback if given. Annotator is created once per
+    thread.
+    """
+    annotators = getattr(_local, 'annotators', None)
+    if annotators is None:
+        annotators = _local.annotators = {}
+
+    key = (index_file, segmenter_lists, cache_size)
+    annotator = annotators.get(key)
+    if annotator is None:
+        known = rwe.segmentations.index.SegmentationIndex(index_file) if index_file is not None else None
+        fallback = rwe.segmentations.segmenter.get_segmenter(*segmenter_lists).segment_word if segmenter_lists is not None else None
+        annotator = annotators[key] = Annotator(known, fallback, cache_size)
+    return annotator
+
+def _annotate_chunk(key, sentences):
+    return get_annotator(*key).annotate_many(sentences)
+
+
+def hit_rates(counts):
+    """
+    Дополняет счётчики `counts` долями слов из индекса, от запасного
+    разбивателя и без разбиения, а также долей попаданий в кэш.
+
+    Complements `counts` counters with shares of words from index, from
+    fallback segmenter and without segmentation, and with cache hit rate.
+    """
+    report = {source: counts[source] for source in sources}
+    report.update(counts)
+    words = sum(counts[source] for source in sources)
+    for source in sources:
+        report[source + '_rate'] = counts[source] / words if words else 0.0
+
+    lookups = counts['cache_hits'] + counts['cache_misses']
+    report['cache_hit_rate'] = counts['cache_hits'] / lookups if lookups else 0.0
+    return report
+
+def annotate_files(filenames, executor=None, index_file=None, segmenter_lists=None, cache_size=default_cache_size, sentences_per_chunk=default_sentences_per_chunk):
+    """
+    Размечает файлы CoNLL `filenames`, сохраняя результат рядом
+    (см. `output_file`), и возвращает общие счётчики (см. `hit_rates`).
+    Пачки по `sentences_per_chunk` предложений размечаются исполнителем
+    `executor` разметчиками `get_annotator`.
+
+    Annotates `filenames` CoNLL files, saving result next to them
+    (see `output_file`), and returns total counters (see `hit_rates`).
+    Chunks of `sentences_per_chunk` sentences are annotated by `executor`
+    with `get_annotator` annotators.
+    """
+    if executor is None:
+        executor = rwe.parallel.create_executor('serial')
+
+    fn = functools.partial(_annotate_chunk, (index_file, segmenter_lists, cache_size))
+    counts = collections.Counter()
+    for filename in filenames:
+        with open(filename, 'r') as f, open(output_file(filename), 'w') as output:
+            for text, chunk_counts in rwe.parallel.imap(executor, fn, rwe.parallel.chunks(read_sentences(f), sentences_per_chunk)):
+                output.write(text)
+                counts.update(chunk_counts)
+
+        logger.info('Annotated %s', filename)
+
+    return hit_rates(counts)
+
+
+def main(args):
+    index_file = None
+    if args.segmentations is not None:
+        index_file = rwe.segmentations.index.ensure_index(args.segmentations)
+
+    segmenter_lists = None
+    if args.fallback == 'segmenter':
+        segmenter_lists = (args.morphemes_directory, args.inflexions.name, args.suffixies.name)
+
+    executor = rwe.parallel.create_executor(args.backend, args.jobs, args.max_pending)
+    report = annotate_files(args.files, executor, index_file, segmenter_lists, args.cache_size, args.sentences_per_chunk)
+    executor.shutdown()
+
+    print(json.dumps(report, indent=1), file=args.output)
+    args.output.close()
@@ -0,0 +1,319 @@
+"""
+Признаки букв для обучения разбиения на морфемы, как в
+stanford-crf/MorphoFeaturesFactory.java: буква с соседями, n-граммы букв,
+позиция от начала и конца слова и начала и концы морфем словаря
+(см. `segmenter`). Разбиения читаются потоково и переводятся пачками в
+разреженные матрицы SciPy (строка на букву) и массивы NumPy меток букв
+(как в `conll`: 'тип_начало' для первой буквы морфемы, иначе 'тип') и
+длин слов, так что пачки можно подавать любому CRF или линейному
+обучателю. Признаки хэшируются в `n_features` столбцов, поэтому пачки
+строятся параллельно без общего словаря признаков.
+
+NumPy и SciPy - необязательные зависимости, нужные только этому модулю.
+
+Letters' features for training morphemes segmentation, as in
+stanford-crf/MorphoFeaturesFactory.java: letter with neighbours, letters'
+n-grams, position from word's start and end, and starts and ends of
+dictionary morphemes (see `segmenter`). Segmentations are streamed and
+converted in batches into SciPy sparse matrices (row per letter) and NumPy
+arrays of letters' labels (as in `conll`: 'type_начало' for first letter of
+morpheme, 'type' otherwise) and words' lengths, so batches may be fed to any
+CRF or linear trainer. Features are hashed into `n_features` columns, so
+batches are built in parallel without shared features dictionary.
+
+NumPy and SciPy are optional dependencies required by this module only.
+"""
+
+import os
+import zlib
+import array
+import functools
+import collections
+
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy
+    import scipy.sparse
+except ImportError:
+    numpy = None
+
+import rwe.parallel
+import rwe.segmentations.index
+import rwe.segmentations.segmenter
+
+
+"""
+Число столбцов матрицы признаков, наибольшая длина n-грамм букв и число
+слов в пачке по умолчанию.
+
+Default number of features matrix columns, maximum length of letters'
+n-grams and number of words in batch.
+"""
+default_n_features = 2 ** 20
+default_ngram = 3
+default_batch_size = 10000
+
+"""
+Границы слова, дополняющие его при выборе соседей и n-грамм.
+
+Word boundaries padding it for neighbours and n-grams.
+"""
+word_start = '^'
+word_end = '$'
+
+FeatureBatch = collections.namedtuple('FeatureBatch', ['features', 'labels', 'lengths', 'words'])
+FeatureBatch.__doc__ = """
+Пачка признаков: разреженная матрица `features` (буквы x признаки), номера
+меток букв `labels`, длины слов `lengths` (границы последовательностей
+для CRF) и сами слова `words`.
+
+Features batch: `features` sparse matrix (letters x features), letters'
+labels ids `labels`, words' lengths `lengths` (sequences boundaries for CRF)
+and `words` themselves.
+"""
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError('Features extraction requires numpy and scipy (pip install numpy scipy)')
+
+
+def letter_labels(segmentation):
+    """
+    Возвращает слово и метки его букв для разбиения, заданного строкой
+    'тип_текст тип_текст'.
+
+    Returns word and its letters' labels for segmentation given as
+    'type_text type_text' string.
+    """
+    word = []
+    labels = []
+    for token in segmentation.split():
+        part_type, _, part = token.partition('_')
+        if part == '':
+            continue
+
+        word.append(part)
+        labels.append(part_type + '_начало')
+        labels.extend([part_type] * (len(part) - 1))
+
+    return ''.join(word), labels
+
+
+class _Columns(dict):
+    """
+    Кэш столбцов признаков: 'признак' -> crc32 признака по модулю `n_features`.
+
+    Features' columns cache: 'feature' -> feature's crc32 modulo `n_features`.
+    """
+
+    def __init__(self, n_features):
+        self.n_features = n_features
+
+    def __missing__(self, feature):
+        column = self[feature] = zlib.crc32(feature.encode()) % self.n_features
+        return column
+
+
+class FeatureExtractor(object):
+    """
+    Вычисляет хэшированные признаки букв слов по словарю морфем
+    `segmenter` (`Segmenter`).
+
+    Computes hashed letters' features of words with `segmenter`
+    (`Segmenter`) morphemes dictionary.
+    """
+
+    def __init__(self, segmenter, n_features=default_n_features, ngram=default_ngram):
+        self.segmenter = segmenter
+        self.n_features = n_features
+        self.ngram = ngram
+        self._columns = _Columns(n_features)
+
+    def letter_features(self, word):
+        """
+        Возвращает списки различных названий признаков для каждой буквы слова `word`.
+
+        Returns lists of distinct features' names for every letter of `word`.
+        """
+        n = len(word)
+        padded = word_start + word + word_end
+
+        starts = [[] for i in range(n + 1)]
+        ends = [[] for i in range(n + 1)]
+        for start in range(n):
+            for end, types in self.segmenter.matches(word, start):
+                morpheme = word[start:end]
+                for morpheme_type in types:
+                    starts[start].append('START-OF-' + morpheme_type + '-TYPE-MORPHEME')
+                    ends[end].append('END-OF-' + morpheme_type + '-TYPE-MORPHEME')
+                starts[start].append('START-OF-' + morpheme + '-MORPHEME')
+                ends[end].append('END-OF-' + morpheme + '-MORPHEME')
+
+        letters = []
+        for i in range(n):
+            p, c, nx = padded[i], padded[i + 1], padded[i + 2]
+            features = [
+                p + '-' + c + '-PWORD-WORD',
+                c + '-WORD',
+                c + '-' + nx + '-WORD-NWORD',
+                '%d-POSITION' % i,
+                '%d-BACK-POSITION' % (n - i),
+            ]
+            # bigrams are covered by PWORD-WORD and WORD-NWORD
+            for k in range(3, self.ngram + 1):
+                if i + 2 >= k:
+                    features.append(padded[i + 2 - k:i + 2] + '-LEFT-NGRAM')
+                if i + 1 + k <= n + 2:
+                    features.append(padded[i + 1:i + 1 + k] + '-RIGHT-NGRAM')
+            # several dictionary morphemes of one type may start or end here, features are a set as in MorphoFeaturesFactory
+            features.extend(dict.fromkeys(starts[i]))
+            features.extend(dict.fromkeys(ends[i]))
+            letters.append(features)
+
+        return letters
+
+    def extract(self, segmentations):
+        """
+        Вычисляет признаки разбиений `segmentations` (строк) и возвращает
+        массивы CSR (indices, indptr), метки букв в виде (список меток,
+        их номера), длины слов и слова.
+
+        Computes features of `segmentations` (strings) and returns CSR
+        arrays (indices, indptr), letters' labels as (labels list, their
+        ids), words' lengths and words.
+        """
+        columns = self._columns
+        indices = array.array('i')
+        indptr = array.array('q', [0])
+        local_labels = {}
+        label_ids = array.array('i')
+        lengths = array.array('i')
+        words = []
+
+        for segmentation in segmentations:
+            word, labels = letter_labels(segmentation)
+            if not word:
+                continue
+
+            for features in self.letter_features(word):
+                # sorted distinct columns keep CSR canonical and binary even on hash collisions
+                indices.extend(sorted({columns[feature] for feature in features}))
+                indptr.append(len(indices))
+            label_ids.extend([local_labels.setdefault(label, len(local_labels)) for label in labels])
+            lengths.append(len(word))
+            words.append(word)
+
+        return (numpy.frombuffer(indices, dtype=numpy.int32), numpy.frombuffer(indptr, dtype=numpy.int64),
+                list(local_labels), numpy.frombuffer(label_ids, dtype=numpy.int32), numpy.frombuffer(lengths, dtype=numpy.int32), words)
+
+
+"""
+Вычислители признаков процесса-обработчика, создаваемые при первом
+использовании.
+
+Worker process features extractors created on first use.
+"""
+_extractors = {}
+
+def get_extractor(segmenter_lists, n_features=default_n_features, ngram=default_ngram):
+    """
+    Возвращает вычислитель признаков со словарём морфем `get_segmenter`
+    по спискам `segmenter_lists` (каталог морфем, файлы окончаний и
+    суффиксов), создавая его один раз на процесс.
+
+    Returns features extractor with `get_segmenter` morphemes dictionary
+    over `segmenter_lists` lists (morphemes directory, inflexions and
+    suffixies files), creating it once per process.
+    """
+    key = (segmenter_lists, n_features, ngram)
+    extractor = _extractors.get(key)
+    if extractor is None:
+        segmenter = rwe.segmentations.segmenter.get_segmenter(*segmenter_lists)
+        extractor = _extractors[key] = FeatureExtractor(segmenter, n_features, ngram)
+    return extractor
+
+def _extract_chunk(key, segmentations):
+    return get_extractor(*key).extract(segmentations)
+
+
+def iter_batches(segmentations, executor=None, batch_size=default_batch_size, labels=None, n_features=default_n_features, ngram=default_ngram, segmenter_lists=None):
+    """
+    Потоково переводит разбиения `segmentations` (строки) в пачки
+    `FeatureBatch` по `batch_size` слов, по желанию параллельно с помощью
+    `executor`. Номера меток берутся из словаря `labels` ('метка' -> номер),
+    который дополняется новыми метками, так что метки согласованы между
+    пачками; названия меток по номерам - `label_names(labels)`.
+
+    Streams `segmentations` (strings) into `FeatureBatch` batches of
+    `batch_size` words, optionally in parallel with `executor`. Labels' ids
+    are taken from `labels` dict ('label' -> id) which is extended with new
+    labels, so labels are consistent across batches; labels' names by ids
+    are `label_names(labels)`.
+    """
+    _require_numpy()
+    if executor is None:
+        executor = rwe.parallel.create_executor('serial')
+    if labels is None:
+        labels = {}
+    if segmenter_lists is None:
+        segmenter_lists = (rwe.segmentations.segmenter.default_morphemes_directory, rwe.segmentations.segmenter.default_inflexions_file, rwe.segmentations.segmenter.default_suffixies_file)
+
+    fn = functools.partial(_extract_chunk, (segmenter_lists, n_features, ngram))
+    for indices, indptr, local_labels, label_ids, lengths, words in rwe.parallel.imap(executor, fn, rwe.parallel.chunks(segmentations, batch_size)):
+        mapping = numpy.array([labels.setdefault(label, len(labels)) for label in local_labels], dtype=numpy.int32)
+        features = scipy.sparse.csr_matrix((numpy.ones(len(indices), dtype=numpy.float32), indices, indptr), shape=(len(indptr) - 1, n_features))
+        yield FeatureBatch(features, mapping[label_ids], lengths, words)
+
+def label_names(labels):
+    """
+    Возвращает список названий меток по их номерам из словаря `labels`.
+
+    Returns list of labels' names by their ids from `labels` dict.
+    """
+    return sorted(labels, key=labels.get)
+
+
+def save_batch(batch, batch_file):
+    """
+    Сохраняет пачку `batch` в файл .npz `batch_file` (без слов).
+
+    Saves `batch` into `batch_file` .npz file (without words).
+    """
+    features = batch.features
+    numpy.savez(batch_file, data=features.data, indices=features.indices, indptr=features.indptr, shape=features.shape, labels=batch.labels, lengths=batch.lengths)
+
+def load_batch(batch_file):
+    """
+    Загружает пачку, сохранённую `save_batch`; слова не восстанавливаются.
+
+    Loads batch saved with `save_batch`; words are not restored.
+    """
+    _require_numpy()
+    with numpy.load(batch_file) as f:
+        features = scipy.sparse.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+        return FeatureBatch(features, f['labels'], f['lengths'], None)
+
+
+def main(args):
+    _require_numpy()
+    executor = rwe.parallel.create_executor(args.backend, args.jobs, args.max_pending)
+    segmenter_lists = (args.morphemes_directory, args.inflexions.name, args.suffixies.name)
+    os.makedirs(args.output_directory, exist_ok=True)
+
+    labels = {}
+    letters = words = 0
+    segmentations = rwe.segmentations.index.read_segmentation_lines(args.segmentations)
+    for i, batch in enumerate(iter_batches(segmentations, executor, args.batch_size, labels, args.n_features, args.ngram, segmenter_lists)):
+        save_batch(batch, os.path.join(args.output_directory, 'batch-{:05d}.npz'.format(i)))
+        letters += batch.features.shape[0]
+        words += len(batch.lengths)
+    executor.shutdown()
+
+    with open(os.path.join(args.output_directory, 'labels.txt'), 'w') as f:
+        for label in label_names(labels):
+            print(label, file=f)
+
+    print('Extracted features of', words, 'words,', letters, 'letters into', args.output_directory)
@@ -0,0 +1,268 @@
+"""
+Индекс разбиений по словоформам: отсортированная таблица строк на диске,
+читаемая через mmap, так что индекс не загружается в память и может
+одновременно использоваться многими процессами.
+
+    файл   := magic число(8 байт) смещения((число + 1) * 8 байт) записи
+    запись := словоформа '\\t' разбиение '\\n'
+
+Записи отсортированы по байтам utf8 словоформы, затем разбиения; смещения
+записей отсчитываются от начала первой записи. Словоформы хранятся без ь и
+ъ (см. `key_form`), поскольку при извлечении они удаляются из морфем.
+
+Segmentations index by word forms: on-disk sorted string table read through
+mmap, so index is not loaded into memory and may be shared by many
+processes at once.
+
+    file   := magic count(8 bytes) offsets((count + 1) * 8 bytes) records
+    record := word form '\\t' segmentation '\\n'
+
+Records are sorted by utf8 bytes of word form, then of segmentation; records'
+offsets are counted from the start of first record. Word forms are stored
+without ь and ъ (see `key_form`), as extraction removes them from morphemes.
+"""
+
+import os
+import mmap
+import struct
+
+import logging
+logger = logging.getLogger(__name__)
+
+import rwe.segmentations.binary
+
+
+magic = b'RWEIDX2\n'
+_header = struct.Struct('<Q')
+
+signs = 'ьъ'
+_signs_removal = str.maketrans('', '', signs)
+
+
+def surface_form(segmentation):
+    """
+    Возвращает словоформу разбиения, заданного строкой 'тип_текст тип_текст'.
+
+    Returns word form of segmentation given as 'type_text type_text' string.
+    """
+    return ''.join(token.partition('_')[2] for token in segmentation.split(' '))
+
+def key_form(word):
+    """
+    Возвращает ключ индекса для словоформы `word`: словоформу без ь и ъ.
+    Извлечение удаляет их из морфем (но не из окончаний вроде -ть), так что
+    у «день» разбиение «корень_ден оконч_», и искать его надо по «ден».
+    Поэтому у разных слов ключ может совпасть («брать» и «брат», «уголь» и
+    «угол»), см. `SegmentationIndex.lookup`.
+
+    Returns index key for `word` form: word form without ь and ъ. Extraction
+    removes them from morphemes (but not from endings like -ть), so «день»
+    segmentation is «корень_ден оконч_» and it has to be looked up by «ден».
+    Hence different words may share key («брать» and «брат», «уголь» and
+    «угол»), see `SegmentationIndex.lookup`.
+    """
+    return word.translate(_signs_removal)
+
+def fits(word, form):
+    """
+    Проверяет, может ли `form` (словоформа разбиения) быть словом `word`
+    без части его ь и ъ.
+
+    Checks if `form` (segmentation's word form) may be `word` without some
+    of its ь and ъ.
+    """
+    position = 0
+    for letter in word:
+        if position < len(form) and form[position] == letter:
+            position += 1
+        elif letter not in signs:
+            return False
+
+    return position == len(form)
+
+def read_segmentation_lines(segmentations_file):
+    """
+    Читает разбиения в текстовом виде из текстового или двоичного файла
+    (формат определяется по заголовку).
+
+    Reads segmentations in text form from text or binary file (format
+    is detected by header).
+    """
+    with open(segmentations_file, 'rb') as f:
+        binary = f.read(len(rwe.segmentations.binary.magic)) == rwe.segmentations.binary.magic
+
+    if binary:
+        with open(segmentations_file, 'rb') as f:
+            yield from rwe.segmentations.binary.read_lines(f)
+    else:
+        with open(segmentations_file, 'r') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if line:
+                    yield line
+
+def build_index(segmentations, index_file):
+    """
+    Строит индекс `index_file` по разбиениям `segmentations` (строкам).
+    Повторяющиеся разбиения сохраняются один раз. Возвращает число записей.
+
+    Builds `index_file` index over `segmentations` (strings). Duplicate
+    segmentations are kept once. Returns number of records.
+    """
+    records = sorted(set((key_form(surface_form(segmentation)).encode(), segmentation.encode()) for segmentation in segmentations))
+
+    offsets = []
+    offset = 0
+    for key, value in records:
+        offsets.append(offset)
+        offset += len(key) + len(value) + 2
+    offsets.append(offset)
+
+    with open(index_file + '.tmp', 'wb') as f:
+        f.write(magic)
+        f.write(_header.pack(len(records)))
+        f.write(struct.pack('<{}Q'.format(len(offsets)), *offsets))
+        for key, value in records:
+            f.write(key + b'\t' + value + b'\n')
+    os.replace(index_file + '.tmp', index_file)
+
+    return len(records)
+
+def _is_index(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(magic)) == magic
+
+def ensure_index(segmentations_file):
+    """
+    Возвращает имя индекса: сам `segmentations_file`, если это индекс,
+    иначе индекс рядом с ним, построенный при необходимости.
+
+    Returns index file name: `segmentations_file` itself if it is index,
+    otherwise index next to it built if required.
+    """
+    if _is_index(segmentations_file):
+        return segmentations_file
+
+    index_file = segmentations_file + '.idx'
+    if not os.path.exists(index_file) or os.path.getmtime(index_file) < os.path.getmtime(segmentations_file) or not _is_index(index_file):
+        logger.info('Building index %s', index_file)
+        build_index(read_segmentation_lines(segmentations_file), index_file)
+
+    return index_file
+
+
+class SegmentationIndex(object):
+    """
+    Индекс разбиений `index_file`, открытый только для чтения через mmap.
+
+    Segmentations `index_file` index opened read-only through mmap.
+    """
+
+    def __init__(self, index_file):
+        with open(index_file, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(magic)] != magic:
+            self._mmap.close()
+            raise ValueError('Not a segmentations index: ' + index_file)
+
+        self._count, = _header.unpack_from(self._mmap, len(magic))
+        self._offsets = len(magic) + _header.size
+        self._records = self._offsets + (self._count + 1) * 8
+
+    def __len__(self):
+        return self._count
+
+    def _record(self, i):
+        start, end = struct.unpack_from('<QQ', self._mmap, self._offsets + 8 * i)
+        return self._records + start, self._records + end
+
+    def _key(self, i):
+        start, end = self._record(i)
+        return self._mmap[start:self._mmap.find(b'\t', start, end)]
+
+    def _lower_bound(self, key):
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def _scan(self, key, match, limit=None):
+        found = []
+        i = self._lower_bound(key)
+        while i < self._count and (limit is None or len(found) < limit):
+            start, end = self._record(i)
+            record = self._mmap[start:end - 1]
+            word, _, segmentation = record.partition(b'\t')
+            if not match(word):
+                break
+            found.append((word.decode(), segmentation.decode()))
+            i += 1
+
+        return found
+
+    def lookup(self, word):
+        """
+        Возвращает список разбиений словоформы `word`: сначала те, что дают
+        в точности `word`, затем те, что дают `word` без части ь и ъ (см.
+        `fits`). Среди последних могут быть разбиения другого слова с тем же
+        ключом (для «брать» - разбиение «брат»), различить их по индексу нельзя.
+
+        Returns list of `word` form segmentations: first those spelling
+        exactly `word`, then those spelling `word` without some of ь and ъ
+        (see `fits`). The latter may include segmentations of other word with
+        the same key (segmentation of «брат» for «брать»), index can't tell
+        them apart.
+        """
+        key = key_form(word).encode()
+        exact = []
+        other = []
+        for _, segmentation in self._scan(key, key.__eq__):
+            form = surface_form(segmentation)
+            if form == word:
+                exact.append(segmentation)
+            elif fits(word, form):
+                other.append(segmentation)
+
+        return exact + other
+
+    def prefix(self, prefix, limit=None):
+        """
+        Возвращает не более `limit` пар (словоформа, разбиение) для словоформ,
+        начинающихся с `prefix` (без учёта ь и ъ), в порядке сортировки.
+
+        Returns at most `limit` (word form, segmentation) pairs for word
+        forms starting with `prefix` (ignoring ь and ъ) in sorted order.
+        """
+        key = key_form(prefix).encode()
+        return [(surface_form(segmentation), segmentation) for _, segmentation in self._scan(key, lambda word: word.startswith(key), limit)]
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def build_main(args):
+    count = build_index(read_segmentation_lines(args.segmentations), args.index)
+    logger.info('Indexed %d segmentations into %s', count, args.index)
+
+def lookup_main(args):
+    with SegmentationIndex(args.index) as index:
+        for word in args.words:
+            if args.prefix:
+                for form, segmentation in index.prefix(word, args.limit):
+                    print(form, segmentation, sep='\t', file=args.output)
+            else:
+                for segmentation in index.lookup(word):
+                    print(word, segmentation, sep='\t', file=args.output)
+    args.output.close()
@@ -6,7 +6,6 @@ Functions for extraction of meta-information (templates invocations)
 from ruwiktionary dump for later extraction of segmentations.
 """
 
-import xml.etree.ElementTree as ET
 import re
 import sys
 import os
@@ -19,6 +18,9 @@ logger = logging.getLogger(__name__)
 
 
 from rwe.constants import *
+import rwe.parallel
+import rwe.dump
+import rwe.metrics
 
 def _extract_template(text, template_start_re):
     """
@@ -52,17 +54,30 @@ def _extract_template(text, template_start_re):
 
 lang = re.compile('{{-[a-z]{2,3}-}}')
 
+"""
+Предварительный фильтр страниц дампа: без секции {{-ru-}} и вызова {{морфо}}
+мета-информацию из страницы всё равно не извлечь. Отброшенные им страницы
+учитываются с теми же причинами, что и в `_handle_page`.
+
+Dump pages prefilter: there is no meta-information to extract from page
+without {{-ru-}} section and {{морфо}} call. Pages dropped by it are counted
+with the same reasons as in `_handle_page`.
+"""
+page_filters = [rwe.dump.PageFilter(None, ('{{-ru-}}', '{{морфо'), ('no -ru-', 'no morfo'))]
+
 english_to_russian = {'a': 'а', 'c': 'с', 'e': 'е', 'o': 'о', 'x': 'х'}
-def _handle_page(text, word, queue):
+def _handle_page(text, word):
     word = word.replace(stress, '')
     if not text or not re.match('[А-ЯЁ]?[а-яё]+', word):
         logger.debug('Skipping %s cause empty or not a russian word', word)
+        rwe.metrics.reject('not russian word')
         return
     word = word.lower()
 
     ru = re.search('{{-ru-}}', text)
     if not ru:
         logger.debug('Skipping %s cause no -ru-', word)
+        rwe.metrics.reject('no -ru-')
         return
 
     text = text[ru.start() + len('{{-ru-}}'):]
@@ -77,6 +92,7 @@ def _handle_page(text, word, queue):
     morf = _extract_template(text, '{{морфо')
     if morf is None:
         logger.debug('Skipping %s cause no morfs', word)
+        rwe.metrics.reject('no morfo')
         return
 
     morf = morf.lower()
@@ -87,14 +103,17 @@ def _handle_page(text, word, queue):
 
     if re.search('[^}{а-яёйj1-5|=-]', morf):
         logger.info('Skipping  %s %s cause strange symbols', word, morf)
+        rwe.metrics.reject('strange symbols')
         return
     if re.match('{{морфо(\|+[а-я-]+[1-5]?=)+}}', morf) or re.match('{{морфо\|+}}', morf):
         logger.debug('Skipping %s %s cause empty', word, morf)
+        rwe.metrics.reject('empty morfo')
         return
 
     table_template_call = _extract_template(text, '{{(прич|сущ|гл|мест|прил|числ) ru ')
     if table_template_call is None:
         logger.debug('No table call for %s', word)
+        rwe.metrics.reject('no table call')
         return
 
 
@@ -107,68 +126,88 @@ def _handle_page(text, word, queue):
     filtered_params = list(filtered_params)
     if len(filtered_params) == 0:
         logger.debug('Skipping %s cause no stems in table template call', word)
+        rwe.metrics.reject('no stems in table call')
         return
 
-    queue.put( (morf, template_name, filtered_params) )
-
+    return (morf, template_name, filtered_params)
 
+def _handle_pages(pages):
+    """
+    Обрабатывает пачку страниц дампа `pages` и возвращает список извлечённых
+    кортежей (морфо, имя шаблона, основы).
 
-def extract_meta_segmentations(dump_file):
-    
-    context = ET.iterparse(dump_file, events=("start", "end"))
-    context = iter(context)
-    event, root = next(context)
+    Handles chunk of dump `pages` and returns list of extracted
+    (morf, template name, stems) tuples.
+    """
+    extracted = []
+    with rwe.metrics.timer('metas.handle_pages'):
+        for page in pages:
+            try:
+                meta = _handle_page(page.text, page.title)
+            except Exception:
+                logger.exception('Failed to handle page %s', page.title)
+                rwe.metrics.reject('page handling error')
+                continue
 
-    page = False
-    word = ''
-    text = ''
+            if meta is not None:
+                extracted.append(meta)
 
-    import queue
-    import concurrent.futures
+    rwe.metrics.count('metas.pages', len(pages))
+    rwe.metrics.count('metas.extracted', len(extracted))
+    return extracted
 
-    executor = concurrent.futures.ThreadPoolExecutor(max_workers=8)
-    extracted_queue = queue.Queue()
 
-    count = 0
+class MetasConsumer(rwe.dump.Consumer):
+    """
+    Потребитель страниц дампа, накапливающий мета-информацию в памяти
+    для однопроходного чтения дампа.
 
-    for event, elem in context:
-        if elem.tag == page_tag:
-            if event == 'start':
-                page = True
-                continue
-            else:
-                executor.submit(_handle_page, text, word, extracted_queue)
-    
-        if page and event == "end" and elem.tag == title_tag:
-            word = elem.text
+    Dump pages consumer accumulating meta-segmentations in memory
+    for single-pass dump reading.
+    """
+    handler = staticmethod(_handle_pages)
+    page_filters = page_filters
 
-        if page and event == 'end' and elem.tag == text_tag:
-            text = elem.text
+    def __init__(self):
+        self.metas = []
 
-        if event == 'end':
-            elem.clear()
+    def consume(self, extracted_chunk):
+        self.metas.extend(extracted_chunk)
 
-    root.clear()
+    def finish(self):
+        logger.info('Metas: %d', len(self.metas))
+        return self.metas
 
-    logger.info('Done reading xml dump for meta-segmentations')
 
-    try:
-        while True:
-            extracted = extracted_queue.get(timeout=2)
+def extract_meta_segmentations(dump_file, executor=None, chunk_size=rwe.parallel.default_chunk_size, index_file=None):
+    """
+    Извлекает мета-информацию из дампа `dump_file`, отправляя страницы
+    исполнителю `executor` пачками по `chunk_size` штук. Сжатый дамп
+    читается с помощью индекса `index_file`. Результаты возвращаются
+    по мере готовности, не дожидаясь конца дампа.
+
+    Extracts meta-segmentations from `dump_file`, sending pages to `executor`
+    in chunks of `chunk_size`. Compressed dump is read using `index_file`.
+    Results are yielded as soon as they are ready, without waiting for
+    the end of dump.
+    """
+    count = 0
+    for extracted_chunk in rwe.dump.map_pages(_handle_pages, dump_file, index_file, executor, chunk_size, page_filters):
+        for extracted in extracted_chunk:
             yield extracted
-            
+
             count += 1
             if count % 1000 == 0:
                 logger.debug('Metas: %d', count)
 
-    except queue.Empty: pass
-
-    executor.shutdown()
+    logger.info('Done reading xml dump for meta-segmentations')
 
 
 def main(args):
 
-    for morf, template_name, filtered_params in extract_meta_segmentations(args.dump_file):
+    executor = rwe.parallel.create_executor(args.backend, args.jobs, args.max_pending)
+    for morf, template_name, filtered_params in extract_meta_segmentations(args.dump_file, executor, args.chunk_size, args.dump_index):
         print(morf, template_name, *filtered_params, sep=';', file=args.output)
 
+    executor.shutdown()
     args.output.close()
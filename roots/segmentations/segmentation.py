@@ -0,0 +1,138 @@
+"""
+Компактное представление разбиения слова на морфемы. Морфемы (пары тип,
+текст) хранятся в общей таблице и в разбиении представлены её номерами,
+так что до самой записи результата строки не собираются.
+
+Compact representation of word segmentation into morphemes. Morphemes
+(type, text pairs) are kept in shared table and segmentation refers to
+them by ids, so no strings are built until result is written.
+"""
+
+import threading
+
+
+"""
+Таблица морфем: номер -> (тип, текст) и её строковые представления.
+Пустая морфема с номером 0 обозначает пустую часть разбиения (например,
+пустое разбиение конца слова) и выводится пустой строкой.
+
+Morphemes table: id -> (type, text), and their string representations.
+Empty morpheme with id 0 stands for empty part of segmentation (e.g. empty
+segmentation of word ending) and is written as empty string.
+"""
+_morphemes = [(None, '')]
+_tokens = ['']
+_morpheme_ids = {(None, ''): 0}
+_lock = threading.Lock()
+
+empty_morpheme = 0
+
+def intern_morpheme(part_type, part):
+    """
+    Возвращает номер морфемы с типом `part_type` и текстом `part`,
+    добавляя её в таблицу при необходимости.
+
+    Returns id of morpheme with `part_type` type and `part` text,
+    adding it to table if needed.
+    """
+    key = (part_type, part)
+    morpheme_id = _morpheme_ids.get(key)
+    if morpheme_id is None:
+        with _lock:
+            morpheme_id = _morpheme_ids.get(key)
+            if morpheme_id is None:
+                morpheme_id = len(_morphemes)
+                _morphemes.append(key)
+                _tokens.append(part_type + '_' + part)
+                _morpheme_ids[key] = morpheme_id
+
+    return morpheme_id
+
+def morpheme_token(morpheme_id):
+    """
+    Возвращает строковое представление 'тип_текст' морфемы с номером `morpheme_id`.
+
+    Returns 'type_text' string representation of morpheme with `morpheme_id`.
+    """
+    return _tokens[morpheme_id]
+
+
+class Segmentation(object):
+    """
+    Разбиение на морфемы: кортеж номеров морфем. Разбиения складываются
+    (основа + конец), сравниваются и хэшируются по номерам, а при передаче
+    в другой процесс сериализуются парами (тип, текст), поскольку номера
+    в каждом процессе свои.
+
+    Segmentation into morphemes: tuple of morphemes' ids. Segmentations
+    are added (stem + ending), compared and hashed by ids, and are pickled
+    as (type, text) pairs to be passed to other process, as every process
+    has its own ids.
+    """
+    __slots__ = ('morphemes',)
+
+    def __init__(self, morphemes=()):
+        self.morphemes = morphemes
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """
+        Создаёт разбиение из пар (тип, текст). Пустое разбиение
+        представляется пустой морфемой.
+
+        Creates segmentation from (type, text) pairs. Empty segmentation
+        is represented by empty morpheme.
+        """
+        morphemes = tuple(intern_morpheme(part_type, part) for part_type, part in pairs)
+        return cls(morphemes or (empty_morpheme,))
+
+    @classmethod
+    def parse(cls, string):
+        """
+        Создаёт разбиение из строки вида 'тип_текст тип_текст'.
+
+        Creates segmentation from string of form 'type_text type_text'.
+        """
+        return cls(tuple(intern_morpheme(*token.split('_', 1)) if token else empty_morpheme for token in string.split(' ')))
+
+    def pairs(self):
+        return [_morphemes[morpheme_id] for morpheme_id in self.morphemes if morpheme_id != empty_morpheme]
+
+    def check(self):
+        """
+        Проверяет, что разбиение начинается с непустой морфемы и пустые
+        морфемы есть только в конце. Бросает ValueError иначе.
+
+        Checks that segmentation starts with non-empty morpheme and empty
+        morphemes are only at its end. Raises ValueError otherwise.
+        """
+        morphemes = self.morphemes
+        if not morphemes or morphemes[0] == empty_morpheme or _morphemes[morphemes[0]][1] == '':
+            raise ValueError("'" + str(self) + "'")
+
+        if empty_morpheme in morphemes:
+            first_empty = morphemes.index(empty_morpheme)
+            if any(morpheme_id != empty_morpheme for morpheme_id in morphemes[first_empty:]):
+                raise ValueError("'" + str(self) + "'")
+
+    def __add__(self, other):
+        return Segmentation(self.morphemes + other.morphemes)
+
+    def __eq__(self, other):
+        return isinstance(other, Segmentation) and self.morphemes == other.morphemes
+
+    def __hash__(self):
+        return hash(self.morphemes)
+
+    def __str__(self):
+        return ' '.join([_tokens[morpheme_id] for morpheme_id in self.morphemes])
+
+    def __repr__(self):
+        return 'Segmentation({!r})'.format(str(self))
+
+    def __reduce__(self):
+        return (_from_morphemes, ([_morphemes[morpheme_id] for morpheme_id in self.morphemes],))
+
+
+def _from_morphemes(morphemes):
+    return Segmentation(tuple(intern_morpheme(*morpheme) for morpheme in morphemes))
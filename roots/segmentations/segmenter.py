@@ -0,0 +1,325 @@
+"""
+Быстрый словарный разбиватель слов на морфемы без обучения. Списки морфем
+(корни, приставки, суффиксы, окончания из stanford-crf/data/morphemes и
+data/inflexions, data/suffixies) компилируются в префиксное дерево, а
+лучшее разбиение находится динамическим программированием по решётке
+(позиция в слове, состояние) простого автомата строения русского слова:
+
+    (префд|прист)* корень ((соед)? корень)* суфф* оконч? частица?
+
+Стоимость разбиения - сумма стоимостей морфем; незнакомые куски слова
+считаются корнем с большим штрафом за каждую букву, так что разбиение
+находится всегда. Мягкий и твёрдый знаки могут дописываться к предыдущей
+морфеме, поскольку в списках морфем они часто опущены.
+
+Fast dictionary-based segmenter without training. Morphemes lists (roots,
+prefixes, suffixes, inflexions from stanford-crf/data/morphemes and
+data/inflexions, data/suffixies) are compiled into trie, and the best
+segmentation is found by dynamic programming over lattice of
+(position in word, state) of simple automaton of russian word structure
+(see above). Segmentation cost is sum of morphemes' costs; unknown pieces
+of word are taken as root with big per-letter penalty, so segmentation is
+always found. Soft and hard signs may be appended to previous morpheme,
+as they are often omitted in morphemes lists.
+"""
+
+import os
+import functools
+import itertools
+
+import logging
+logger = logging.getLogger(__name__)
+
+from rwe.segmentations.segmentation import Segmentation
+import rwe.parallel
+
+
+"""
+Файлы списков морфем в stanford-crf/data/morphemes и типы морфем в них.
+
+Morphemes lists' files in stanford-crf/data/morphemes and their morphemes' types.
+"""
+morphemes_files = {
+    'корни': 'корень',
+    'приставки': 'прист',
+    'префиксойды': 'префд',
+    'суффиксы': 'суфф',
+    'окончания': 'оконч',
+}
+
+default_morphemes_directory = 'stanford-crf/data/morphemes'
+default_inflexions_file = 'data/inflexions'
+default_suffixies_file = 'data/suffixies'
+
+"""
+Морфемы, которых нет в списках: соединительные гласные и постфиксы.
+
+Morphemes missing in lists: linking vowels and postfixes.
+"""
+builtin_morphemes = {
+    'соед': ['о', 'е'],
+    'частица': ['ся', 'сь'],
+}
+
+"""
+Стоимости морфем по типам, бонус корня за букву, штраф за корень сразу
+после корня (без соединительной гласной), штраф за букву незнакомого
+куска и стоимость дописывания ь/ъ.
+
+Morphemes' costs by type, root bonus per letter, penalty for root right
+after root (without linking vowel), penalty per letter of unknown piece
+and cost of ь/ъ appending.
+"""
+costs = {
+    'префд': 0.8,
+    'прист': 0.5,
+    'корень': 1.0,
+    'соед': 0.8,
+    'суфф': 1.0,
+    'оконч': 0.6,
+    'частица': 0.3,
+}
+root_letter_bonus = 0.15
+compound_cost = 1.5
+unknown_letter_cost = 2.0
+sign_cost = 0.1
+signs = 'ьъ'
+
+"""
+Автомат строения слова: состояние -> {тип морфемы: следующее состояние}.
+
+Word structure automaton: state -> {morpheme type: next state}.
+"""
+_start, _prefix, _root, _link, _suffix, _ending, _particle = range(7)
+_transitions = {
+    _start: {'префд': _prefix, 'прист': _prefix, 'корень': _root},
+    _prefix: {'префд': _prefix, 'прист': _prefix, 'корень': _root},
+    _root: {'корень': _root, 'соед': _link, 'суфф': _suffix, 'оконч': _ending, 'частица': _particle},
+    _link: {'корень': _root},
+    _suffix: {'суфф': _suffix, 'соед': _link, 'оконч': _ending, 'частица': _particle},
+    _ending: {'частица': _particle},
+    _particle: {},
+}
+_final = (_root, _suffix, _ending, _particle)
+_unknown_from = (_start, _prefix, _link)
+
+
+def _read_morphemes(morphemes_file):
+    with open(morphemes_file, 'r') as f:
+        for l in f:
+            l = l.strip()
+            if l == '' or l[0] == '#':
+                continue
+            yield l
+
+
+class Segmenter(object):
+    """
+    Разбиватель слов на морфемы по словарю `morphemes` ('морфема' -> набор
+    типов). Морфемы хранятся в словаре и множестве всех их префиксов, так
+    что обход дерева из любой позиции слова - это поиск срезов в хэше.
+
+    Words segmenter by `morphemes` dictionary ('morpheme' -> set of types).
+    Morphemes are kept in dict and set of all their prefixes, so trie walk
+    from any position of word is lookup of slices in hash.
+    """
+
+    def __init__(self, morphemes):
+        self._morphemes = {morpheme: tuple(sorted(types)) for morpheme, types in morphemes.items()}
+        self._prefixes = set()
+        for morpheme in self._morphemes:
+            for i in range(1, len(morpheme) + 1):
+                self._prefixes.add(morpheme[:i])
+        self.segment = functools.lru_cache(maxsize=65536)(self._segment)
+
+    @classmethod
+    def load(cls, morphemes_directory=default_morphemes_directory, inflexions_file=default_inflexions_file, suffixies_file=default_suffixies_file):
+        """
+        Загружает списки морфем из `morphemes_directory` и файлов окончаний
+        и суффиксов.
+
+        Loads morphemes lists from `morphemes_directory` and inflexions and
+        suffixies files.
+        """
+        sources = [(os.path.join(morphemes_directory, name), morpheme_type) for name, morpheme_type in morphemes_files.items()]
+        sources += [(inflexions_file, 'оконч'), (suffixies_file, 'суфф')]
+
+        morphemes = {}
+        for morphemes_file, morpheme_type in sources:
+            if not os.path.exists(morphemes_file):
+                logger.warning('No morphemes file %s', morphemes_file)
+                continue
+            for morpheme in _read_morphemes(morphemes_file):
+                morphemes.setdefault(morpheme, set()).add(morpheme_type)
+
+        for morpheme_type, builtin in builtin_morphemes.items():
+            for morpheme in builtin:
+                morphemes.setdefault(morpheme, set()).add(morpheme_type)
+
+        logger.info('Loaded %d morphemes', len(morphemes))
+        return cls(morphemes)
+
+    def matches(self, word, start):
+        """
+        Возвращает пары (конец, типы) для морфем словаря, начинающихся
+        в позиции `start` слова `word`.
+
+        Yields (end, types) pairs for dictionary morphemes starting at
+        `start` position of `word`.
+        """
+        prefixes = self._prefixes
+        morphemes = self._morphemes
+        for end in range(start + 1, len(word) + 1):
+            piece = word[start:end]
+            if piece not in prefixes:
+                break
+            types = morphemes.get(piece)
+            if types is not None:
+                yield end, types
+
+    def _segment(self, word):
+        """
+        Возвращает лучшее разбиение слова `word` списком пар (тип, текст).
+
+        Returns best segmentation of `word` as list of (type, text) pairs.
+        """
+        n = len(word)
+        # best[position][state] = (cost, previous position, previous state, morpheme type)
+        best = [dict() for i in range(n + 1)]
+        best[0][_start] = (0.0, None, None, None)
+
+        for start in range(n):
+            states = best[start]
+            if not states:
+                continue
+
+            matches = list(self.matches(word, start))
+            for state, (cost, _, _, _) in list(states.items()):
+                transitions = _transitions[state]
+                for end, types in matches:
+                    for morpheme_type in types:
+                        next_state = transitions.get(morpheme_type)
+                        if next_state is None:
+                            continue
+                        next_cost = cost + costs[morpheme_type]
+                        if morpheme_type == 'корень':
+                            next_cost -= root_letter_bonus * (end - start)
+                            if state == _root:
+                                next_cost += compound_cost
+                        current = best[end].get(next_state)
+                        if current is None or next_cost < current[0]:
+                            best[end][next_state] = (next_cost, start, state, morpheme_type)
+
+                if state in _unknown_from:
+                    for end in range(start + 1, n + 1):
+                        next_cost = cost + costs['корень'] + unknown_letter_cost * (end - start)
+                        current = best[end].get(_root)
+                        if current is None or next_cost < current[0]:
+                            best[end][_root] = (next_cost, start, state, 'корень')
+
+                if word[start] in signs and state != _start:
+                    next_cost = cost + sign_cost
+                    current = best[start + 1].get(state)
+                    if current is None or next_cost < current[0]:
+                        best[start + 1][state] = (next_cost, start, state, None)
+
+        final = [(best[n][state][0], state) for state in _final if state in best[n]]
+        if not final:
+            return []
+
+        _, state = min(final)
+        parts = []
+        position = n
+        while position > 0:
+            _, start, previous_state, morpheme_type = best[position][state]
+            parts.append((morpheme_type, word[start:position]))
+            position, state = start, previous_state
+
+        segmentation = []
+        for morpheme_type, text in reversed(parts):
+            if morpheme_type is None:
+                segmentation[-1] = (segmentation[-1][0], segmentation[-1][1] + text)
+            else:
+                segmentation.append((morpheme_type, text))
+
+        return segmentation
+
+    def segment_word(self, word):
+        """
+        Разбивает слово `word` и возвращает `Segmentation` или None,
+        если слово пустое.
+
+        Segments `word` and returns `Segmentation` or None if word is empty.
+        """
+        pairs = self.segment(word.lower())
+        if not pairs:
+            return
+        return Segmentation.from_pairs(pairs)
+
+    def segment_many(self, words):
+        """
+        Разбивает слова `words` и возвращает список их разбиений.
+
+        Segments `words` and returns list of their segmentations.
+        """
+        return [self.segment_word(word) for word in words]
+
+
+"""
+Разбиватель процесса-обработчика, загружаемый при первом использовании.
+
+Worker process segmenter loaded on first use.
+"""
+_segmenters = {}
+
+def get_segmenter(morphemes_directory=default_morphemes_directory, inflexions_file=default_inflexions_file, suffixies_file=default_suffixies_file):
+    """
+    Возвращает разбиватель для заданных списков морфем, загружая его один
+    раз на процесс.
+
+    Returns segmenter for given morphemes lists, loading it once per process.
+    """
+    key = (morphemes_directory, inflexions_file, suffixies_file)
+    segmenter = _segmenters.get(key)
+    if segmenter is None:
+        segmenter = _segmenters[key] = Segmenter.load(*key)
+    return segmenter
+
+def _segment_chunk(key, words):
+    return get_segmenter(*key).segment_many(words)
+
+def segment_many(words, executor=None, chunk_size=1000, **lists):
+    """
+    Разбивает слова `words` разбивателем `get_segmenter(**lists)`, по желанию
+    параллельно с помощью `executor` пачками по `chunk_size` слов, и
+    возвращает их разбиения в исходном порядке.
+
+    Segments `words` with `get_segmenter(**lists)` segmenter, optionally in
+    parallel with `executor` in chunks of `chunk_size` words, and yields
+    their segmentations in original order.
+    """
+    if executor is None:
+        yield from get_segmenter(**lists).segment_many(words)
+        return
+
+    key = (lists.get('morphemes_directory', default_morphemes_directory), lists.get('inflexions_file', default_inflexions_file), lists.get('suffixies_file', default_suffixies_file))
+    fn = functools.partial(_segment_chunk, key)
+    for chunk in rwe.parallel.imap(executor, fn, rwe.parallel.chunks(words, chunk_size)):
+        yield from chunk
+
+
+def main(args):
+    executor = None
+    if args.jobs != 1:
+        executor = rwe.parallel.create_executor(args.backend, args.jobs, args.max_pending)
+
+    lists = {'morphemes_directory': args.morphemes_directory, 'inflexions_file': args.inflexions.name, 'suffixies_file': args.suffixies.name}
+    with args.words:
+        words = (l.strip() for l in args.words if l.strip())
+        words, copy = itertools.tee(words)
+        for word, segmentation in zip(copy, segment_many(words, executor, **lists)):
+            print(word, segmentation or '', sep='\t', file=args.output)
+
+    if executor is not None:
+        executor.shutdown()
+    args.output.close()
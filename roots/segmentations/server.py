@@ -0,0 +1,268 @@
+"""
+Сервер разбиений: отвечает на запросы по HTTP на локальном адресе или
+через Unix-сокет, используя индекс разбиений (см. `index`), общий для
+всех процессов через mmap. Запросы принимают сразу много слов, частые
+ответы кэшируются.
+
+    GET  /lookup?word=мама&word=папа[&prefix=1&limit=10]
+    POST /lookup  {"words": ["мама", "папа"], "prefix": false, "limit": null}
+    GET  /stats
+
+Ответ на /lookup: {"results": {"мама": ["корень_мам оконч_а"], ...}}.
+
+Segmentations server: answers HTTP requests on local address or through
+Unix socket using segmentations index (see `index`) shared by all processes
+through mmap. Requests take many words at once, frequent answers are cached.
+"""
+
+import os
+import json
+import signal
+import time
+import functools
+import threading
+import collections
+import socketserver
+import urllib.parse
+import http.server
+
+import logging
+logger = logging.getLogger(__name__)
+
+import rwe.segmentations.index
+
+
+"""
+Число кэшируемых ответов по умолчанию.
+
+Default number of cached answers.
+"""
+default_cache_size = 65536
+
+"""
+Число последних запросов, по которым считаются задержки.
+
+Number of latest requests latencies are computed over.
+"""
+latency_window = 10000
+
+
+class ServerStats(object):
+    """
+    Счётчики запросов сервера: число запросов и слов, пропускная способность
+    и задержки (медиана и перцентили по последним `latency_window` запросам).
+
+    Server requests counters: number of requests and words, throughput and
+    latencies (median and percentiles over latest `latency_window` requests).
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.requests = 0
+        self.words = 0
+        self._latencies = collections.deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+
+    def record(self, words, latency):
+        with self._lock:
+            self.requests += 1
+            self.words += words
+            self._latencies.append(latency)
+
+    def snapshot(self, cache_info=None):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            requests, words = self.requests, self.words
+
+        uptime = time.time() - self.started
+        stats = {
+            'uptime': uptime,
+            'requests': requests,
+            'words': words,
+            'requests_per_second': requests / uptime if uptime else 0.0,
+            'words_per_second': words / uptime if uptime else 0.0,
+        }
+        for name, quantile in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+            stats['latency_' + name + '_ms'] = 1000 * latencies[min(int(quantile * len(latencies)), len(latencies) - 1)] if latencies else None
+
+        if cache_info is not None:
+            lookups = cache_info.hits + cache_info.misses
+            stats['cache_hits'] = cache_info.hits
+            stats['cache_misses'] = cache_info.misses
+            stats['cache_hit_rate'] = cache_info.hits / lookups if lookups else 0.0
+
+        return stats
+
+
+class LookupService(object):
+    """
+    Поиск разбиений в индексе `index_file` с кэшем на `cache_size` ответов.
+
+    Segmentations lookup in `index_file` index with cache of `cache_size` answers.
+    """
+
+    def __init__(self, index_file, cache_size=default_cache_size):
+        self.index = rwe.segmentations.index.SegmentationIndex(index_file)
+        self.stats = ServerStats()
+        self._lookup = functools.lru_cache(maxsize=cache_size)(self._find)
+
+    def _find(self, word, prefix, limit):
+        if prefix:
+            return tuple(self.index.prefix(word, limit))
+        return tuple(self.index.lookup(word))
+
+    def lookup(self, words, prefix=False, limit=None):
+        """
+        Возвращает словарь 'слово' -> 'список разбиений' (или пар
+        (словоформа, разбиение) для поиска по префиксу).
+
+        Returns 'word' -> 'list of segmentations' dict (or of (word form,
+        segmentation) pairs for prefix lookup).
+        """
+        return {word: list(self._lookup(word, prefix, limit)) for word in words}
+
+    def report(self):
+        return self.stats.snapshot(self._lookup.cache_info())
+
+    def close(self):
+        self.index.close()
+
+
+class LookupHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _lookup(self, start, words, prefix, limit):
+        if not isinstance(words, list) or not all(isinstance(word, str) for word in words):
+            self._reply(400, {'error': 'words must be list of strings'})
+            return
+        if limit is not None and (type(limit) != int or limit < 0):
+            self._reply(400, {'error': 'limit must be non-negative integer'})
+            return
+
+        self._reply(200, {'results': self.server.service.lookup(words, bool(prefix), limit)})
+        self.server.service.stats.record(len(words), time.perf_counter() - start)
+
+    def _handle(self, handler):
+        try:
+            handler()
+        except Exception as e:
+            logger.exception('Failed to handle %s %s', self.command, self.path)
+            self._reply(500, {'error': '{}: {}'.format(type(e).__name__, e)})
+
+    def _get(self):
+        start = time.perf_counter()
+        path = self.path
+        try:
+            # http.server decodes request line as latin-1, raw utf8 is welcome too
+            path = path.encode('iso-8859-1').decode('utf-8')
+        except UnicodeError:
+            pass
+
+        url = urllib.parse.urlsplit(path)
+        if url.path == '/stats':
+            self._reply(200, self.server.service.report())
+        elif url.path == '/lookup':
+            query = urllib.parse.parse_qs(url.query)
+            limit = query.get('limit')
+            try:
+                limit = int(limit[0]) if limit else None
+            except ValueError:
+                self._reply(400, {'error': 'limit must be non-negative integer'})
+                return
+            self._lookup(start, query.get('word', []), query.get('prefix', ['0'])[0] not in ('0', 'false', ''), limit)
+        else:
+            self._reply(404, {'error': 'unknown path'})
+
+    def _post(self):
+        start = time.perf_counter()
+        if urllib.parse.urlsplit(self.path).path != '/lookup':
+            self._reply(404, {'error': 'unknown path'})
+            return
+
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError:
+            self._reply(400, {'error': 'bad json'})
+            return
+        if not isinstance(request, dict):
+            self._reply(400, {'error': 'request must be json object'})
+            return
+
+        self._lookup(start, request.get('words'), request.get('prefix', False), request.get('limit'))
+
+    def do_GET(self):
+        self._handle(self._get)
+
+    def do_POST(self):
+        self._handle(self._post)
+
+    def address_string(self):
+        return str(self.client_address[0]) if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logger.debug('%s %s', self.address_string(), format % args)
+
+
+class TCPLookupHandler(LookupHandler):
+    disable_nagle_algorithm = True
+
+class LookupServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+class UnixLookupServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(service, host='127.0.0.1', port=8080, unix_socket=None):
+    """
+    Создаёт сервер для `service` на `host`:`port` или, если задан,
+    на Unix-сокете `unix_socket`.
+
+    Creates server for `service` on `host`:`port` or, if given,
+    on `unix_socket` Unix socket.
+    """
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+        server = UnixLookupServer(unix_socket, LookupHandler)
+    else:
+        server = LookupServer((host, port), TCPLookupHandler)
+
+    server.service = service
+    return server
+
+
+def main(args):
+    service = LookupService(rwe.segmentations.index.ensure_index(args.segmentations), args.cache_size)
+    server = create_server(service, args.host, args.port, args.unix_socket)
+
+    stop = threading.Event()
+    def report():
+        while not stop.wait(args.stats_interval):
+            logger.info('Stats: %s', json.dumps(service.report()))
+
+    if args.stats_interval > 0:
+        threading.Thread(target=report, daemon=True).start()
+
+    def interrupt(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, interrupt)
+
+    print('Serving', args.segmentations, 'on', args.unix_socket or '{}:{}'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        print(json.dumps(service.report(), indent=1))
+        service.close()
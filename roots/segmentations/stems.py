@@ -1,12 +1,15 @@
 
 import operator
 
+from rwe.segmentations.segmentation import Segmentation
 from rwe.exception import ExtractException
 class StemException(ExtractException): pass
 
 import logging
 logger = logging.getLogger(__name__)
 
+import rwe.metrics
+
 
 def split_stems(stems_with_names, replace=False):
     for i, stem in enumerate(stems_with_names):
@@ -50,15 +53,24 @@ def segment_additional_stem(stem, base_form_segmentation):
             break
         else:
             logger.info('Cannot align stem %s to segmentation %s', original_stem, base_form_segmentation)
+            rwe.metrics.reject('stem alignment failure')
             return
 
     if stem != '':
         logger.info("Can't fully segment stem %s: %s", original_stem, segmentation)
+        rwe.metrics.reject('stem not fully segmented')
         return
 
     return segmentation
 
 def segment_additional_stems(base_form_segmentation, stems):
+    """
+    Разбивает все дополнительные основы `stems` из вызова шаблона таблицы.
+    Возвращает список пар (имя основы или None, разбиение) или None.
+
+    Segments all additional `stems` from table template call.
+    Returns list of (stem name or None, segmentation) pairs or None.
+    """
     base_form = ''.join(map(operator.itemgetter(1), base_form_segmentation))
     base_stem_found = False
 
@@ -77,14 +89,11 @@ def segment_additional_stems(base_form_segmentation, stems):
             logger.debug("Can't segment stem %s of %s", stem, stems)
             return
 
-        stem = ' '.join(map(lambda p: p[0] + '_' + p[1], segmentation))
-        if name is None:
-            new_stems.append(stem)
-        else:
-            new_stems.append('{}={}'.format(name, stem))
+        new_stems.append((name, Segmentation.from_pairs(segmentation)))
 
     if not base_stem_found:
         logger.info("Can't find base stem %s in stems %s", base_form_segmentation, stems)
+        rwe.metrics.reject('base stem not found')
         return
 
     return new_stems
@@ -92,28 +101,26 @@ def segment_additional_stems(base_form_segmentation, stems):
 
 def fill_stems_dict(stems):
     """ 
-    Переводит список основ вроде
-        основа=мушк;основа1=мушек 
+    Переводит список разбитых основ вроде
+        [('основа', мушк), ('основа1', мушек)]
     или
-        мушк;мушек
+        [(None, мушк), (None, мушек)]
     в таблицу 
-        {'{{{1}}}': 'мушк', '{{{основа}}}': 'мушк',...}
+        {'{{{1}}}': мушк, '{{{основа}}}': мушк,...}
     для использования в шаблоне таблицы склонения/спряжения.
 
-    Transforms list of stems from form:
-        основа=мушк;основа1=мушек 
+    Transforms list of segmented stems from form:
+        [('основа', мушк), ('основа1', мушек)]
     or
-        мушк;мушек
+        [(None, мушк), (None, мушек)]
     into dict 
-        {'{{{1}}}': 'мушк', '{{{основа}}}': 'мушк',...}
+        {'{{{1}}}': мушк, '{{{основа}}}': мушк,...}
     for declension/conjugation table template.
     """
     result = {}
     i = 1
-    for stem in split_stems(stems):
-        value = stem
-        if type(stem) == tuple:
-            name, value = stem
+    for name, value in stems:
+        if name is not None:
             result['{{{' + name + '}}}'] = value
         result['{{{' + str(i) + '}}}'] = value
         i += 1
@@ -124,4 +131,3 @@ def fill_stems_dict(stems):
         result['{{{основа1}}}'] = result['{{{основа}}}']
 
     return result
-
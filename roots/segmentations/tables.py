@@ -7,16 +7,29 @@ Loading and processing of plain text declension and conjugation tables' template
 import os
 import re
 import sys
+import json
+import time
+import hashlib
+import functools
+import threading
 
 import logging
 logger = logging.getLogger(__name__)
 
+import rwe.parallel
 from rwe.constants import *
+from rwe.segmentations.segmentation import Segmentation
 
 
-def _create_tables(dump_file, tables_directoryectory):
+from rwe.tables import tables_complete
+
+def _create_tables(args):
     from rwe.tables import extract_and_render
-    extract_and_render(dump_file, tables_directoryectory)
+    from rwe.parallel import create_executor
+    executor = create_executor(args.backend, args.jobs, args.max_pending)
+    extract_and_render(args.dump_file, args.tables_directory, args.address, executor=executor, index_file=args.dump_index,
+                       cache_directory=args.render_cache, render_jobs=args.render_jobs, offline=args.offline)
+    executor.shutdown()
 
 
 from rwe.exception import ExtractException
@@ -126,77 +139,335 @@ def _segment_template_ending(ending):
     return ' '.join(segmented_ending)
 
 
-# TODO check if native lazy loading availiable
-def _template_form_generator(template_name, parameter, ending):
-    def impl():
+def _segment_template(template_name, lines):
+    """
+    Разбивает на морфемы концы всех форм шаблона `template_name` с текстом
+    таблицы `lines`. Возвращает список пар (параметр основы, разбиение конца)
+    в порядке их появления в таблице.
+
+    Segments all forms' endings of `template_name` template with table text
+    `lines`. Returns list of (stem parameter, segmented ending) pairs in order
+    of their appearance in table.
+    """
+    forms = []
+    seen = set()
+    for match in re.finditer('(\{\{\{[^ ]+\}\}\})([а-яёй]*)', lines):
+        if match.group(0) in seen:
+            continue
+        seen.add(match.group(0))
+
+        parameter, ending = match.group(1), match.group(2)
         try:
-            segmented_ending = _segment_template_ending(ending)
-            return (parameter, segmented_ending)
+            forms.append((parameter, _segment_template_ending(ending)))
         except TableException as e:
             logger.info("Can't segment template %s ending %s %s: %s", template_name, parameter, ending, e.string)
             raise TableException(e.string, template_name, parameter, ending)
 
-    return impl
+    return forms
+
+
+"""
+Имя файла скомпилированных шаблонов в каталоге таблиц и версия его формата.
+
+Compiled templates' file name in tables' directory and its format version.
+"""
+compiled_file_name = 'compiled.json'
+compiled_version = 1
+
+def _sets_digest():
+    """
+    Хэш априорных списков окончаний и суффиксов, от которых зависят разбиения.
+
+    Hash of predefined inflexions and suffixies sets segmentations depend on.
+    """
+    data = '\n'.join(sorted(_inflexions)) + '\0' + '\n'.join(sorted(_suffixies))
+    return hashlib.sha1(data.encode()).hexdigest()
 
-class LazyDict(dict):
+def _table_signature(table_file):
+    stat = os.stat(table_file)
+    return [stat.st_mtime_ns, stat.st_size]
 
-    def get(self, key, default=None):
-        value = dict.get(self, key, default)
-        if type(value) == dict and value != default:
-            instantiated_value = set()
-            for clojure in value.values():
-                instantiated_value.add(clojure())
+def _load_compiled(compiled_file, digest):
+    """
+    Загружает скомпилированные шаблоны, если они сделаны с теми же списками
+    морфем, иначе возвращает пустой словарь.
 
-            value = instantiated_value
-            self[key] = value
+    Loads compiled templates if they were made with the same morphemes sets,
+    otherwise returns empty dict.
+    """
+    if not os.path.exists(compiled_file):
+        return {}
+
+    try:
+        with open(compiled_file, 'r') as f:
+            compiled = json.load(f)
+    except ValueError:
+        logger.warning('Broken compiled templates %s, recompiling', compiled_file)
+        return {}
+
+    if compiled.get('version') != compiled_version or compiled.get('sets') != digest:
+        return {}
+
+    return compiled['tables']
+
+def compile_templates(tables_directory):
+    """
+    Возвращает словарь 'имя файла таблицы' -> {'template': имя шаблона,
+    'signature': время изменения и размер файла, 'forms': разбиения форм,
+    'error': описание ошибки разбиения}. Заново разбираются только таблицы,
+    изменившиеся с прошлой компиляции, результат сохраняется в `tables_directory`.
+    Все изменения списков окончаний и суффиксов приводят к полной перекомпиляции.
+
+    Returns dict 'table file name' -> {'template': template name, 'signature':
+    file modification time and size, 'forms': forms' segmentations, 'error':
+    segmentation error description}. Only tables changed since last compilation
+    are processed again, result is saved into `tables_directory`.
+    Any change of inflexions or suffixies sets forces full recompilation.
+    """
+    digest = _sets_digest()
+    compiled_file = os.path.join(tables_directory, compiled_file_name)
+    previous = _load_compiled(compiled_file, digest)
+
+    tables = {}
+    for filename in sorted(os.listdir(tables_directory)):
+        if filename[-6:] != '.table':
+            continue
+
+        table_file = os.path.join(tables_directory, filename)
+        signature = _table_signature(table_file)
+        if filename in previous and previous[filename]['signature'] == signature:
+            tables[filename] = previous[filename]
+            continue
+
+        with open(table_file, 'r') as f:
+            lines = f.read().replace(stress, '')
+
+        template_name = filename[:-6].replace('%', '/')
+        entry = {'template': template_name, 'signature': signature, 'forms': None, 'error': None}
+        try:
+            entry['forms'] = _segment_template(template_name, lines)
+        except TableException as e:
+            entry['error'] = e.string
+        tables[filename] = entry
+
+    if tables != previous:
+        with open(compiled_file + '.tmp', 'w') as f:
+            json.dump({'version': compiled_version, 'sets': digest, 'tables': tables}, f, ensure_ascii=False)
+        os.replace(compiled_file + '.tmp', compiled_file)
+
+    return tables
+
+
+def _compile_slot(parameter):
+    """
+    Разбирает параметр основы вида {{{основа1}}} или {{{основа1|{{{1}}}}}}
+    на ключ основы и ключ запасной основы (или None).
+
+    Parses stem parameter of form {{{основа1}}} or {{{основа1|{{{1}}}}}}
+    into stem key and fallback stem key (or None).
+    """
+    split_index = parameter.find('|')
+    if split_index == -1:
+        return parameter, None
+
+    return parameter[:split_index] + '}}}', parameter[split_index + 1 : parameter.index('}', split_index) + 3]
+
+def _instantiate_template(entry):
+    """
+    Компилирует запись скомпилированного шаблона в план рендера: кортеж
+    троек (ключ основы, ключ запасной основы или None, разбиение конца),
+    или бросает TableException, если шаблон не удалось разбить.
+
+    Compiles compiled template entry into render plan: tuple of
+    (stem key, fallback stem key or None, segmented ending) triples,
+    or raises TableException if template failed to be segmented.
+    """
+    if entry['error'] is not None:
+        raise TableException(entry['error'])
+
+    return tuple(_compile_slot(parameter) + (Segmentation.parse(ending),) for parameter, ending in entry['forms'])
+
+def _instantiate_entries(instantiate, entries):
+    """
+    Создаёт шаблоны по парам (имя шаблона, запись) и возвращает пары
+    (имя шаблона, план или TableException).
+
+    Instantiates templates from (template name, entry) pairs and returns
+    (template name, plan or TableException) pairs.
+    """
+    plans = []
+    for template_name, entry in entries:
+        try:
+            plans.append((template_name, instantiate(entry)))
+        except TableException as e:
+            plans.append((template_name, e))
+
+    return plans
+
+"""
+Число шаблонов, создаваемых за одну задачу при прогреве.
+
+Number of templates instantiated per task while warming.
+"""
+default_warm_chunk_size = 16
+
+class TemplateRegistry(object):
+    """
+    Потокобезопасный словарь шаблонов 'имя шаблона' -> 'частичные разбиения'.
+    Шаблон создаётся из скомпилированной записи при первом обращении ровно
+    один раз (под своей блокировкой), ошибка создания запоминается и
+    бросается при каждом следующем обращении. Метод `warm` создаёт все
+    шаблоны заранее и параллельно. Проверка наличия шаблона (`in`) его
+    не создаёт.
+
+    Thread-safe dict of templates 'template name' -> 'partial segmentations'.
+    Template is instantiated from compiled entry exactly once on first access
+    (under its own lock), instantiation error is cached and raised on every
+    later access. `warm` method instantiates all templates beforehand and in
+    parallel. Checking template presence (`in`) doesn't instantiate it.
+    """
+
+    def __init__(self, entries, instantiate=_instantiate_template):
+        self._entries = entries
+        self._instantiate = instantiate
+        self._templates = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _template(self, template_name):
+        value = self._templates.get(template_name)
+        if value is not None:
+            return value
+
+        with self._lock:
+            lock = self._locks.setdefault(template_name, threading.Lock())
+
+        with lock:
+            value = self._templates.get(template_name)
+            if value is None:
+                try:
+                    value = self._instantiate(self._entries[template_name])
+                except TableException as e:
+                    value = e
+                self._templates[template_name] = value
+
+        return value
+
+    def get(self, template_name, default=None):
+        if template_name not in self._entries:
+            return default
+
+        value = self._template(template_name)
+        if isinstance(value, TableException):
+            raise value
 
         return value
 
-    def __getitem__(self, key):
-        value = self.get(key)
-        if value is None: raise KeyError(key)
+    def __getitem__(self, template_name):
+        value = self.get(template_name)
+        if value is None: raise KeyError(template_name)
         return value
 
+    def __contains__(self, template_name):
+        return template_name in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def warm(self, executor=None, chunk_size=default_warm_chunk_size):
+        """
+        Создаёт все ещё не созданные шаблоны заранее, по `chunk_size` на
+        задачу `executor` (по умолчанию - в текущем потоке), так что каждый
+        шаблон создаётся ровно один раз, и возвращает число неудавшихся.
+        Планы шаблонов из процессов-обработчиков переносятся в текущий
+        процесс, а процессы, порождённые после прогрева, наследуют их.
+
+        Instantiates all not yet instantiated templates beforehand, `chunk_size`
+        per `executor` task (defaults to current thread), so every template is
+        instantiated exactly once, and returns number of failed ones. Templates'
+        plans are carried over from worker processes into current process,
+        and processes forked after warming inherit them.
+        """
+        if executor is None:
+            executor = rwe.parallel.SerialExecutor()
+
+        entries = ((template_name, entry) for template_name, entry in self._entries.items() if template_name not in self._templates)
+        fn = functools.partial(_instantiate_entries, self._instantiate)
+        for plans in rwe.parallel.imap(executor, fn, rwe.parallel.chunks(entries, chunk_size)):
+            with self._lock:
+                for template_name, value in plans:
+                    self._templates.setdefault(template_name, value)
+
+        return len(self.failures())
 
-def load_segmentation_table_templates(args):
+    def failures(self):
+        """
+        Возвращает словарь 'имя шаблона' -> 'ошибка' для уже созданных шаблонов.
+
+        Returns 'template name' -> 'error' dict for already instantiated templates.
+        """
+        return {name: value.string for name, value in list(self._templates.items()) if isinstance(value, TableException)}
+
+
+def load_segmentation_table_templates(args, executor=None):
     """
-    Загружает шаблоны таблиц в словарь 'имя шаблона' -> 'список частичных разбиений'
+    Загружает шаблоны таблиц в реестр 'имя шаблона' -> 'план частичных разбиений'
     Частичных потому, что сейчас частично разбиение имеет вид:
         {{{#номер основы#}}} #разбиение конечной части слова из таблицы#
+    Разбиения берутся из скомпилированных шаблонов (см. `compile_templates`).
 
     `dump_file` требуется только если таблицы не были извлечены в файлы.
+    Если задан `warm_templates`, шаблоны создаются заранее с помощью `executor`.
 
 
-    Loads tables' templates into convenient dict 'template name' -> 'set of partial segmentations'.
+    Loads tables' templates into registry 'template name' -> 'plan of partial segmentations'.
     Partial in a sense that now segmentations are of form:
         {{{#stem identificator#}}} #segmented ending from table#
+    Segmentations are taken from compiled templates (see `compile_templates`).
 
     `dump_file` is required if not yet tables were extracted in plain text files.
+    If `warm_templates` is set, templates are instantiated beforehand with `executor`.
     """
     _load_sets(args.inflexions, args.suffixies)
 
-    if not os.path.exists(args.tables_directory): 
-        _create_tables(args.dump_file, args.tables_directory)
+    if not tables_complete(args.tables_directory):
+        _create_tables(args)
 
-    segmentation_table_templates = LazyDict()
-    for filename in os.listdir(args.tables_directory):
-        if filename[-6:] != '.table':
-            continue
+    start = time.time()
+    entries = {entry['template']: entry for entry in compile_templates(args.tables_directory).values()}
+    segmentation_table_templates = _registries[args.tables_directory] = TemplateRegistry(entries)
 
-        f = open(os.path.join(args.tables_directory, filename), 'r')
-        lines = ''.join(f.readlines()).replace(stress, '')
-        f.close()
+    if args.warm_templates:
+        failed = segmentation_table_templates.warm(executor)
+        logger.info('Warmed templates, %d failed', failed)
 
-        template_name = filename[:-6].replace('%', '/')
+    logger.info('Loaded %d templates in %.3fs', len(segmentation_table_templates), time.time() - start)
 
-        templates = {}
-        for match in re.finditer('(\{\{\{[^ ]+\}\}\})([а-яёй]*)', lines):
-            if match.group(0) in templates:
-                continue
+    return segmentation_table_templates
 
-            clojure = _template_form_generator(template_name, match.group(1), match.group(2))
-            templates[match.group(0)] = clojure
 
-        segmentation_table_templates[template_name] = templates
+"""
+Реестры шаблонов процесса по каталогам таблиц: заполняются
+`load_segmentation_table_templates` или при первом использовании в
+процессе-обработчике, так что задачам достаточно передавать имена шаблонов.
 
-    return segmentation_table_templates
+Process templates registries by tables' directories: filled by
+`load_segmentation_table_templates` or on first use in worker process, so
+tasks need to carry only templates' names.
+"""
+_registries = {}
+
+def get_template_registry(tables_directory):
+    """
+    Возвращает реестр шаблонов, скомпилированных в `tables_directory`
+    (см. `compile_templates`), загружая его один раз на процесс.
+
+    Returns registry of templates compiled in `tables_directory` (see
+    `compile_templates`), loading it once per process.
+    """
+    registry = _registries.get(tables_directory)
+    if registry is None:
+        with open(os.path.join(tables_directory, compiled_file_name), 'r') as f:
+            tables = json.load(f)['tables']
+        registry = _registries[tables_directory] = TemplateRegistry({entry['template']: entry for entry in tables.values()})
+    return registry
@@ -11,12 +11,198 @@ and their rendering to plain text form.
 import re
 import os
 import sys
+import functools
+import json
+import hashlib
+import operator
+import tempfile
+import itertools
+import threading
+import concurrent.futures
 import xml.etree.ElementTree as ET
 
 import http.client
 import urllib.parse
 
-import rwe.pages
+import rwe.dump
+import rwe.parallel
+import rwe.wikitext
+from rwe.exception import ExtractException
+
+class RenderException(ExtractException): pass
+
+def _table_file(template_name, output_directory, extension='.table'):
+    return os.path.join(output_directory, template_name.replace('Шаблон:', '').replace('/', '%') + extension)
+
+def _digest(data):
+    return hashlib.sha1(data).hexdigest()
+
+def save_table(template_name, rows, output_directory):
+    """
+    Сохраняет строки таблицы `rows` (списки текстов ячеек) в простом виде
+    и возвращает хэш сохранённого файла.
+
+    Saves table `rows` (lists of cells' texts) as plain text table and
+    returns hash of saved file.
+    """
+    lines = []
+    for row in rows:
+        lines.append(''.join(text.strip() + ' | ' for text in row) + '\n')
+    data = ''.join(lines).encode()
+
+    table_file = _table_file(template_name, output_directory)
+    with open(table_file + '.tmp', 'wb') as of:
+        of.write(data)
+    os.replace(table_file + '.tmp', table_file)
+
+    return _digest(data)
+
+
+class Manifest(object):
+    """
+    Сохраняемый в каталоге таблиц `output_directory` список отрендеренных
+    шаблонов: для каждого хранятся номер ревизии, хэш таблицы, состояние и
+    описание ошибки. Позволяет при повторном запуске рендерить только
+    новые, изменившиеся или не отрендеренные ранее шаблоны.
+
+    Rendered templates' list saved in tables' `output_directory`: revision id,
+    table hash, status and error description are kept for every template.
+    Allows rerun to render only new, changed or previously failed templates.
+    """
+
+    file_name = 'manifest.json'
+
+    """
+    Через сколько записей манифест сохраняется на диск.
+
+    Number of records after which manifest is saved to disk.
+    """
+    checkpoint_interval = 32
+
+    def __init__(self, output_directory):
+        self.manifest_file = os.path.join(output_directory, self.file_name)
+        self.output_directory = output_directory
+        self.templates = {}
+        self.complete = False
+        self._lock = threading.Lock()
+        self._unsaved = 0
+
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file, 'r') as f:
+                manifest = json.load(f)
+            self.templates = manifest['templates']
+            self.complete = manifest['complete']
+
+    def is_rendered(self, template_name, revision):
+        """
+        Проверяет, что шаблон `template_name` ревизии `revision` уже
+        отрендерен и его таблица с тех пор не менялась.
+
+        Checks that `template_name` template of `revision` is already
+        rendered and its table has not changed since.
+        """
+        entry = self.templates.get(template_name)
+        if entry is None or entry['status'] != 'ok' or revision is None or entry['revision'] != revision:
+            return False
+
+        table_file = _table_file(template_name, self.output_directory)
+        if not os.path.exists(table_file):
+            return False
+        with open(table_file, 'rb') as f:
+            return _digest(f.read()) == entry['hash']
+
+    def record(self, template_name, revision, digest=None, error=None):
+        """
+        Запоминает результат рендера шаблона: хэш таблицы при успехе
+        или описание ошибки `error`.
+
+        Records template render result: table hash on success or
+        `error` description.
+        """
+        with self._lock:
+            self.templates[template_name] = {
+                'revision': revision,
+                'hash': digest,
+                'status': 'ok' if error is None else 'failed',
+                'error': error
+            }
+            self._unsaved += 1
+            if self._unsaved >= self.checkpoint_interval:
+                self._save()
+
+    def start(self):
+        """
+        Отмечает рендер незавершённым и сохраняет манифест до начала
+        рендера, так что прерванный рендер возобновится при следующем запуске.
+
+        Marks render as incomplete and saves manifest before render starts,
+        so that interrupted render is resumed on next run.
+        """
+        with self._lock:
+            self.complete = False
+            self._save()
+
+    def finish(self):
+        """
+        Отмечает рендер завершённым и сохраняет манифест.
+
+        Marks render as complete and saves manifest.
+        """
+        with self._lock:
+            self.complete = True
+            self._save()
+
+    def _save(self):
+        with open(self.manifest_file + '.tmp', 'w') as f:
+            json.dump({'complete': self.complete, 'templates': self.templates}, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(self.manifest_file + '.tmp', self.manifest_file)
+        self._unsaved = 0
+
+    def failed(self):
+        return sorted(name for name, entry in self.templates.items() if entry['status'] != 'ok')
+
+
+def tables_complete(output_directory):
+    """
+    Проверяет, что таблицы в `output_directory` уже отрендерены полностью.
+    Каталог таблиц без манифеста считается неготовым: его рендер мог
+    прерваться до первого сохранения манифеста.
+
+    Checks that tables in `output_directory` are completely rendered.
+    Tables' directory without manifest is considered incomplete: its render
+    may have been interrupted before manifest was first saved.
+    """
+    manifest_file = os.path.join(output_directory, Manifest.file_name)
+    return os.path.exists(manifest_file) and Manifest(output_directory).complete
+
+
+def _prepare_render(templates, output_directory):
+    """
+    Создаёт каталог таблиц, загружает манифест и отбрасывает уже
+    отрендеренные шаблоны.
+
+    Creates tables' directory, loads manifest and drops already
+    rendered templates.
+    """
+    if not os.path.isdir(output_directory):
+        if os.path.exists(output_directory): 
+            raise Exception('Tables directory "{}" exists but is not directory'.format(output_directory))
+
+        os.mkdir(output_directory)
+
+    manifest = Manifest(output_directory)
+    manifest.start()
+    pending = [template for template in templates if not manifest.is_rendered(*template)]
+    print('Templates to render:', len(pending), 'of', len(templates))
+
+    return manifest, pending
+
+def _finish_render(manifest):
+    manifest.finish()
+    failed = manifest.failed()
+    if failed:
+        print('Failed to render templates:', *failed, sep='\n')
+
 
 # !!! NOTE Шаблон:прил ru 2a has two templates in one cell
 def render(template_name, text, output_directory):
@@ -29,10 +215,8 @@ def render(template_name, text, output_directory):
     parser.feed('<fakeroot>')
     parser.feed(text)
 
-    dump_file = os.path.join(output_directory, template_name.replace('Шаблон:', '').replace('/', '%') + '.table')
-    of = open(dump_file, 'w')
-
     table = False
+    rows = [[]]
 
     try:
         for event, elem in parser.read_events():
@@ -43,7 +227,7 @@ def render(template_name, text, output_directory):
                 break
 
             if table and event == 'end' and elem.tag == 'tr':
-                print('', file=of)
+                rows.append([])
 
             if table and event == 'end' and (elem.tag == 'th' or elem.tag == 'td'):
                 text = elem.text
@@ -52,62 +236,316 @@ def render(template_name, text, output_directory):
                     if a is not None: text = a.text
 
                 if text is not None:
-                    print(text.strip(), '|', end=' ', file=of)
+                    rows[-1].append(text)
 
             if not table and event == 'end':
                 elem.clear()
     except ET.ParseError as e:
-        print(e)
-        os.remove(dump_file)
-        exit(1)
+        raise RenderException('Bad html of', template_name, e)
 
-    of.close()
+    return save_table(template_name, rows[:-1], output_directory)
 
 
-def extract_and_render(dump_file, output_directory, address, save_html=False):
+"""
+Разворачиватели шаблонов процесса-обработчика при рендере без обращения
+к серверу по файлам страниц шаблонов.
+
+Worker process templates expanders for offline rendering by templates'
+pages files.
+"""
+_expanders = {}
+
+def _get_expander(pages_file):
+    expander = _expanders.get(pages_file)
+    if expander is None:
+        with open(pages_file, 'r') as f:
+            expander = _expanders[pages_file] = rwe.wikitext.Expander(json.load(f))
+    return expander
+
+def _render_offline(expander, template_name, output_directory):
     """
-    Находит таблицы склонения и спряжения в дампе русского викисловаря, запрашивает их 
-    рендер у сервера и сохраняет их по файлам в упрощённом виде.
+    Разворачивает шаблон `template_name` из викитекста дампа и сохраняет его
+    таблицу в простом виде. Возвращает пару из хэша таблицы и описания ошибки.
 
-    Finds declension and conjugation tables in ruwiktionary dump, requests their render
-    from server and save in plain text form.
+    Expands `template_name` template from dump wikitext and saves its table
+    in plain text form. Returns pair of table hash and error description.
     """
+    try:
+        rows = rwe.wikitext.table_rows(expander.expand_page(template_name))
+        if not rows:
+            return None, 'no table'
 
-    if not os.path.isdir(output_directory):
-        if os.path.exists(output_directory): 
-            raise Exception('Tables directory "{}" exists but is not directory'.format(output_directory))
+        return save_table(template_name, rows, output_directory), None
+    except (rwe.wikitext.WikitextException, RecursionError) as e:
+        return None, str(e)
+    except Exception as e:
+        # a broken template must not stop the whole render
+        return None, '{}: {}'.format(type(e).__name__, e)
 
-        os.mkdir(output_directory)
+def _render_offline_chunk(pages_file, output_directory, template_names):
+    expander = _get_expander(pages_file)
+    return [_render_offline(expander, template_name, output_directory) for template_name in template_names]
 
-    print('Parsing wiktionary dump for templates, be patient')
-    template_names = rwe.pages.extract('Шаблон:(прич|сущ|гл|мест|прил|числ) ru', dump_file)
-    print('Templates extracted:', *template_names, sep='\n')
-
-    connection = http.client.HTTPConnection(address)
-#    connection = http.client.HTTPSConnection("proxy", 3128)
-#    connection.set_tunnel(address)
-    for template_name in template_names:
-        params = {
-            'action': 'render',
-            'title': template_name
-        }
-        print('Rendering html for', template_name)
-        connection.request('GET', '/w/index.php?{}'.format(urllib.parse.urlencode(params)))
-        r = connection.getresponse()
-        if r.status != 200:
-            print("Can't get", template_name, "template from wiktionary =\\")
-            continue
-
-        text = r.read().decode()
+def render_offline(templates, pages, output_directory, executor=None, chunk_size=16):
+    """
+    Разворачивает шаблоны `templates`, заданные парами (имя, номер ревизии),
+    из викитекста страниц шаблонов `pages` ('заголовок' -> 'текст') без
+    обращения к серверу, параллельно с помощью `executor` (по `chunk_size`
+    шаблонов на задачу), и сохраняет их таблицы в простом виде. Страницы
+    передаются обработчикам через временный файл в `output_directory` и
+    загружаются ими один раз на процесс.
+
+    Expands `templates` given as (name, revision id) pairs from templates'
+    `pages` wikitext ('title' -> 'text') without server requests, in parallel
+    with `executor` (`chunk_size` templates per task), and saves their tables
+    in plain text form. Pages are passed to workers through temporary file in
+    `output_directory` and are loaded by them once per process.
+    Already rendered templates are skipped according to manifest.
+    """
+    manifest, templates = _prepare_render(templates, output_directory)
+    if executor is None:
+        executor = rwe.parallel.SerialExecutor()
+
+    descriptor, pages_file = tempfile.mkstemp(prefix='.pages-', suffix='.json', dir=output_directory)
+    try:
+        with os.fdopen(descriptor, 'w') as f:
+            json.dump(pages, f, ensure_ascii=False)
+
+        template_names = rwe.parallel.chunks(map(operator.itemgetter(0), templates), chunk_size)
+        fn = functools.partial(_render_offline_chunk, pages_file, output_directory)
+        results = itertools.chain.from_iterable(rwe.parallel.imap(executor, fn, template_names))
+
+        for (template_name, revision), (digest, error) in zip(templates, results):
+            if error is not None:
+                print("Can't expand", template_name, "template:", error)
+            manifest.record(template_name, revision, digest, error)
+    finally:
+        os.remove(pages_file)
+
+    _finish_render(manifest)
+
+
+"""
+Регулярное выражение для заголовков страниц шаблонов таблиц склонения и спряжения.
+
+Regexp for titles of declension and conjugation table templates' pages.
+"""
+template_pattern = 'Шаблон:(прич|сущ|гл|мест|прил|числ) ru'
+
+"""
+Число одновременных запросов рендера шаблонов к серверу.
+
+Number of concurrent templates' render requests to server.
+"""
+default_render_jobs = 8
+
+
+def _collect_templates(pattern, with_texts, pages):
+    templates = []
+    for page in pages:
+        if pattern.match(page.title) or with_texts:
+            templates.append((page.title, page.revision, page.text if with_texts else None))
+
+    return templates
+
+class TemplatesConsumer(rwe.dump.Consumer):
+    """
+    Потребитель страниц дампа, собирающий имена и номера ревизий шаблонов
+    таблиц склонения и спряжения. Если нужен рендер без обращения к серверу
+    (`with_texts`), в `pages` также собираются тексты всех шаблонов.
+
+    Dump pages consumer collecting declension and conjugation templates'
+    names and revision ids. If offline render is required (`with_texts`),
+    texts of all templates are also collected into `pages`.
+    """
+
+    def __init__(self, with_texts=False):
+        self.pattern = re.compile(template_pattern)
+        self.handler = functools.partial(_collect_templates, self.pattern, with_texts)
+        if with_texts:
+            self.page_filters = [rwe.dump.PageFilter(re.compile(rwe.wikitext.template_namespace), ())]
+        else:
+            self.page_filters = [rwe.dump.PageFilter(self.pattern, ())]
+        self.templates = []
+        self.pages = {}
+
+    def consume(self, templates):
+        for title, revision, text in templates:
+            if text is not None:
+                self.pages[title] = text
+            if self.pattern.match(title):
+                self.templates.append((title, revision))
+
+    def finish(self):
+        return self.templates
+
+
+class ConnectionPool(object):
+    """
+    Набор постоянных соединений с сервером `address`, по одному на поток.
+
+    Set of keep-alive connections to `address` server, one per thread.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = http.client.HTTPConnection(self.address)
+#            connection = http.client.HTTPSConnection("proxy", 3128)
+#            connection.set_tunnel(self.address)
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+
+        return connection
+
+    def get(self, url):
+        """
+        Запрашивает `url` и возвращает код и тело ответа. Разорванное
+        сервером соединение один раз переоткрывается.
+
+        Requests `url` and returns response status and body. Connection
+        closed by server is reopened once.
+        """
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request('GET', url)
+                r = connection.getresponse()
+                return r.status, r.read()
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                self._local.connection = None
+                if attempt > 0:
+                    raise
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+
+
+def _cache_file(cache_directory, template_name, revision):
+    key = hashlib.sha1('{}\n{}'.format(template_name, revision).encode()).hexdigest()
+    return os.path.join(cache_directory, key[:2], key + '.html')
+
+def fetch_template(pool, template_name, revision=None, cache_directory=None):
+    """
+    Возвращает html рендер шаблона `template_name`, запрашивая его у сервера
+    через `pool`, только если его нет в кэше `cache_directory` для ревизии
+    `revision`. Рендеры шаблонов с неизвестной ревизией не кэшируются.
+    Возвращает None, если сервер не смог отрендерить шаблон.
+
+    Returns html render of `template_name` template, requesting it from server
+    through `pool` only if there is none in `cache_directory` for `revision`.
+    Renders of templates with unknown revision are not cached.
+    Returns None if server failed to render template.
+    """
+    cache_file = None
+    if cache_directory is not None and revision is not None:
+        cache_file = _cache_file(cache_directory, template_name, revision)
+        if os.path.exists(cache_file):
+            with open(cache_file, 'r') as f:
+                return f.read()
+
+    params = {
+        'action': 'render',
+        'title': template_name
+    }
+    status, body = pool.get('/w/index.php?{}'.format(urllib.parse.urlencode(params)))
+    if status != 200:
+        return
+
+    text = body.decode()
+
+    if cache_file is not None:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(cache_file + '.tmp', 'w') as f:
+            f.write(text)
+        os.replace(cache_file + '.tmp', cache_file)
+
+    return text
+
+def _render_template(pool, template, output_directory, save_html, cache_directory, manifest):
+    template_name, revision = template
+
+    print('Rendering html for', template_name)
+    try:
+        text = fetch_template(pool, template_name, revision, cache_directory)
+        if text is None:
+            raise RenderException("Can't get", template_name, "template from wiktionary =\\")
 
         if save_html:
-            with open(os.path.join(output_directory, template_name.replace('Шаблон:', '').replace('/', '%') + '.html'), 'w') as f:
+            with open(_table_file(template_name, output_directory, '.html'), 'w') as f:
                 print(text, file=f)
 
-        render(template_name, text, output_directory)
+        digest = render(template_name, text, output_directory)
+    except (RenderException, http.client.HTTPException, OSError) as e:
+        print(e)
+        manifest.record(template_name, revision, error=str(e))
+        return
+
+    manifest.record(template_name, revision, digest)
+
+
+def render_templates(templates, output_directory, address, save_html=False, cache_directory=None, jobs=default_render_jobs):
+    """
+    Запрашивает у сервера рендер шаблонов `templates`, заданных парами
+    (имя, номер ревизии), не более чем `jobs` запросами одновременно,
+    и сохраняет их по файлам в упрощённом виде. Полученный html кэшируется
+    в `cache_directory`, так что повторный запуск обходится без сети.
+
+    Requests render of `templates` given as (name, revision id) pairs from
+    server with at most `jobs` concurrent requests and saves them in plain
+    text form. Received html is cached in `cache_directory`, so rerun does
+    without network. Already rendered templates are skipped according to
+    manifest, failures are recorded there and do not stop rendering.
+    """
+    manifest, templates = _prepare_render(templates, output_directory)
+
+    pool = ConnectionPool(address)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(_render_template, pool, template, output_directory, save_html, cache_directory, manifest) for template in templates]
+            for future in futures:
+                future.result()
+    finally:
+        pool.close()
+
+    _finish_render(manifest)
+
+
+def extract_and_render(dump_file, output_directory, address, save_html=False, executor=None, index_file=None, cache_directory=None, render_jobs=default_render_jobs, offline=False):
+    """
+    Находит таблицы склонения и спряжения в дампе русского викисловаря, запрашивает их 
+    рендер у сервера (не более `render_jobs` запросов одновременно) или, если `offline`,
+    разворачивает их сам с помощью `executor`, и сохраняет их по файлам
+    в упрощённом виде. Сжатый дамп читается с помощью индекса `index_file`.
+
+    Finds declension and conjugation tables in ruwiktionary dump, requests their render
+    from server (at most `render_jobs` requests at once) or, if `offline`, expands them
+    by itself with `executor`, and save in plain text form.
+    Compressed dump is read using `index_file`.
+    """
+    print('Parsing wiktionary dump for templates, be patient')
+    consumer = TemplatesConsumer(offline)
+    templates, = rwe.dump.dispatch([consumer], dump_file, index_file, executor)
+    print('Templates extracted:', *map(operator.itemgetter(0), templates), sep='\n')
 
-    connection.close()
+    if offline:
+        render_offline(templates, consumer.pages, output_directory, executor)
+    else:
+        render_templates(templates, output_directory, address, save_html, cache_directory, render_jobs)
 
 
 def main(args):
-    extract_and_render(args.dump_file, args.output_directory, args.address, args.save_html)
+    executor = rwe.parallel.create_executor(args.backend, args.jobs, args.max_pending)
+    extract_and_render(args.dump_file, args.tables_directory, args.address, args.save_html, executor, args.dump_index, args.render_cache, args.render_jobs, args.offline)
+    executor.shutdown()
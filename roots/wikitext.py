@@ -0,0 +1,547 @@
+"""
+Упрощённый разворот шаблонов MediaWiki без обращения к серверу. Поддерживаются
+параметры шаблонов со значениями по умолчанию, включение других шаблонов,
+распространённые функции парсера (#if, #ifeq, #switch, #expr и др.) и теги
+<noinclude>, <includeonly>, <onlyinclude>. Lua модули (#invoke) не поддерживаются.
+
+Simplified offline MediaWiki templates expansion. Supported are templates'
+parameters with default values, transclusion of other templates, common parser
+functions (#if, #ifeq, #switch, #expr etc.) and <noinclude>, <includeonly>,
+<onlyinclude> tags. Lua modules (#invoke) are not supported.
+"""
+
+import ast
+import collections
+import math
+import operator
+import re
+
+import logging
+logger = logging.getLogger(__name__)
+
+from rwe.exception import ExtractException
+class WikitextException(ExtractException): pass
+
+
+"""
+Пространство имён шаблонов русского викисловаря.
+
+Templates namespace of ruwiktionary.
+"""
+template_namespace = 'Шаблон:'
+
+"""
+Наибольшая глубина вложенности включений шаблонов.
+
+Maximum depth of templates' transclusions.
+"""
+max_depth = 40
+
+
+Template = collections.namedtuple('Template', ['parts'])
+Argument = collections.namedtuple('Argument', ['parts'])
+Link = collections.namedtuple('Link', ['nodes'])
+
+
+def _parse(text, pos, closing):
+    """
+    Разбирает `text` начиная с `pos` до закрывающей последовательности `closing`
+    ('}}' для шаблона, '}}}' для параметра, ']]' для ссылки или None - до конца).
+    Возвращает список частей, разделённых '|' (только для шаблонов и параметров),
+    каждая из которых - список узлов, и позицию после `closing`, либо None,
+    если `closing` так и не встретилась.
+
+    Parses `text` from `pos` till `closing` sequence ('}}' for template, '}}}'
+    for parameter, ']]' for link or None - till the end). Returns list of '|'
+    separated parts (only for templates and parameters), each of them is list
+    of nodes, and position after `closing`, or None if `closing` is never met.
+    """
+    split = closing in ('}}', '}}}')
+    parts = [[]]
+    nodes = parts[0]
+    start = pos
+
+    def flush(end):
+        if end > start:
+            nodes.append(text[start:end])
+
+    while pos < len(text):
+        if closing is not None and text.startswith(closing, pos):
+            flush(pos)
+            return parts, pos + len(closing)
+
+        if text.startswith('{{', pos):
+            flush(pos)
+            node = None
+            if text.startswith('{{{', pos):
+                parsed = _parse(text, pos + 3, '}}}')
+                if parsed is not None:
+                    node = Argument(parsed[0])
+            if node is None:
+                parsed = _parse(text, pos + 2, '}}')
+                if parsed is not None:
+                    node = Template(parsed[0])
+
+            if node is None:
+                start = pos
+                pos += 1
+                continue
+
+            nodes.append(node)
+            pos = start = parsed[1]
+            continue
+
+        if text.startswith('[[', pos):
+            flush(pos)
+            parsed = _parse(text, pos + 2, ']]')
+            if parsed is None:
+                start = pos
+                pos += 2
+                continue
+
+            nodes.append(Link(parsed[0][0]))
+            pos = start = parsed[1]
+            continue
+
+        if split and text[pos] == '|':
+            flush(pos)
+            nodes = []
+            parts.append(nodes)
+            pos = start = pos + 1
+            continue
+
+        pos += 1
+
+    if closing is not None:
+        return
+
+    flush(pos)
+    return parts, pos
+
+
+def parse(text):
+    """
+    Разбирает викитекст `text` в список узлов: строк, шаблонов, параметров и ссылок.
+
+    Parses `text` wikitext into list of nodes: strings, templates, parameters and links.
+    """
+    return _parse(text, 0, None)[0][0]
+
+
+_comment = re.compile('<!--.*?(-->|$)', re.S)
+
+def preprocess(text, transcluded):
+    """
+    Удаляет комментарии и обрабатывает теги <noinclude>, <includeonly> и
+    <onlyinclude> в зависимости от того, включается ли страница `transcluded`
+    в другую или показывается сама по себе.
+
+    Removes comments and handles <noinclude>, <includeonly> and <onlyinclude>
+    tags depending on whether page is `transcluded` into another one or
+    is shown by itself.
+    """
+    text = _comment.sub('', text)
+    if transcluded:
+        onlyinclude = re.findall('<onlyinclude>(.*?)</onlyinclude>', text, re.S)
+        if onlyinclude:
+            text = ''.join(onlyinclude)
+        text = re.sub('<noinclude>.*?(</noinclude>|$)', '', text, flags=re.S)
+        text = re.sub('</?includeonly>', '', text)
+    else:
+        text = re.sub('<includeonly>.*?(</includeonly>|$)', '', text, flags=re.S)
+        text = re.sub('</?(noinclude|onlyinclude)>', '', text)
+
+    return text
+
+
+def _split_named(part):
+    """
+    Разделяет часть вызова шаблона `part` на имя и значение по первому '='
+    верхнего уровня. Возвращает (None, part) для неименованных частей.
+
+    Splits template call `part` into name and value at first top level '='.
+    Returns (None, part) for unnamed parts.
+    """
+    for i, node in enumerate(part):
+        if type(node) == str and '=' in node:
+            split_index = node.index('=')
+            name = part[:i] + [node[:split_index]]
+            value = [node[split_index + 1:]] + part[i + 1:]
+            return name, value
+
+    return None, part
+
+
+class _Frame(object):
+    """
+    Контекст разворота шаблона: заголовок страницы, аргументы вызова
+    (ещё не развёрнутые) и вызвавший контекст.
+
+    Template expansion context: page title, not yet expanded call arguments
+    and calling context.
+    """
+
+    def __init__(self, expander, title, arguments=None, parent=None):
+        self.expander = expander
+        self.title = title
+        self.arguments = arguments or {}
+        self.parent = parent
+        self.depth = 0 if parent is None else parent.depth + 1
+        self.page_title = title if parent is None else parent.page_title
+        self._expanded = {}
+
+    def argument(self, name):
+        if name not in self._expanded:
+            if name not in self.arguments:
+                return
+            nodes, strip = self.arguments[name]
+            value = self.parent.expander.expand(nodes, self.parent)
+            self._expanded[name] = value.strip() if strip else value
+
+        return self._expanded[name]
+
+
+def _number(s):
+    try:
+        return float(s)
+    except ValueError:
+        return
+
+
+def _power(base, exponent):
+    # computed in doubles as MediaWiki does, so huge powers overflow instead of hanging
+    try:
+        return math.pow(base, exponent)
+    except OverflowError:
+        raise ValueError('Power overflow: {}^{}'.format(base, exponent))
+
+_expr_operators = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+    ast.Div: operator.truediv, ast.Mod: operator.mod, ast.Pow: _power,
+    ast.USub: operator.neg, ast.UAdd: operator.pos, ast.Not: operator.not_,
+    ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt,
+    ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge,
+}
+
+def _evaluate(node):
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return node.value
+    if isinstance(node, ast.BinOp) and type(node.op) in _expr_operators:
+        return _expr_operators[type(node.op)](_evaluate(node.left), _evaluate(node.right))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _expr_operators:
+        return _expr_operators[type(node.op)](_evaluate(node.operand))
+    if isinstance(node, ast.BoolOp):
+        values = [_evaluate(value) for value in node.values]
+        return all(values) if isinstance(node.op, ast.And) else any(values)
+    if isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in _expr_operators:
+        return _expr_operators[type(node.ops[0])](_evaluate(node.left), _evaluate(node.comparators[0]))
+
+    raise ValueError(node)
+
+def evaluate_expression(expression):
+    """
+    Вычисляет арифметическое выражение в синтаксисе функции парсера #expr.
+
+    Evaluates arithmetic expression in #expr parser function syntax.
+    """
+    if '**' in expression:
+        raise ValueError('Unexpected ** operator: {}'.format(expression))
+    expression = expression.replace('^', '**')
+    expression = re.sub(r'\bmod\b', '%', expression)
+    expression = re.sub(r'\bdiv\b', '/', expression)
+    expression = expression.replace('<>', '!=')
+    expression = re.sub('(?<![<>!=])=(?!=)', '==', expression)
+
+    result = _evaluate(ast.parse(expression.strip() or '0', mode='eval'))
+    if type(result) == bool:
+        result = int(result)
+    if type(result) == float and result.is_integer():
+        result = int(result)
+
+    return str(result)
+
+
+class Expander(object):
+    """
+    Разворачивает шаблоны, тексты которых (в виде словаря 'заголовок страницы' ->
+    'викитекст') переданы в `pages`.
+
+    Expands templates with texts given in `pages` as 'page title' -> 'wikitext' dict.
+    """
+
+    def __init__(self, pages):
+        self.pages = pages
+        self._parsed = {}
+
+    def _parsed_page(self, title, transcluded):
+        key = (title, transcluded)
+        if key not in self._parsed:
+            self._parsed[key] = parse(preprocess(self.pages[title], transcluded))
+
+        return self._parsed[key]
+
+    def expand_page(self, title):
+        """
+        Разворачивает страницу `title` так, как она выглядит сама по себе:
+        параметры без значений по умолчанию остаются в виде {{{имя}}}.
+
+        Expands `title` page as it looks by itself: parameters without
+        default values are left as {{{name}}}.
+        """
+        return self.expand(self._parsed_page(title, False), _Frame(self, title))
+
+    def expand(self, nodes, frame):
+        result = []
+        for node in nodes:
+            if type(node) == str:
+                result.append(node)
+            elif type(node) == Argument:
+                result.append(self._expand_argument(node, frame))
+            elif type(node) == Template:
+                result.append(self._expand_template(node, frame))
+            else:
+                result.append('[[' + self.expand(node.nodes, frame) + ']]')
+
+        return ''.join(result)
+
+    def _expand_argument(self, node, frame):
+        name = self.expand(node.parts[0], frame).strip()
+        value = frame.argument(name)
+        if value is not None:
+            return value
+
+        if len(node.parts) > 1:
+            return self.expand(node.parts[1], frame)
+
+        return '{{{' + name + '}}}'
+
+    def _expand_template(self, node, frame):
+        if frame.depth >= max_depth:
+            raise WikitextException('Too deep transclusion', frame.title)
+
+        name = self.expand(node.parts[0], frame).strip()
+        arguments = node.parts[1:]
+
+        function_name, colon, first = name.partition(':')
+        function = _functions.get(function_name.strip().lower()) if colon else None
+        if function is not None:
+            return function(self, frame, first.strip(), arguments)
+
+        if name in _variables:
+            return _variables[name](frame)
+
+        name = re.sub('[ _]+', ' ', name)
+        if name.startswith(':'):
+            title = name[1:]
+        elif name.startswith(template_namespace):
+            title = name
+        else:
+            title = template_namespace + name
+
+        if title not in self.pages:
+            return '[[' + title + ']]'
+
+        call_arguments = {}
+        position = 1
+        for part in arguments:
+            argument_name, value = _split_named(part)
+            if argument_name is None:
+                call_arguments[str(position)] = (value, False)
+                position += 1
+            else:
+                call_arguments[self.expand(argument_name, frame).strip()] = (value, True)
+
+        return self.expand(self._parsed_page(title, True), _Frame(self, title, call_arguments, frame))
+
+
+def _argument(expander, frame, arguments, i):
+    if i < len(arguments):
+        return expander.expand(arguments[i], frame).strip()
+    return ''
+
+def _equal(a, b):
+    a_number, b_number = _number(a), _number(b)
+    if a_number is not None and b_number is not None:
+        return a_number == b_number
+    return a == b
+
+def _if(expander, frame, first, arguments):
+    return _argument(expander, frame, arguments, 0 if first else 1)
+
+def _ifeq(expander, frame, first, arguments):
+    second = _argument(expander, frame, arguments, 0)
+    return _argument(expander, frame, arguments, 1 if _equal(first, second) else 2)
+
+def _iferror(expander, frame, first, arguments):
+    if 'class="error"' in first:
+        return _argument(expander, frame, arguments, 0)
+    if len(arguments) > 1:
+        return _argument(expander, frame, arguments, 1)
+    return first
+
+def _ifexist(expander, frame, first, arguments):
+    return _argument(expander, frame, arguments, 0 if first in expander.pages else 1)
+
+def _switch(expander, frame, first, arguments):
+    default = None
+    fall_through = False
+    for i, part in enumerate(arguments):
+        name, value = _split_named(part)
+        if name is None:
+            case = expander.expand(value, frame).strip()
+            if _equal(case, first):
+                fall_through = True
+            elif i == len(arguments) - 1:
+                default = value
+            continue
+
+        case = expander.expand(name, frame).strip()
+        if fall_through or _equal(case, first):
+            return expander.expand(value, frame).strip()
+        if case == '#default':
+            default = value
+
+    if default is None:
+        return ''
+    return expander.expand(default, frame).strip()
+
+def _expr(expander, frame, first, arguments):
+    try:
+        return evaluate_expression(first)
+    except (ValueError, SyntaxError, TypeError, ZeroDivisionError):
+        return '<strong class="error">Expression error: {}</strong>'.format(first)
+
+def _ifexpr(expander, frame, first, arguments):
+    try:
+        value = evaluate_expression(first)
+    except (ValueError, SyntaxError, TypeError, ZeroDivisionError):
+        return '<strong class="error">Expression error: {}</strong>'.format(first)
+    return _argument(expander, frame, arguments, 0 if _number(value) else 1)
+
+def _pad(left):
+    def pad(expander, frame, first, arguments):
+        length = _number(_argument(expander, frame, arguments, 0)) or 0
+        padding = _argument(expander, frame, arguments, 1) or '0'
+        missing = int(length) - len(first)
+        if missing <= 0:
+            return first
+        padding = (padding * missing)[:missing]
+        return padding + first if left else first + padding
+    return pad
+
+def _invoke(expander, frame, first, arguments):
+    raise WikitextException('Lua modules are not supported', frame.title, first)
+
+_functions = {
+    '#if': _if,
+    '#ifeq': _ifeq,
+    '#iferror': _iferror,
+    '#ifexist': _ifexist,
+    '#ifexpr': _ifexpr,
+    '#switch': _switch,
+    '#expr': _expr,
+    '#invoke': _invoke,
+    'lc': lambda expander, frame, first, arguments: first.lower(),
+    'uc': lambda expander, frame, first, arguments: first.upper(),
+    'lcfirst': lambda expander, frame, first, arguments: first[:1].lower() + first[1:],
+    'ucfirst': lambda expander, frame, first, arguments: first[:1].upper() + first[1:],
+    'padleft': _pad(True),
+    'padright': _pad(False),
+}
+
+_variables = {
+    '!': lambda frame: '|',
+    '=': lambda frame: '=',
+    'PAGENAME': lambda frame: frame.page_title.partition(':')[2] or frame.page_title,
+    'FULLPAGENAME': lambda frame: frame.page_title,
+    'NAMESPACE': lambda frame: frame.page_title.partition(':')[0] if ':' in frame.page_title else '',
+}
+
+
+_table_row = re.compile(r'^\s*\|-')
+_link = re.compile(r'\[\[(?:[^|\]]*\|)?([^\]]*)\]\]')
+
+def _cell_text(cell):
+    """
+    Извлекает текст ячейки таблицы так же, как это делает разбор html рендера:
+    берётся текст до первого тега или, если его нет, текст первой ссылки.
+
+    Extracts table cell text same way as html render parsing does: text before
+    first tag is taken or, if there is none, first link text.
+    """
+    attributes_end = None
+    depth = 0
+    for i, c in enumerate(cell):
+        if c in '[{':
+            depth += 1
+        elif c in ']}':
+            depth -= 1
+        elif c == '|' and depth == 0:
+            attributes_end = i
+            break
+    if attributes_end is not None:
+        cell = cell[attributes_end + 1:]
+
+    cell = re.sub("'''?", '<b>', cell)
+    first_link = _link.search(cell)
+    cell = _link.sub('<a>', cell)
+
+    text = re.split('<[^>]*>', cell, 1)[0]
+    if text == '' and cell.startswith('<a>') and first_link is not None:
+        text = first_link.group(1)
+    if text == '':
+        return
+
+    return text
+
+def table_rows(wikitext):
+    """
+    Возвращает строки (списки текстов ячеек) таблицы склонения/спряжения из
+    развёрнутого викитекста: таблицы, плавающей справа, либо первой таблицы.
+
+    Returns rows (lists of cells' texts) of declension/conjugation table from
+    expanded wikitext: table floating right or the first table.
+    """
+    tables = []
+    depth = 0
+    for line in wikitext.split('\n'):
+        stripped = line.strip()
+        if stripped.startswith('{|'):
+            depth += 1
+            if depth == 1:
+                tables.append((stripped[2:], []))
+            continue
+        if depth == 0:
+            continue
+        if stripped.startswith('|}'):
+            depth -= 1
+            continue
+        if depth > 1:
+            continue
+
+        rows = tables[-1][1]
+        if _table_row.match(line):
+            rows.append([])
+        elif stripped.startswith('|+'):
+            continue
+        elif stripped.startswith('!') or stripped.startswith('|'):
+            if not rows:
+                rows.append([])
+            separator = '!!' if stripped.startswith('!') else '||'
+            cells = stripped[1:].replace('||', separator).split(separator)
+            rows[-1].extend(cells)
+        elif rows and rows[-1]:
+            rows[-1][-1] += '\n' + line
+
+    if not tables:
+        return
+
+    rows = tables[0][1]
+    for attributes, table in tables:
+        if re.search('float *: *right', attributes):
+            rows = table
+            break
+
+    return [[text for text in map(_cell_text, row) if text is not None] for row in rows]
@@ -0,0 +1,14 @@
+"""
+Пакет лежит в каталоге roots, но импортируется как rwe: без установки
+делаем его доступным под этим именем.
+
+Package lives in roots directory but is imported as rwe: make it available
+under this name without installation.
+"""
+
+import os
+import sys
+import importlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.modules.setdefault('rwe', importlib.import_module('roots'))
@@ -0,0 +1,47 @@
+import io
+
+import pytest
+
+from rwe.segmentations import binary
+from rwe.segmentations.segmentation import Segmentation
+
+
+lines = [
+    'корень_мам оконч_а',
+    'корень_мам оконч_ы',
+    'корень_мам оконч_',
+    'прист_по корень_д оконч_ать',
+    'корень_мам оконч_а',
+]
+
+def _write(blocks, compression_level):
+    stream = io.BytesIO()
+    writer = binary.BinaryWriter(stream, compression_level)
+    for block in blocks:
+        writer.write(block)
+    writer.close()
+    return stream.getvalue()
+
+@pytest.mark.parametrize('compression_level', [0, binary.default_compression_level])
+def test_round_trip(compression_level):
+    data = _write([lines[:2], [], lines[2:]], compression_level)
+
+    assert list(binary.read_lines(io.BytesIO(data))) == lines
+    assert list(binary.read_line_blocks(io.BytesIO(data))) == [lines[:2], [], lines[2:]]
+    assert [str(segmentation) for segmentation in binary.read_segmentations(io.BytesIO(data))] == lines
+
+def test_segmentation_objects():
+    segmentations = [Segmentation.parse(line) for line in lines]
+    data = _write([segmentations], 0)
+    assert list(binary.read_segmentations(io.BytesIO(data))) == segmentations
+
+def test_convert_to_text():
+    output = io.StringIO()
+    binary.convert_to_text(io.BytesIO(_write([lines[:2], [], lines[2:]], 1)), output)
+    assert output.getvalue() == ''.join(line + '\n' for line in lines)
+
+def test_bad_files():
+    with pytest.raises(ValueError):
+        list(binary.read_lines(io.BytesIO('корень_мам оконч_а\n'.encode())))
+    with pytest.raises(ValueError):
+        list(binary.read_lines(io.BytesIO(_write([lines], 1)[:-3])))
@@ -0,0 +1,50 @@
+import argparse
+
+import pytest
+
+from rwe.segmentations import conll
+
+
+def test_transform():
+    lines = ['корень_мам оконч_а', 'прист_по корень_д оконч_']
+    assert conll.transform(lines) == (
+        'м корень_начало\n'
+        'а корень\n'
+        'м корень\n'
+        'а оконч_начало\n'
+        '\n'
+        'п прист_начало\n'
+        'о прист\n'
+        'д корень_начало\n'
+        '\n'
+    )
+
+def test_transform_empty():
+    assert conll.transform([]) == ''
+
+def test_shards_do_not_depend_on_chunking():
+    lines = ['корень_слов{} оконч_о'.format(i) for i in range(200)]
+    bounds = conll._bounds([8, 1, 1])
+
+    whole = conll._transform_chunk(bounds, lines)
+    chunked = [conll._transform_chunk(bounds, lines[i:i + 7]) for i in range(0, len(lines), 7)]
+    assert [''.join(shard) for shard in zip(*chunked)] == whole
+    assert ''.join(whole).count('\n\n') == len(lines)
+    assert all(whole)
+
+def test_forms_of_word_share_shard():
+    bounds = conll._bounds([1, 1, 1])
+    words = [['прист_по корень_{}ал оконч_{}'.format(chr(ord('а') + i), ending) for ending in ('', 'а', 'ом', 'ами')] for i in range(32)]
+    for forms in words:
+        assert conll.word_key(forms[0]) == conll.word_key(forms[-1])
+        assert len({conll.shard_of(form, bounds) for form in forms}) == 1
+    assert len({conll.shard_of(forms[0], bounds) for forms in words}) == 3
+
+    assert conll.word_key('суфф_к оконч_а') == 'суфф_к оконч_а'
+
+def test_shard_fractions():
+    assert conll.shard_fractions('0.8,0.1,0.1') == [0.8, 0.1, 0.1]
+    assert conll.shard_fractions('9,1') == [9, 1]
+    for string in ('1', '1,2,3,4', '1,x', '1,0', '1,-1', '1,nan', '1,inf'):
+        with pytest.raises(argparse.ArgumentTypeError):
+            conll.shard_fractions(string)
@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+from rwe.dedupe import Deduplicator
+
+
+def _run(deduplicator, lines, batch=3):
+    out = []
+    for i in range(0, len(lines), batch):
+        out.extend(deduplicator.feed(lines[i:i + batch]))
+    out.extend(deduplicator.finish())
+    return out
+
+def test_in_memory_keeps_order():
+    lines = ['в', 'а', 'б', 'а', 'в', 'г', 'б']
+    deduplicator = Deduplicator(max_entries=100)
+    assert _run(deduplicator, lines) == ['в', 'а', 'б', 'г']
+    assert (deduplicator.total, deduplicator.unique) == (7, 4)
+    assert deduplicator.duplicates_ratio() == pytest.approx(3 / 7)
+
+@pytest.mark.parametrize('max_entries', [1, 2, 5, 17])
+def test_spilled_emits_every_line_once(tmp_path, max_entries):
+    lines = ['строка {}'.format(i * 7 % 23) for i in range(100)]
+    deduplicator = Deduplicator(max_entries, str(tmp_path))
+    out = _run(deduplicator, lines)
+
+    assert sorted(out) == sorted(set(lines))
+    assert deduplicator.unique == len(set(lines))
+    assert deduplicator.total == len(lines)
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,83 @@
+import io
+import os
+
+import pytest
+
+from rwe.segmentations import binary, index
+
+
+segmentations = [
+    'корень_мам оконч_а',
+    'корень_мам оконч_ы',
+    'корень_ден оконч_',
+    'корень_бра оконч_ть',
+    'корень_брат оконч_',
+    'корень_мам оконч_а',
+]
+
+@pytest.fixture
+def index_file(tmp_path):
+    index_file = str(tmp_path / 'segmentations.idx')
+    assert index.build_index(segmentations, index_file) == len(set(segmentations))
+    return index_file
+
+def test_lookup(index_file):
+    with index.SegmentationIndex(index_file) as idx:
+        assert len(idx) == 5
+        assert idx.lookup('мама') == ['корень_мам оконч_а']
+        assert idx.lookup('день') == ['корень_ден оконч_']
+        assert idx.lookup('ден') == ['корень_ден оконч_']
+        assert idx.lookup('брать') == ['корень_бра оконч_ть', 'корень_брат оконч_']
+        assert idx.lookup('брат') == ['корень_брат оконч_']
+        assert idx.lookup('папа') == []
+        assert idx.lookup('') == []
+
+def test_prefix(index_file):
+    with index.SegmentationIndex(index_file) as idx:
+        assert idx.prefix('ма') == [('мама', 'корень_мам оконч_а'), ('мамы', 'корень_мам оконч_ы')]
+        assert idx.prefix('ма', 1) == [('мама', 'корень_мам оконч_а')]
+        assert idx.prefix('бра') == [('брать', 'корень_бра оконч_ть'), ('брат', 'корень_брат оконч_')]
+        assert [form for form, _ in idx.prefix('')] == ['брать', 'брат', 'ден', 'мама', 'мамы']
+        assert idx.prefix('я') == []
+
+def test_fits():
+    assert index.fits('день', 'ден')
+    assert index.fits('подъезд', 'подъезд')
+    assert index.fits('подъезд', 'подезд')
+    assert not index.fits('брат', 'брать')
+    assert not index.fits('дени', 'ден')
+
+def test_not_index(tmp_path):
+    text_file = tmp_path / 'segmentations.txt'
+    text_file.write_text('корень_мам оконч_а\n')
+    with pytest.raises(ValueError):
+        index.SegmentationIndex(str(text_file))
+
+@pytest.mark.parametrize('output_format', ['text', 'binary'])
+def test_ensure_index(tmp_path, output_format):
+    segmentations_file = str(tmp_path / 'segmentations')
+    if output_format == 'binary':
+        with open(segmentations_file, 'wb') as f:
+            writer = binary.BinaryWriter(f)
+            writer.write(segmentations)
+            writer.close()
+    else:
+        with open(segmentations_file, 'w') as f:
+            f.write('\n'.join(segmentations) + '\n')
+
+    index_file = index.ensure_index(segmentations_file)
+    assert index_file == segmentations_file + '.idx'
+    assert index.ensure_index(index_file) == index_file
+    with index.SegmentationIndex(index_file) as idx:
+        assert len(idx) == 5
+        assert idx.lookup('мамы') == ['корень_мам оконч_ы']
+
+def test_ensure_index_rebuilds_stale(tmp_path):
+    segmentations_file = str(tmp_path / 'segmentations')
+    with open(segmentations_file, 'w') as f:
+        f.write('корень_ден оконч_\n')
+    with open(segmentations_file + '.idx', 'wb') as f:
+        f.write(b'RWEIDX1\n')
+
+    with index.SegmentationIndex(index.ensure_index(segmentations_file)) as idx:
+        assert idx.lookup('день') == ['корень_ден оконч_']
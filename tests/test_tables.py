@@ -0,0 +1,251 @@
+import os
+import html
+import json
+import time
+import threading
+import urllib.parse
+import http.server
+
+import pytest
+
+import rwe.parallel
+import rwe.tables
+
+
+tables = {
+    'Шаблон:сущ ru f a': [['падеж', 'ед. ч.', 'мн. ч.'], ['Им.', 'мама', 'мамы']],
+    'Шаблон:сущ ru m a': [['падеж', 'ед. ч.', 'мн. ч.'], ['Им.', 'папа', 'папы']],
+    'Шаблон:гл ru 1a': [['лицо', 'наст.', 'прош.'], ['Я', 'читаю', 'читал']],
+    'Шаблон:прил ru 1a': [['падеж', 'м. р.', 'ж. р.'], ['Им.', 'новый', 'новая']],
+    'Шаблон:сущ ru n a': [['падеж', 'ед. ч.'], ['Им.', 'окно']],
+    'Шаблон:гл ru 2a': [['лицо', 'наст.'], ['Я', 'рисую']],
+}
+
+
+class StubMediaWiki(http.server.ThreadingHTTPServer):
+    """
+    Заглушка сервера MediaWiki: отвечает на action=render таблицами из
+    `tables`, считает запросы, соединения и одновременные запросы.
+
+    MediaWiki server stub: answers action=render with tables from `tables`,
+    counts requests, connections and concurrent requests.
+    """
+    daemon_threads = True
+
+    def __init__(self, delay=0.05):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.delay = delay
+        self.requests = []
+        self.connections = set()
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    @property
+    def address(self):
+        return '{}:{}'.format(*self.server_address)
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        title = query['title'][0]
+        with server.lock:
+            server.requests.append(title)
+            server.connections.add(self.client_address)
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+
+        time.sleep(server.delay)
+
+        rows = tables.get(title)
+        if url.path != '/w/index.php' or query.get('action') != ['render'] or rows is None:
+            status, body = 404, 'no such page'
+        else:
+            status = 200
+            body = '<div><table style="float: right;">{}</table></div>'.format(''.join(
+                '<tr>' + ''.join('<td>{}</td>'.format(html.escape(cell)) for cell in row) + '</tr>' for row in rows))
+
+        with server.lock:
+            server.active -= 1
+
+        body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = StubMediaWiki()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _templates():
+    return [(name, revision) for revision, name in enumerate(sorted(tables), 100)]
+
+def _table_text(rows):
+    return ''.join(''.join(cell + ' | ' for cell in row) + '\n' for row in rows)
+
+def _read_table(output_directory, template_name):
+    with open(rwe.tables._table_file(template_name, output_directory), 'r') as f:
+        return f.read()
+
+def _manifest(output_directory):
+    with open(os.path.join(output_directory, rwe.tables.Manifest.file_name), 'r') as f:
+        return json.load(f)
+
+
+def test_render_templates(server, tmp_path):
+    output_directory = str(tmp_path / 'tables')
+    cache_directory = str(tmp_path / 'cache')
+    rwe.tables.render_templates(_templates(), output_directory, server.address, cache_directory=cache_directory, jobs=3)
+
+    for name, rows in tables.items():
+        assert _read_table(output_directory, name) == _table_text(rows)
+    assert sorted(server.requests) == sorted(tables)
+    assert 1 < server.max_active <= 3
+    # connections are kept alive and reused by pool's threads
+    assert len(server.connections) <= 3
+
+    manifest = _manifest(output_directory)
+    assert manifest['complete']
+    assert {name: entry['status'] for name, entry in manifest['templates'].items()} == dict.fromkeys(tables, 'ok')
+    assert rwe.tables.tables_complete(output_directory)
+
+def test_render_templates_rerun(server, tmp_path):
+    output_directory = str(tmp_path / 'tables')
+    cache_directory = str(tmp_path / 'cache')
+    templates = _templates()
+    rwe.tables.render_templates(templates, output_directory, server.address, cache_directory=cache_directory)
+    del server.requests[:]
+
+    # rendered tables are skipped by manifest
+    rwe.tables.render_templates(templates, output_directory, server.address, cache_directory=cache_directory)
+    assert server.requests == []
+
+    # changed revision is rendered again, fresh tables are rendered from cache
+    changed = templates[0][0]
+    templates[0] = (changed, 1)
+    rwe.tables.render_templates(templates, output_directory, server.address, cache_directory=cache_directory)
+    other_directory = str(tmp_path / 'other')
+    rwe.tables.render_templates(_templates(), other_directory, server.address, cache_directory=cache_directory)
+    assert server.requests == [changed]
+    for name, rows in tables.items():
+        assert _read_table(other_directory, name) == _table_text(rows)
+
+def test_render_templates_failures(server, tmp_path):
+    output_directory = str(tmp_path / 'tables')
+    templates = _templates() + [('Шаблон:сущ ru нет', 1)]
+    rwe.tables.render_templates(templates, output_directory, server.address, jobs=2)
+
+    manifest = _manifest(output_directory)
+    assert manifest['complete']
+    assert manifest['templates']['Шаблон:сущ ru нет']['status'] == 'failed'
+    assert sorted(name for name, entry in manifest['templates'].items() if entry['status'] == 'ok') == sorted(tables)
+
+    # failed templates are retried on rerun
+    del server.requests[:]
+    rwe.tables.render_templates(templates, output_directory, server.address, jobs=2)
+    assert server.requests == ['Шаблон:сущ ru нет']
+
+
+def _crash_after(monkeypatch, count):
+    """
+    Подменяет рендер так, что после `count` таблиц он падает, как при
+    прерывании процесса.
+
+    Patches render so that it crashes after `count` tables, as if process
+    was interrupted.
+    """
+    rendered = []
+    render = rwe.tables.render
+    def crashing(template_name, text, output_directory):
+        if len(rendered) >= count:
+            raise KeyboardInterrupt
+        rendered.append(template_name)
+        return render(template_name, text, output_directory)
+    monkeypatch.setattr(rwe.tables, 'render', crashing)
+    return rendered
+
+def test_render_templates_resume(server, tmp_path, monkeypatch):
+    output_directory = str(tmp_path / 'tables')
+    monkeypatch.setattr(rwe.tables.Manifest, 'checkpoint_interval', 1)
+    rendered = _crash_after(monkeypatch, 2)
+    with pytest.raises(KeyboardInterrupt):
+        rwe.tables.render_templates(_templates(), output_directory, server.address, jobs=1)
+
+    assert not rwe.tables.tables_complete(output_directory)
+    manifest = _manifest(output_directory)
+    assert not manifest['complete']
+    assert sorted(manifest['templates']) == sorted(rendered)
+
+    monkeypatch.undo()
+    del server.requests[:]
+    rwe.tables.render_templates(_templates(), output_directory, server.address, jobs=1)
+    assert sorted(server.requests) == sorted(set(tables) - set(rendered))
+    assert rwe.tables.tables_complete(output_directory)
+    for name, rows in tables.items():
+        assert _read_table(output_directory, name) == _table_text(rows)
+
+def test_render_templates_crash_before_checkpoint(server, tmp_path, monkeypatch):
+    output_directory = str(tmp_path / 'tables')
+    assert not rwe.tables.tables_complete(output_directory)
+
+    _crash_after(monkeypatch, 0)
+    with pytest.raises(KeyboardInterrupt):
+        rwe.tables.render_templates(_templates(), output_directory, server.address, jobs=1)
+    assert not rwe.tables.tables_complete(output_directory)
+
+    # crash while rendering changed templates of complete tables
+    monkeypatch.undo()
+    rwe.tables.render_templates(_templates(), output_directory, server.address)
+    assert rwe.tables.tables_complete(output_directory)
+
+    _crash_after(monkeypatch, 0)
+    templates = _templates()
+    templates[0] = (templates[0][0], 1)
+    with pytest.raises(KeyboardInterrupt):
+        rwe.tables.render_templates(templates, output_directory, server.address)
+    assert not rwe.tables.tables_complete(output_directory)
+
+
+pages = {
+    'Шаблон:сущ ru f a': '{| style="float:right;"\n|-\n! падеж !! ед. ч.\n|-\n| Им. || мама\n|}\n',
+    'Шаблон:сущ ru m a': '{{сущ ru основа|папа}}',
+    'Шаблон:сущ ru основа': '{| style="float:right;"\n|-\n| Им. || {{{1}}}\n|}\n',
+    'Шаблон:сущ ru n a': 'без таблицы',
+    # page without text breaks expansion with TypeError, not WikitextException
+    'Шаблон:гл ru 1a': '{{гл ru пусто}}',
+    'Шаблон:гл ru пусто': None,
+}
+
+@pytest.mark.parametrize('backend', rwe.parallel.backends)
+def test_render_offline(tmp_path, monkeypatch, backend):
+    output_directory = str(tmp_path / 'tables')
+    templates = [(name, 1) for name in sorted(pages) if name not in ('Шаблон:сущ ru основа', 'Шаблон:гл ru пусто')]
+    executor = rwe.parallel.create_executor(backend, 2)
+    try:
+        rwe.tables.render_offline(templates, pages, output_directory, executor, chunk_size=1)
+    finally:
+        executor.shutdown()
+
+    assert _read_table(output_directory, 'Шаблон:сущ ru f a') == _table_text([['падеж', 'ед. ч.'], ['Им.', 'мама']])
+    assert _read_table(output_directory, 'Шаблон:сущ ru m a') == _table_text([['Им.', 'папа']])
+
+    manifest = _manifest(output_directory)
+    assert manifest['complete']
+    statuses = {name: entry['status'] for name, entry in manifest['templates'].items()}
+    assert statuses == {'Шаблон:гл ru 1a': 'failed', 'Шаблон:сущ ru f a': 'ok', 'Шаблон:сущ ru m a': 'ok', 'Шаблон:сущ ru n a': 'failed'}
+    assert manifest['templates']['Шаблон:гл ru 1a']['error'].startswith('TypeError')
+    assert sorted(os.listdir(output_directory)) == sorted([rwe.tables.Manifest.file_name, 'сущ ru f a.table', 'сущ ru m a.table'])
@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+import rwe.parallel
+from rwe.segmentations import tables
+from rwe.segmentations.segmentation import Segmentation
+
+
+def _entry(name, endings, error=None):
+    return {'template': name, 'forms': [['{{{основа|{{{1}}}}}}', ending] for ending in endings], 'error': error}
+
+entries = {
+    'сущ ru f a 1a': _entry('сущ ru f a 1a', ['оконч_а', 'оконч_ы']),
+    'сущ ru m a 1a': _entry('сущ ru m a 1a', ['оконч_', 'оконч_а']),
+    'сущ ru n a 1a': _entry('сущ ru n a 1a', [], 'no endings'),
+}
+
+def _counting():
+    calls = []
+    def instantiate(entry):
+        calls.append(entry['template'])
+        return tables._instantiate_template(entry)
+    return calls, instantiate
+
+
+def test_lazy_instantiation():
+    calls, instantiate = _counting()
+    registry = tables.TemplateRegistry(entries, instantiate)
+
+    assert 'сущ ru f a 1a' in registry and 'нет' not in registry
+    assert len(registry) == 3
+    assert calls == []
+
+    plan = registry['сущ ru f a 1a']
+    assert plan == (('{{{основа}}}', '{{{1}}}', Segmentation.parse('оконч_а')), ('{{{основа}}}', '{{{1}}}', Segmentation.parse('оконч_ы')))
+    assert registry.get('сущ ru f a 1a') is plan
+    assert registry.get('нет') is None
+    for i in range(2):
+        with pytest.raises(tables.TableException):
+            registry.get('сущ ru n a 1a')
+    assert calls == ['сущ ru f a 1a', 'сущ ru n a 1a']
+    assert registry.failures() == {'сущ ru n a 1a': 'no endings'}
+
+@pytest.mark.parametrize('backend', ['serial', 'thread'])
+def test_warm_instantiates_once(backend):
+    calls, instantiate = _counting()
+    registry = tables.TemplateRegistry(entries, instantiate)
+    registry.get('сущ ru m a 1a')
+
+    executor = rwe.parallel.create_executor(backend, 2)
+    assert registry.warm(executor, chunk_size=1) == 1
+    executor.shutdown()
+
+    registry.get('сущ ru f a 1a')
+    assert sorted(calls) == sorted(entries)
+
+def test_warm_in_processes():
+    registry = tables.TemplateRegistry(entries)
+    executor = rwe.parallel.create_executor('process', 2)
+    assert registry.warm(executor, chunk_size=1) == 1
+    executor.shutdown()
+
+    assert registry._templates.keys() == entries.keys()
+    assert registry['сущ ru m a 1a'] == tables._instantiate_template(entries['сущ ru m a 1a'])
+    assert str(registry['сущ ru m a 1a'][0][2]) == 'оконч_'
+    assert registry.failures() == {'сущ ru n a 1a': 'no endings'}
+
+def test_get_template_registry(tmp_path):
+    with open(str(tmp_path / tables.compiled_file_name), 'w') as f:
+        json.dump({'tables': {name + '.table': entry for name, entry in entries.items()}}, f, ensure_ascii=False)
+
+    registry = tables.get_template_registry(str(tmp_path))
+    assert tables.get_template_registry(str(tmp_path)) is registry
+    assert 'сущ ru m a 1a' in registry and len(registry) == 3
@@ -0,0 +1,30 @@
+import pytest
+
+from rwe.wikitext import evaluate_expression
+
+
+@pytest.mark.parametrize('expression, result', [
+    ('1 + 2 * 3', '7'),
+    ('2 ^ 10', '1024'),
+    ('2 ^ 0.5 ^ 2', str(2 ** 0.25)),
+    ('7 mod 3', '1'),
+    ('7 div 2', '3.5'),
+    ('6 div 2', '3'),
+    ('2 = 2', '1'),
+    ('2 <> 2', '0'),
+    ('1 < 2 and 3 >= 3', '1'),
+    ('not 1', '0'),
+    ('', '0'),
+])
+def test_evaluate_expression(expression, result):
+    assert evaluate_expression(expression) == result
+
+@pytest.mark.parametrize('expression', [
+    '2 ** 3',
+    '10 ^ 10 ^ 10',
+    '__import__("os")',
+    'x + 1',
+])
+def test_evaluate_expression_rejects(expression):
+    with pytest.raises(ValueError):
+        evaluate_expression(expression)